@@ -1,19 +1,38 @@
 # Progetto_Stabile/agent.py
 import asyncio
 import base64
+import contextlib
 import json
 import logging
-import threading
+import signal
+import time
 
-import numpy as np
-import sounddevice as sd
 import websockets
 from websockets.exceptions import ConnectionClosed
 
 # Importa i nuovi moduli
 import config
-import spotify_tools
-import spotify_player_controls
+# Importare i moduli dei tool li registra nel registro (decoratore @tool)
+import spotify_tools  # noqa: F401
+import spotify_player_controls  # noqa: F401
+import metrics
+from audio_core import Capture, Playout, StreamDecoder
+from audio_process import AudioProcess
+from black_box import BlackBox
+from effect_scheduler import EffectScheduler, create_backend
+from format_negotiation import SUPPORTED_FORMATS, LinkEstimator, with_output_format
+from hibernation import Hibernation
+from log_setup import setup_logging
+from loop_watchdog import LoopWatchdog
+from narrative_store import NarrativeStore
+from playback_queue import playback_queue
+from playback_state import describe, playback_state
+from ritual_spotter import RitualSpotter, load_rituals
+from sampling_profiler import profiler
+from spotify_tools import target_device_name
+from spotify_watcher import spotify_watcher
+from tool_registry import registry as tool_registry
+from voice_lines import VoiceLineCache
 
 # --- CONFIGURAZIONE ---
 # Ora leggiamo la configurazione dal file config.py
@@ -27,102 +46,251 @@ API_INPUT_RATE = 16000
 TTS_OUTPUT_RATE = 24000
 
 # --- Parametri Tecnici ---
-WEBSOCKET_URL = (
-    f"wss://api.elevenlabs.io/v1/convai/conversation"
-    f"?agent_id={ELEVEN_AGENT_ID}"
-    f"&output_format=pcm_{TTS_OUTPUT_RATE}"
-    f"&enable_visemes=true"
-)
+def websocket_url(agent_id):
+    return (
+        f"wss://api.elevenlabs.io/v1/convai/conversation"
+        f"?agent_id={agent_id}"
+        f"&output_format=pcm_{TTS_OUTPUT_RATE}"
+        f"&enable_visemes=true"
+    )
+
+
+WEBSOCKET_URL = websocket_url(ELEVEN_AGENT_ID)
 RECONNECT_DELAY = 5
+# Blocchi del microfono letti dal processo audio isolato
+MIC_BLOCK_SAMPLES = API_INPUT_RATE // 20
+
+# --- Esecuzione concorrente dei tool ---
+MAX_CONCURRENT_TOOLS = 4
+# Corsie seriali e chiavi di fusione sono dichiarate sui tool stessi (@tool(lane=..., merge_key=...))
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)-15s - %(levelname)-8s - %(message)s')
+setup_logging()
 logger = logging.getLogger("Agent")
 
 
-class AudioPlayer:
-    # ... (Classe AudioPlayer invariata) ...
-    def __init__(self):
-        self._queue = asyncio.Queue()
-        self._play_task = None
-        self.stop_event = threading.Event()
+class AudioPlayer(Playout):
+    """La voce del Capitano: il playout comune più gli effetti fisici agganciati all'orologio di riproduzione."""
+
+    def __init__(self, device=OUTPUT_DEVICE_INDEX, barrel="barile"):
+        super().__init__(TTS_OUTPUT_RATE, device, barrel=barrel)
+        self.effects = None
+
+    def _chunk_starting(self, cues, start_at):
+        if cues and self.effects: self.effects.schedule(cues, start_at)
+
+    def _clock_corrected(self, correction):
+        if self.effects: self.effects.retime(correction)
+
+    def interrupt(self):
+        super().interrupt()
+        if self.effects: self.effects.interrupt()
+
+
+class _LaneGroup:
+    def __init__(self, merge_key, after):
+        self.merge_key = merge_key
+        self.after = after
+        self.members = 0
+        self.done = asyncio.get_running_loop().create_future()
+
 
-    def add_chunk(self, chunk):
-        self._queue.put_nowait(chunk)
+class SerialLane:
+    """
+    Corsia seriale per i tool che toccano la stessa risorsa: partono nell'ordine di arrivo
+    e ognuno aspetta la fine del precedente. Chiamate consecutive con la stessa chiave di
+    fusione formano un unico gruppo ed entrano insieme, così lo scheduler del player può
+    ancora unire le raffiche (es. "salta, salta, salta").
+    """
 
-    async def _play_audio(self):
-        loop = asyncio.get_event_loop()
+    def __init__(self):
+        self._last_group = None
+
+    @contextlib.asynccontextmanager
+    async def hold(self, merge_key=None):
+        group = self._last_group
+        if merge_key is None or group is None or group.merge_key != merge_key or group.done.done():
+            group = _LaneGroup(merge_key, group.done if group else None)
+            self._last_group = group
+        group.members += 1
         try:
-            with sd.OutputStream(samplerate=TTS_OUTPUT_RATE, channels=1, dtype='int16', device=OUTPUT_DEVICE_INDEX) as stream:
-                logger.info(f"Stream di output avviato su dispositivo {stream.device} a {stream.samplerate}Hz.")
-                while not self.stop_event.is_set():
-                    chunk = await self._queue.get()
-                    if chunk is None: break
-                    await loop.run_in_executor(None, stream.write, np.frombuffer(chunk, dtype=np.int16))
-        except Exception as e:
-            logger.error(f"Errore critico nello stream di output: {e}", exc_info=True)
+            if group.after is not None:
+                await asyncio.shield(group.after)
+            yield
         finally:
-            logger.info("Stream di output audio fermato.")
+            group.members -= 1
+            if group.members == 0 and not group.done.done():
+                group.done.set_result(None)
 
-    def start(self):
-        self.stop_event.clear()
-        self._play_task = asyncio.get_event_loop().create_task(self._play_audio())
 
-    def stop(self):
-        self.stop_event.set()
-        if self._play_task: self._play_task.cancel()
+class ProcessServices:
+    """
+    Watchdog del loop, endpoint metriche (e profiler), guardiano di Spotify, classifiche e coda di Spotify letta in anticipo:
+    uno per processo, condivisi dai barili.
+    """
 
-    def interrupt(self):
-        while not self._queue.empty(): self._queue.get_nowait()
+    def __init__(self, metrics_port=None):
+        self.metrics_port = metrics_port or config.METRICS_PORT
+        self.watchdog = None
+        self.metrics_server = None
+
+    async def start(self):
+        if config.LOOP_WATCHDOG_THRESHOLD_S:
+            self.watchdog = LoopWatchdog(threshold=config.LOOP_WATCHDOG_THRESHOLD_S)
+            self.watchdog.start()
+        if self.metrics_port:
+            self.metrics_server = metrics.MetricsServer(config.METRICS_HOST, self.metrics_port)
+            # Il profiler si accende anche da qui, solo in locale come le metriche
+            self.metrics_server.routes["/profile"] = profiler.http_start
+            self.metrics_server.routes["/profile/stop"] = profiler.http_stop
+            try: await self.metrics_server.start()
+            except OSError as e:
+                logger.error(f"Impossibile avviare l'endpoint metriche: {e}")
+                self.metrics_server = None
+        try:
+            # kill -USR2 <pid>: accende (o spegne) il profiler a campionamento
+            asyncio.get_running_loop().add_signal_handler(signal.SIGUSR2, profiler.toggle)
+        except (NotImplementedError, RuntimeError, AttributeError):
+            logger.debug("Segnale SIGUSR2 non disponibile: profiler solo dall'endpoint metriche.")
+        if config.SPOTIFY_STATE_PUSH and spotify_watcher:
+            spotify_watcher.start()
+        if spotify_tools.spotify:
+            spotify_tools.chart_playlists.start(config.CHART_PLAYLISTS or ())
+            playback_queue.start()
+
+    def stop(self):
+        with contextlib.suppress(NotImplementedError, RuntimeError, AttributeError):
+            asyncio.get_running_loop().remove_signal_handler(signal.SIGUSR2)
+        profiler.stop()
+        if self.metrics_server: self.metrics_server.stop()
+        if self.watchdog: self.watchdog.stop()
+        if config.SPOTIFY_STATE_PUSH and spotify_watcher: spotify_watcher.stop()
+        spotify_tools.chart_playlists.stop()
+        playback_queue.stop()
 
 
 class ConversationalAgent:
-    def __init__(self):
-        self.audio_player = AudioPlayer()
+    """
+    Un barile. Senza argomenti usa config.py; `barrel` sovrascrive le chiavi per questa istanza
+    (NAME, ELEVEN_AGENT_ID, INPUT_DEVICE_INDEX, OUTPUT_DEVICE_INDEX, SPOTIFY_DEVICE_NAME, EFFECTS_*, ...).
+    Con services=False watchdog, metriche e guardiano di Spotify sono del supervisore, uno per processo.
+    """
+
+    def __init__(self, barrel=None, services=True):
+        self.barrel = dict(barrel or {})
+        self.name = self.barrel.get("NAME", "barile")
+        agent_id = self.barrel.get("ELEVEN_AGENT_ID")
+        # None: si legge WEBSOCKET_URL al momento della connessione
+        self.websocket_url = self.barrel.get("WEBSOCKET_URL") or (websocket_url(agent_id) if agent_id else None)
+        self.input_device = self.barrel.get("INPUT_DEVICE_INDEX", INPUT_DEVICE_INDEX)
+        self.audio_player = AudioPlayer(self.barrel.get("OUTPUT_DEVICE_INDEX", OUTPUT_DEVICE_INDEX), barrel=self.name)
         self.stop_flag = asyncio.Event()
         self.user_can_speak = asyncio.Event()
         self.user_can_speak.set()
+        # Servizi di processo: li avvia l'agente da solo oppure il supervisore, una volta per tutti i barili
+        self.services = ProcessServices() if services else None
+        self.spotter = None
+        self.voice_lines = None
+        self.hibernation = None
+        self._websocket = None
+        self.microphone = None
+        self.audio_process = None
+        self.black_box = None
+        # Storia del visitatore: sopravvive a riconnessioni e riavvii (None se NARRATIVE_DIR non è impostata)
+        self.story = None
+        # Formato audio della sessione, scelto a ogni connessione in base alla rete misurata
+        self.link = LinkEstimator()
+        self.output_format = None
+        self._decoder = None
+        # Coda dell'audio del microfono verso la sessione aperta (None se non c'è sessione)
+        self._session_audio = None
+        self._tool_tasks = set()
+        self._tool_lanes = {}
+        self._tool_slots = asyncio.Semaphore(MAX_CONCURRENT_TOOLS)
         logger.info("Agente conversazionale stabile inizializzato.")
 
-    async def _microphone_handler(self, websocket):
-        # ... (Funzione _microphone_handler invariata) ...
-        loop = asyncio.get_event_loop()
-        audio_queue = asyncio.Queue()
+    def _setting(self, key):
+        return self.barrel.get(key, getattr(config, key, None))
 
-        def audio_callback(indata, frames, time, status):
-            if status: logger.warning(f"Errore stream microfono: {status}")
-            if self.user_can_speak.is_set():
-                loop.call_soon_threadsafe(audio_queue.put_nowait, indata.copy())
+    def _open_microphone(self):
+        """Il microfono resta aperto per tutta la vita dell'agente: serve anche in letargo, per il risveglio."""
+        def spotter_tap(data):
+            # Lo spotter locale ascolta lo stesso audio che va a ElevenLabs, in parallelo
+            if self.spotter and self.user_can_speak.is_set(): self.spotter.feed(data)
 
-        with sd.InputStream(samplerate=API_INPUT_RATE, device=INPUT_DEVICE_INDEX, channels=1, dtype='int16', callback=audio_callback):
-            logger.info(f"Avvio stream di input dal dispositivo di default a {API_INPUT_RATE}Hz.")
+        self.microphone = Capture(API_INPUT_RATE, self._on_mic_block, device=self.input_device, tap=spotter_tap,
+                                  blocksize=MIC_BLOCK_SAMPLES if self.audio_process else 0, source=self.audio_process)
+        self.microphone.start()
+
+    def _on_mic_block(self, data):
+        if self.hibernation: self.hibernation.on_block(data)
+        if self._session_audio is not None:
+            if self.user_can_speak.is_set(): self._session_audio.put_nowait(data)
+        elif self.hibernation:
+            # Nessuna sessione (letargo o connessione in corso): l'audio aspetta nel pre-roll
+            self.hibernation.buffer(data)
+
+    async def _microphone_handler(self, websocket):
+        audio_queue = asyncio.Queue()
+        # Prima quello che è stato detto mentre la connessione si apriva, poi l'audio in diretta
+        if self.hibernation:
+            for block in self.hibernation.take_preroll(): audio_queue.put_nowait(block)
+        self._session_audio = audio_queue
+        try:
             while not self.stop_flag.is_set():
                 await self.user_can_speak.wait()
                 audio_data_np = await audio_queue.get()
+                if self.black_box: self.black_box.mic(audio_data_np)
                 audio_bytes = audio_data_np.tobytes()
                 encoded_data = base64.b64encode(audio_bytes).decode('utf-8')
                 await websocket.send(json.dumps({ "user_audio_chunk": encoded_data }))
+        finally:
+            self._session_audio = None
 
+    async def _idle_monitor(self):
+        """Termina quando la sessione è inattiva da IDLE_HIBERNATE_S: chi la aspetta chiude e va in letargo."""
+        while not self.stop_flag.is_set():
+            await asyncio.sleep(1)
+            # Il Capitano che parla o un tool in corso non sono inattività
+            if self._tool_tasks or self.audio_player.is_playing():
+                self.hibernation.touch()
+            elif self.hibernation.is_idle():
+                return
 
     async def _message_handler(self, websocket):
         async for message_str in websocket:
             message = json.loads(message_str)
             msg_type = message.get("type")
+            # I ping arrivano anche quando nessuno parla: non tengono sveglio l'agente
+            if self.hibernation and msg_type != "ping": self.hibernation.touch()
+            if self.black_box:
+                # L'audio è già nell'anello della voce: dell'evento basta l'arrivo
+                self.black_box.event("ws_in", message_str if msg_type != "audio" else
+                                     f"audio {message['audio_event'].get('event_id')} {len(message_str)}B")
 
             if msg_type == "audio":
                 if not self.audio_player._play_task: self.audio_player.start()
-                self.audio_player.add_chunk(base64.b64decode(message["audio_event"]["audio_base_64"]))
+                audio_event = message["audio_event"]
+                cues = self.audio_player.effects.cues_for(audio_event) if self.audio_player.effects else None
+                samples = self._decoder.decode(base64.b64decode(audio_event["audio_base_64"]))
+                self.link.on_audio(len(message_str), len(samples) / TTS_OUTPUT_RATE)
+                self.audio_player.add_chunk(samples, cues)
 
             elif msg_type == "user_transcript":
                 transcript = message['user_transcription_event']['user_transcript']
                 if transcript: logger.info(f"🗣️  Trascrizione: '{transcript}'")
+                if transcript and self.story: self.story.record("user", transcript)
 
             elif msg_type == "agent_response_start":
                 logger.info("L'agente sta per parlare, microfono in pausa.")
                 self.user_can_speak.clear()
                 self.audio_player.interrupt()
+                self._decoder.reset()
+                self.link.begin_response()
 
             elif msg_type == "agent_response":
                 logger.info(f"🤖 Risposta: '{message['agent_response_event']['agent_response'].strip()}'")
+                if self.story: self.story.record("agent", message['agent_response_event']['agent_response'])
+                if self.audio_player.effects: self.audio_player.effects.flush()
                 self.user_can_speak.set()
                 logger.info(">> Turno dell'utente. Microfono attivo.")
 
@@ -130,82 +298,280 @@ class ConversationalAgent:
             elif msg_type == "client_tool_call":
                 logger.info("🛠️  Agente richiede esecuzione di un tool. Microfono in pausa.")
                 self.user_can_speak.clear()
-                await self.handle_tool_call(websocket, message.get('client_tool_call', {}))
+                # Il tool gira in background: il gestore continua a leggere audio, ping e trascrizioni
+                self._dispatch_tool_call(websocket, message.get('client_tool_call', {}))
 
             elif msg_type == "ping":
+                ping_ms = message["ping_event"].get("ping_ms")
+                if ping_ms: self.link.on_rtt(ping_ms / 1000)
                 await websocket.send(json.dumps({"type": "pong", "event_id": message["ping_event"]["event_id"]}))
 
+    async def _state_push_handler(self, websocket):
+        """Manda all'agente lo stato di Spotify appena cambia, senza aspettare una get_current_song."""
+        subscription = playback_state.subscribe()
+        try:
+            while not self.stop_flag.is_set():
+                # Il primo giro manda subito lo stato già noto alla nuova sessione
+                snapshot = await subscription.next()
+                await websocket.send(json.dumps({"type": "contextual_update", "text": describe(snapshot)}))
+        finally:
+            playback_state.unsubscribe(subscription)
+
+    def _perform_ritual(self, ritual):
+        """Il rituale parte subito in locale; ElevenLabs viene solo informato, senza attendere nulla."""
+        if self.story: self.story.record("ritual", ritual.name)
+        if ritual.stinger:
+            if not self.audio_player._play_task: self.audio_player.start()
+            # Gli effetti viaggiano con lo stinger e partono in sincrono con il suono
+            self.audio_player.add_chunk(ritual.stinger, ritual.cues)
+        elif ritual.cues and self.audio_player.effects:
+            self.audio_player.effects.schedule(ritual.cues, asyncio.get_running_loop().time())
+        if self._websocket:
+            asyncio.create_task(self._send_contextual_update(self._websocket, ritual.announce))
+
+    async def _send_contextual_update(self, websocket, text):
+        try:
+            await websocket.send(json.dumps({"type": "contextual_update", "text": text}))
+        except ConnectionClosed:
+            logger.warning("Connessione chiusa prima di poter inviare l'aggiornamento di contesto.")
+
+    def set_visitor(self, key):
+        """Passa alla storia di un visitatore riconosciuto (es. un badge): se è già passato, si riprende da lì."""
+        if not self.story: return
+        store = self.story.store
+        self.story.close()
+        self.story = store.open(key)
+        if self._websocket and self.story.has_history():
+            asyncio.create_task(self._send_contextual_update(self._websocket, self.story.describe()))
+
+    def _speak_cached_line(self, text):
+        if not self.voice_lines or not isinstance(text, str):
+            return False
+        pcm = self.voice_lines.get(text)
+        if pcm is None:
+            return False
+        if not self.audio_player._play_task: self.audio_player.start()
+        self.audio_player.add_chunk(pcm)
+        return True
+
+    def _dispatch_tool_call(self, websocket, tool_call_data):
+        task = asyncio.create_task(self._run_tool_call(websocket, tool_call_data))
+        self._tool_tasks.add(task)
+        task.add_done_callback(self._tool_tasks.discard)
+
+    async def _run_tool_call(self, websocket, tool_call_data):
+        tool_name = tool_call_data.get('tool_name')
+        spec = tool_registry.get(tool_name)
+        try:
+            async with contextlib.AsyncExitStack() as stack:
+                if spec and spec.lane:
+                    lane = self._tool_lanes.setdefault(spec.lane, SerialLane())
+                    await stack.enter_async_context(lane.hold(spec.merge_key))
+                await stack.enter_async_context(self._tool_slots)
+                await self.handle_tool_call(websocket, tool_call_data)
+        except ConnectionClosed:
+            logger.warning(f"Connessione chiusa prima di poter inviare il risultato del tool '{tool_name}'.")
+        except Exception as e:
+            logger.error(f"Errore nella gestione del tool '{tool_name}': {e}", exc_info=True)
+
     async def handle_tool_call(self, websocket, tool_call_data):
         tool_name = tool_call_data.get('tool_name')
         parameters = tool_call_data.get('parameters', {})
         tool_call_id = tool_call_data.get('tool_call_id')
 
-        logger.info(f"Esecuzione tool '{tool_name}' con parametri: {parameters}")
+        logger.info("Esecuzione tool '%s' con parametri: %s", tool_name, parameters)
+        started_at = time.perf_counter()
 
-        tool_result = {"status": "error", "message": f"Tool '{tool_name}' non trovato."}
-
-        # Cerca il tool prima nei controlli del player, poi negli strumenti di ricerca
-        tool_function = None
-        if hasattr(spotify_player_controls, tool_name):
-            tool_function = getattr(spotify_player_controls, tool_name)
-        elif hasattr(spotify_tools, tool_name):
-            tool_function = getattr(spotify_tools, tool_name)
-
-        if tool_function:
+        # Solo le funzioni registrate con @tool sono chiamabili: niente helper privati o nomi importati
+        if tool_registry.get(tool_name):
             try:
-                # Esegui la funzione del tool
-                tool_result = await tool_function(**parameters)
+                # Validazione, timeout e cache sono gestiti dal registro
+                tool_result, result_json = await tool_registry.call(tool_name, parameters)
             except Exception as e:
                 logger.error(f"Errore durante l'esecuzione del tool '{tool_name}': {e}", exc_info=True)
                 tool_result = {"status": "error", "message": str(e)}
+                result_json = json.dumps(tool_result)
         else:
             logger.warning(f"Tentativo di chiamare un tool non definito: '{tool_name}'")
+            tool_result, result_json = await tool_registry.call(tool_name, parameters)
+            tool_name = "unknown"
+
+        # Battuta fissa già in cache: il Capitano la dice subito in locale, senza TTS nel cloud.
+        # Solo per i successi: errori e direttive per l'LLM non vanno letti al visitatore
+        if tool_result.get("status") == "success" and self._speak_cached_line(tool_result.get("message")):
+            tool_result = dict(tool_result, already_spoken=True,
+                               instruction="Il Capitano ha già detto questa frase ad alta voce: non ripeterla.")
+            result_json = json.dumps(tool_result)
+
+        metrics.TOOL_LATENCY.observe(time.perf_counter() - started_at, tool=tool_name)
+        metrics.TOOL_CALLS.inc(tool=tool_name, status=tool_result.get("status", "unknown"))
+        if self.story and tool_result.get("status") in ("success", "CURRENT_STATE_UPDATE"):
+            self.story.record("tool", tool_name)
+        if self.black_box:
+            self.black_box.event("tool", f"{tool_name} {time.perf_counter() - started_at:.3f}s {result_json}")
 
         # Invia il risultato al server
         response_msg = {
             "type": "client_tool_response",
             "client_tool_response": {
                 "tool_call_id": tool_call_id,
-                "result": json.dumps(tool_result),
+                "result": result_json,
                 "is_error": tool_result.get("status") not in ["success", "CURRENT_STATE_UPDATE"]
             }
         }
         await websocket.send(json.dumps(response_msg))
-        logger.info(f"Risultato del tool '{tool_name}' inviato al server: {json.dumps(tool_result)}")
+        logger.info("Risultato del tool '%s' inviato al server: %s", tool_name, result_json)
 
 
-        # Riattiva il microfono dopo l'esecuzione del tool
-        self.user_can_speak.set()
-        logger.info(">> Turno dell'utente. Microfono riattivato dopo esecuzione tool.")
+        # Riattiva il microfono solo quando non restano altri tool in esecuzione
+        if len(self._tool_tasks) <= 1:
+            self.user_can_speak.set()
+            logger.info(">> Turno dell'utente. Microfono riattivato dopo esecuzione tool.")
 
     async def _run_session(self):
         # ... (Funzione _run_session invariata) ...
         headers = {"xi-api-key": ELEVEN_API_KEY}
+        disconnected_at = None
         while not self.stop_flag.is_set():
+            if self.hibernation and self.hibernation.asleep:
+                waiters = {asyncio.create_task(self.hibernation.wait_for_wake()),
+                           asyncio.create_task(self.stop_flag.wait())}
+                _, pending = await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+                for task in pending: task.cancel()
+                if self.stop_flag.is_set(): break
+            self.output_format = self._setting("OUTPUT_FORMAT") or self.link.choose(
+                self._setting("OUTPUT_FORMATS") or SUPPORTED_FORMATS, self.output_format)
+            self._decoder = StreamDecoder(self.output_format, TTS_OUTPUT_RATE)
+            url = with_output_format(self.websocket_url or WEBSOCKET_URL, self.output_format)
             try:
                 logger.info("Tentativo di connessione a ElevenLabs...")
-                async with websockets.connect(WEBSOCKET_URL, extra_headers=headers) as websocket:
-                    logger.info("✅ Connessione stabilita. In attesa di audio...")
+                async with websockets.connect(url, extra_headers=headers) as websocket:
+                    logger.info(f"✅ Connessione stabilita ({self.name}). In attesa di audio...")
+                    if self.black_box: self.black_box.event("connect", self.output_format)
+                    self._websocket = websocket
+                    if self.story and self.story.has_history():
+                        # Riconnessione o visitatore che torna: il Capitano riprende il filo, subito
+                        asyncio.create_task(self._send_contextual_update(websocket, self.story.describe()))
+                    if disconnected_at is not None:
+                        metrics.WS_RECONNECT_DURATION.observe(time.monotonic() - disconnected_at)
+                        disconnected_at = None
+                    if self.hibernation: self.hibernation.connected()
                     tasks = [
                         asyncio.create_task(self._microphone_handler(websocket)),
                         asyncio.create_task(self._message_handler(websocket)),
                     ]
+                    if self._setting("SPOTIFY_STATE_PUSH"):
+                        tasks.append(asyncio.create_task(self._state_push_handler(websocket)))
+                    idle_task = asyncio.create_task(self._idle_monitor()) if self.hibernation else None
+                    if idle_task: tasks.append(idle_task)
                     done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
                     for task in pending: task.cancel()
+                    # I risultati dei tool appartengono a questa sessione: non ha senso completarli
+                    for task in list(self._tool_tasks): task.cancel()
+                    self._websocket = None
+                if idle_task in done and not self.stop_flag.is_set():
+                    # Chiusura voluta: nessun ritardo di riconnessione, si riapre al risveglio
+                    self.hibernation.sleep()
+                    # Nessuno parla da un pezzo: chi sveglierà il Capitano è un nuovo visitatore
+                    if self.story: self.story.record("new_visitor")
+                    metrics.WS_RECONNECTS.inc(reason="idle")
+                    continue
+                metrics.WS_RECONNECTS.inc(reason="closed")
 
             except ConnectionClosed as e:
                 logger.warning(f"Connessione chiusa ({e.code}). Riconnessione tra {RECONNECT_DELAY}s.")
+                metrics.WS_RECONNECTS.inc(reason=f"closed_{e.code}")
             except Exception as e:
                 logger.error(f"Errore imprevisto: {e}. Riconnessione tra {RECONNECT_DELAY}s.", exc_info=True)
+                metrics.WS_RECONNECTS.inc(reason="error")
+
+            if self.black_box: self.black_box.event("disconnect", f"riconnessione tra {RECONNECT_DELAY}s")
+            # Il tempo di riconnessione parte dalla prima caduta, non da ogni tentativo
+            if disconnected_at is None: disconnected_at = time.monotonic()
 
             if not self.stop_flag.is_set(): await asyncio.sleep(RECONNECT_DELAY)
 
     async def start(self):
         self.stop_flag.clear()
+        if self.services: await self.services.start()
+        # I tool di questo barile (e i thread che aprono) vedono il suo dispositivo Spotify
+        if self.barrel.get("SPOTIFY_DEVICE_NAME"): target_device_name.set(self.barrel["SPOTIFY_DEVICE_NAME"])
+        effects_backend = self._setting("EFFECTS_BACKEND")
+        if effects_backend:
+            try:
+                backend = create_backend(effects_backend, serial_port=self._setting("EFFECTS_SERIAL_PORT"),
+                                         serial_baudrate=self._setting("EFFECTS_SERIAL_BAUDRATE"),
+                                         gpio_pins=self._setting("EFFECTS_GPIO_PINS"))
+                self.audio_player.effects = EffectScheduler(backend, self._setting("EFFECT_WORD_CUES"))
+                logger.info(f"🔥 Effetti sincronizzati con la voce attivi (backend: {backend.name}).")
+            except Exception as e:
+                logger.error(f"Impossibile avviare gli effetti: {e}")
+        if self._setting("VOICE_LINES_DIR"):
+            self.voice_lines = VoiceLineCache(self._setting("VOICE_LINES_DIR"),
+                                              max_mapped=self._setting("VOICE_LINES_MAX_MAPPED"))
+            if len(self.voice_lines):
+                logger.info(f"🗣️  {len(self.voice_lines)} battute del Capitano pronte in locale.")
+            else:
+                logger.info("Cache delle battute vuota: 'python voice_lines.py --rebuild' per crearla.")
+        if self._setting("RITUALS"):
+            rituals = load_rituals(self._setting("RITUALS"), output_rate=TTS_OUTPUT_RATE)
+            if rituals:
+                loop = asyncio.get_running_loop()
+                self.spotter = RitualSpotter(
+                    rituals, on_detect=lambda ritual, _: loop.call_soon_threadsafe(self._perform_ritual, ritual))
+                self.spotter.start()
+        if self._setting("IDLE_HIBERNATE_S"):
+            self.hibernation = Hibernation(API_INPUT_RATE, self._setting("IDLE_HIBERNATE_S"),
+                                           wake_dbfs=self._setting("WAKE_THRESHOLD_DBFS"),
+                                           wake_min_s=self._setting("WAKE_MIN_S"),
+                                           preroll_s=self._setting("PREROLL_S"))
+        if self._setting("BLACK_BOX_PATH"):
+            try:
+                self.black_box = BlackBox(self._setting("BLACK_BOX_PATH").format(name=self.name),
+                                          minutes=self._setting("BLACK_BOX_MINUTES") or 5,
+                                          mic_rate=API_INPUT_RATE, tts_rate=TTS_OUTPUT_RATE)
+                self.audio_player.tap = self.black_box.tts
+            except OSError as e:
+                logger.error(f"Impossibile aprire la scatola nera: {e}")
+        if self._setting("NARRATIVE_DIR"):
+            try:
+                store = NarrativeStore(self._setting("NARRATIVE_DIR"),
+                                       snapshot_every=self._setting("NARRATIVE_SNAPSHOT_EVERY") or 50)
+                self.story = store.open(self.name)
+            except OSError as e:
+                logger.error(f"Impossibile aprire la storia del visitatore: {e}")
+        if self._setting("AUDIO_PROCESS"):
+            self.audio_process = AudioProcess(TTS_OUTPUT_RATE, API_INPUT_RATE, output_device=self.audio_player.device,
+                                              input_device=self.input_device, music=self._setting("AUDIO_PROCESS_MUSIC"))
+            self.audio_process.start()
+            self.audio_player.sink = self.audio_process
+            if self.audio_process.music and spotify_watcher and config.SPOTIFY_PAUSES_MUSIC:
+                spotify_watcher.music_players.append(self.audio_process)
+        self._open_microphone()
         try: await self._run_session()
         except asyncio.CancelledError: logger.info("Task principale cancellato.")
 
     def stop(self):
-        logger.info("🛑 Richiesta di arresto...")
+        logger.info(f"🛑 Richiesta di arresto ({self.name})...")
         self.stop_flag.set()
         self.audio_player.stop()
+        if self.spotter: self.spotter.stop()
+        if self.microphone:
+            self.microphone.close()
+            self.microphone = None
+        if self.audio_process:
+            if self.audio_process in getattr(spotify_watcher, "music_players", ()):
+                spotify_watcher.music_players.remove(self.audio_process)
+            self.audio_process.stop()
+            self.audio_player.sink = self.audio_process = None
+        if self.audio_player.effects:
+            self.audio_player.effects.close()
+            self.audio_player.effects = None
+        if self.story:
+            self.story.close()
+            self.story = None
+        if self.black_box:
+            self.audio_player.tap = None
+            self.black_box.close()
+            self.black_box = None
+        if self.services: self.services.stop()
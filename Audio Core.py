@@ -0,0 +1,375 @@
+# Progetto_Stabile/audio_core.py
+"""
+Il nucleo audio comune a agent.py, streaming_agent.py e audio_manager.py.
+
+- Codec: PCM16 e µ-law, da/verso array int16 senza copie inutili.
+- Playout: coda dei chunk, underrun, orologio di riproduzione e flush, uguali per tutti.
+  Dove finisce l'audio lo decide il sink: scheda audio (DeviceSink), processo audio
+  isolato (AudioProcess ha la stessa interfaccia) o nessuno (SimulatedSink).
+- Capture: microfono a blocchi consegnati sull'event loop; se il loop resta indietro
+  i blocchi in eccesso si scartano e si contano, invece di accumularsi.
+
+Da dove arriva l'audio (websocket grezzo, SDK di ElevenLabs, mock) non importa:
+chi lo riceve lo decodifica con decode() e lo passa a Playout.add_chunk().
+"""
+import asyncio
+import contextlib
+import logging
+import threading
+import time
+
+import numpy as np
+import sounddevice as sd
+
+import metrics
+from effect_scheduler import PlayoutClock
+from log_setup import RateLimited
+
+logger = logging.getLogger("AudioCore")
+
+# Pausa oltre la quale un buco tra due chunk è considerato fine risposta e non underrun
+UNDERRUN_MAX_GAP_S = 0.5
+# Blocchi del microfono in attesa di essere consegnati al loop: oltre si scartano
+CAPTURE_MAX_PENDING_BLOCKS = 100
+
+CAPTURE_DROPPED = metrics.registry.counter(
+    "rumbtide_capture_dropped_blocks_total", "Blocchi del microfono scartati perché l'event loop era indietro.")
+AUDIO_RECEIVED_BYTES = metrics.registry.counter(
+    "rumbtide_audio_received_bytes_total", "Byte di audio ricevuti (dopo il base64), per formato.", ("format",))
+AUDIO_DECODE_SECONDS = metrics.registry.counter(
+    "rumbtide_audio_decode_seconds_total", "Tempo di CPU speso a decodificare e ricampionare, per formato.",
+    ("format",))
+
+
+# --- Codec ---
+def _ulaw_decode_table():
+    codes = ~np.arange(256, dtype=np.int32) & 0xFF
+    exponent, mantissa = (codes >> 4) & 0x07, codes & 0x0F
+    magnitude = (((mantissa << 3) + 0x84) << exponent) - 0x84
+    return np.where(codes & 0x80, -magnitude, magnitude).astype(np.int16)
+
+
+def _ulaw_encode_table():
+    # Indicizzata con i campioni int16 visti come uint16: una sola lettura per campione
+    samples = np.arange(65536, dtype=np.int32)
+    samples = np.where(samples >= 32768, samples - 65536, samples)
+    sign = np.where(samples < 0, 0x80, 0)
+    magnitude = np.minimum(np.abs(samples), 32635) + 0x84
+    exponent = np.floor(np.log2(magnitude)).astype(np.int32) - 7
+    mantissa = (magnitude >> (exponent + 3)) & 0x0F
+    return (~(sign | (exponent << 4) | mantissa) & 0xFF).astype(np.uint8)
+
+
+_ULAW_DECODE = _ulaw_decode_table()
+_ULAW_ENCODE = _ulaw_encode_table()
+
+
+def encoding_rate(encoding):
+    """Sample rate di un formato ElevenLabs, es. 'pcm_24000' -> 24000 (None se non è indicato)."""
+    _, _, rate = encoding.rpartition("_")
+    return int(rate) if rate.isdigit() else None
+
+
+def decode(payload, encoding="pcm"):
+    """Byte ricevuti -> campioni int16. Il PCM è una vista sui byte, senza copia."""
+    if encoding.startswith("ulaw"):
+        return _ULAW_DECODE[np.frombuffer(payload, dtype=np.uint8)]
+    return np.frombuffer(payload, dtype=np.int16)
+
+
+def encode(samples, encoding="pcm"):
+    """Campioni int16 -> byte da inviare."""
+    samples = np.asarray(samples, dtype=np.int16)
+    if encoding.startswith("ulaw"):
+        return _ULAW_ENCODE[samples.view(np.uint16)].tobytes()
+    return samples.tobytes()
+
+
+class StreamResampler:
+    """
+    Cambio di sample rate di un flusso a blocchi (1D, oppure campioni x canali).
+    L'interpolazione lineare tiene l'ultimo campione e la fase tra un blocco e l'altro, e quando
+    si scende di rate il passa-basso anti-aliasing tiene il suo stato: niente click ai bordi.
+    """
+
+    def __init__(self, from_rate, to_rate):
+        self.from_rate = from_rate
+        self.to_rate = to_rate
+        self._step = from_rate / to_rate
+        self._sos = None
+        if to_rate < from_rate:
+            from scipy.signal import butter
+
+            self._sos = butter(8, 0.9 * to_rate / from_rate, output="sos")
+        self.reset()
+
+    def reset(self):
+        """A inizio flusso o dopo un barge-in: il blocco successivo non continua il precedente."""
+        self._last = None
+        # Posizione del prossimo campione di uscita, con il campione precedente all'indice 0
+        self._phase = 1.0
+        self._zi = None
+
+    def process(self, samples):
+        """Restituisce float32 al nuovo rate, con la stessa forma (1D o 2D) dell'ingresso."""
+        if self.from_rate == self.to_rate or not len(samples):
+            return samples
+        data = np.asarray(samples, dtype=np.float32)
+        if self._sos is not None:
+            from scipy.signal import sosfilt, sosfilt_zi
+
+            if self._zi is None:
+                # Filtro già a regime sul primo campione: nessun transitorio all'inizio del flusso
+                zi = sosfilt_zi(self._sos)
+                self._zi = (zi[:, :, None] if data.ndim > 1 else zi) * data[0]
+            data, self._zi = sosfilt(self._sos, data, axis=0, zi=self._zi)
+        source = np.empty((len(data) + 1,) + data.shape[1:], dtype=np.float32)
+        source[0] = 0.0 if self._last is None else self._last
+        source[1:] = data
+        count = int((len(data) - self._phase) // self._step) + 1 if self._phase <= len(data) else 0
+        positions = self._phase + self._step * np.arange(count)
+        self._last = source[-1].copy()
+        self._phase += count * self._step - len(data)
+        grid = np.arange(len(source))
+        if source.ndim == 1:
+            return np.interp(positions, grid, source).astype(np.float32)
+        return np.stack([np.interp(positions, grid, channel) for channel in source.T], axis=1).astype(np.float32)
+
+
+class StreamDecoder:
+    """Decodifica i chunk di un flusso nel formato `encoding` (es. 'ulaw_8000') e li porta al rate del playout."""
+
+    def __init__(self, encoding, out_rate):
+        self.encoding = encoding
+        self.in_rate = encoding_rate(encoding) or out_rate
+        self.out_rate = out_rate
+        self._resampler = StreamResampler(self.in_rate, out_rate)
+
+    def reset(self):
+        """A inizio risposta o dopo un barge-in: il chunk successivo non continua il precedente."""
+        self._resampler.reset()
+
+    def decode(self, payload):
+        started = time.perf_counter()
+        samples = decode(payload, self.encoding)
+        if self.in_rate != self.out_rate and len(samples):
+            samples = self._resampler.process(samples).astype(np.int16)
+        AUDIO_RECEIVED_BYTES.inc(len(payload), format=self.encoding)
+        AUDIO_DECODE_SECONDS.inc(time.perf_counter() - started, format=self.encoding)
+        return samples
+
+
+def to_int16(samples):
+    """Float in [-1, 1] (es. dal microfono in float32) -> int16."""
+    return (np.clip(samples, -1, 1) * 32767).astype(np.int16)
+
+
+# --- Sink del playout ---
+class DeviceSink:
+    """Scheda audio via sounddevice: write bloccante in un thread, così il loop resta libero."""
+
+    def __init__(self, rate, device=None):
+        self.rate = rate
+        self.device = device
+        self._stream = None
+
+    def __enter__(self):
+        self._stream = sd.OutputStream(samplerate=self.rate, channels=1, dtype='int16', device=self.device)
+        self._stream.start()
+        logger.info(f"Stream di output avviato su dispositivo {self._stream.device} a {self._stream.samplerate}Hz.")
+        return self
+
+    def __exit__(self, *exc):
+        self._stream.close()
+        self._stream = None
+        return False
+
+    async def write(self, samples):
+        await asyncio.get_running_loop().run_in_executor(None, self._stream.write, samples)
+
+    def latency(self):
+        return getattr(self._stream, "latency", 0.0)
+
+    def flush(self):
+        # Con la write bloccante nel buffer di PortAudio resta al più un blocco: si lascia finire
+        pass
+
+
+class SimulatedSink:
+    """Nessun dispositivo: la write dura quanto l'audio. Per il client di prova e i benchmark."""
+
+    def __init__(self, rate):
+        self.rate = rate
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    async def write(self, samples):
+        await asyncio.sleep(len(samples) / self.rate)
+
+    def latency(self):
+        return 0.0
+
+    def flush(self):
+        pass
+
+
+# --- Playout ---
+class Playout:
+    """
+    Riproduce i chunk int16 nell'ordine di arrivo su `sink` (di default la scheda audio `device`).
+    Il sink si può cambiare prima di start(): qualunque oggetto con write (async), latency e flush.
+    `tap(samples)`, se c'è, vede ogni chunk mentre viene scritto sul sink (es. la scatola nera).
+    `barrel` è l'etichetta della profondità della coda nelle metriche.
+    """
+
+    def __init__(self, rate, device=None, sink=None, tap=None, barrel="barile"):
+        self.rate = rate
+        self.device = device
+        self.sink = sink
+        self.tap = tap
+        self._queue = asyncio.Queue()
+        self._play_task = None
+        self.stop_event = threading.Event()
+        # Istante (loop.time) in cui l'audio già scritto finirà di suonare
+        self._playout_deadline = 0.0
+        # Posizione reale della riproduzione, a cui si agganciano gli effetti fisici
+        self.clock = PlayoutClock(rate)
+        # Con più barili nello stesso processo ognuno ha la sua serie
+        metrics.AUDIO_QUEUE_DEPTH.set_function(self._queue.qsize, barrel=barrel)
+
+    def add_chunk(self, chunk, cues=None):
+        """`chunk`: byte PCM16 o array int16. I cue viaggiano con il loro chunk: se viene scartato, non partono."""
+        if not isinstance(chunk, np.ndarray):
+            chunk = decode(chunk)
+        self._queue.put_nowait((chunk, cues))
+
+    def is_playing(self):
+        loop = asyncio.get_running_loop()
+        return not self._queue.empty() or self._playout_deadline > loop.time()
+
+    def _open_sink(self):
+        if self.sink is not None:
+            return contextlib.nullcontext(self.sink)
+        return DeviceSink(self.rate, self.device)
+
+    def _chunk_starting(self, cues, start_at):
+        """Hook: il chunk con questi cue inizierà a suonare a start_at (loop.time)."""
+
+    def _clock_corrected(self, correction):
+        """Hook: la stima dell'orologio di riproduzione è stata spostata di `correction` secondi."""
+
+    async def _play_audio(self):
+        loop = asyncio.get_running_loop()
+        try:
+            with self._open_sink() as sink:
+                while not self.stop_event.is_set():
+                    item = await self._queue.get()
+                    if item is None: break
+                    samples, cues = item
+                    now = loop.time()
+                    if self._playout_deadline < now < self._playout_deadline + UNDERRUN_MAX_GAP_S:
+                        metrics.AUDIO_UNDERRUNS.inc()
+                    self._playout_deadline = max(now, self._playout_deadline) + len(samples) / self.rate
+                    start_at = self.clock.begin_chunk(len(samples), now, sink.latency())
+                    self._chunk_starting(cues, start_at)
+                    if self.tap: self.tap(samples)
+                    await sink.write(samples)
+                    self._clock_corrected(self.clock.end_chunk(now, loop.time(), sink.latency()))
+        except Exception as e:
+            logger.error(f"Errore critico nello stream di output: {e}", exc_info=True)
+        finally:
+            logger.info("Stream di output audio fermato.")
+
+    def start(self):
+        self.stop_event.clear()
+        self._play_task = asyncio.get_event_loop().create_task(self._play_audio())
+
+    def stop(self):
+        self.stop_event.set()
+        if self._play_task: self._play_task.cancel()
+
+    async def wait_stopped(self):
+        if self._play_task:
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._play_task
+
+    def interrupt(self):
+        """Barge-in: scarta la coda e quello che il sink non ha ancora suonato."""
+        while not self._queue.empty(): self._queue.get_nowait()
+        self._playout_deadline = 0.0
+        self.clock.reset()
+        if self.sink is not None: self.sink.flush()
+
+
+# --- Capture ---
+class Capture:
+    """
+    Microfono a blocchi. `on_block(data)` viene chiamata sull'event loop; `tap(data)`, se c'è,
+    direttamente nel thread audio (per chi non deve aspettare il loop, es. lo spotter dei rituali).
+    Con `source` (un AudioProcess) i blocchi arrivano dal processo audio isolato invece che da sounddevice.
+    """
+
+    def __init__(self, rate, on_block, device=None, tap=None, blocksize=0, dtype='int16', source=None,
+                 max_pending=CAPTURE_MAX_PENDING_BLOCKS):
+        self.rate = rate
+        self.on_block = on_block
+        self.device = device
+        self.tap = tap
+        self.blocksize = blocksize
+        self.dtype = dtype
+        self.source = source
+        self.max_pending = max_pending
+        self.dropped = 0
+        # Ognuno scritto da un solo thread: la differenza è quanto aspetta di essere consegnato
+        self._queued = 0
+        self._delivered = 0
+        self._loop = None
+        self._stream = None
+        self._task = None
+        self._closed = False
+        self._status_log = RateLimited(logger, level=logging.WARNING)
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._closed = False
+        if self.source is not None:
+            self._task = self._loop.create_task(self._from_source())
+            return
+        self._stream = sd.InputStream(samplerate=self.rate, device=self.device, channels=1, dtype=self.dtype,
+                                      blocksize=self.blocksize, callback=self._callback)
+        self._stream.start()
+        logger.info(f"Avvio stream di input dal dispositivo {self.device if self.device is not None else 'di default'} "
+                    f"a {self.rate}Hz.")
+
+    def _callback(self, indata, frames, time_info, status):
+        if status: self._status_log.log("Errore stream microfono: %s", status)
+        data = indata.copy()
+        if self.tap: self.tap(data)
+        if self._queued - self._delivered >= self.max_pending:
+            self.dropped += 1
+            CAPTURE_DROPPED.inc()
+            return
+        self._queued += 1
+        self._loop.call_soon_threadsafe(self._deliver, data)
+
+    def _deliver(self, data):
+        self._delivered += 1
+        if not self._closed: self.on_block(data)
+
+    async def _from_source(self):
+        async for data in self.source.microphone(self.blocksize or self.rate // 20):
+            if self.tap: self.tap(data)
+            self.on_block(data)
+        if not self._closed: logger.error("Il processo audio è terminato: microfono muto.")
+
+    def close(self):
+        self._closed = True
+        if self._task: self._task.cancel()
+        if self._stream:
+            self._stream.close()
+            logger.info("🎤 Microfono spento.")
+        self._task = self._stream = None
@@ -0,0 +1,385 @@
+# Progetto_Stabile/audio_process.py
+"""
+Processo audio isolato.
+
+Microfono, voce del Capitano e musica di sottofondo girano in un processo piccolo che fa
+solo audio: le callback di PortAudio non si contendono il GIL con JSON, tool, client HTTP
+e garbage collector dell'agente.
+
+- PCM: due ring buffer in memoria condivisa (voce verso il processo, microfono verso l'agente).
+- Controllo: una riga JSON per comando sullo stdin del processo (musica, duck, stop).
+  Se l'agente muore, lo stdin si chiude e il processo audio termina da solo.
+- Statistiche (xrun, underrun, durata delle callback): un piccolo array condiviso,
+  letto dall'agente senza andata e ritorno.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+import wave
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+import metrics
+
+logger = logging.getLogger("AudioProcess")
+
+# Pausa oltre la quale un buco nella voce è fine risposta e non un glitch (come in audio_core.py)
+UNDERRUN_MAX_GAP_S = 0.5
+# Comando che esegue questo file nel processo figlio; None = l'interprete corrente
+LAUNCHER = None
+# Riduzione della musica mentre il Capitano parla
+DUCK_GAIN = 0.3
+
+# Indici dell'array di statistiche condiviso
+OUTPUT_XRUNS, INPUT_XRUNS, UNDERRUNS, CAPTURE_DROPPED, CALLBACKS, MAX_CALLBACK_US, DEVICE_LATENCY_US = range(7)
+STATS_SIZE = 8
+XRUN_KINDS = {"output_xrun": OUTPUT_XRUNS, "input_xrun": INPUT_XRUNS, "underrun": UNDERRUNS,
+              "capture_dropped": CAPTURE_DROPPED}
+
+AUDIO_PROCESS_XRUNS = metrics.registry.gauge(
+    "rumbtide_audio_process_xruns", "Contatori del processo audio (crescono soltanto).", ("kind",))
+AUDIO_PROCESS_CALLBACK_MAX = metrics.registry.gauge(
+    "rumbtide_audio_process_callback_max_seconds", "Callback audio più lunga dall'avvio del processo.")
+
+
+# --- Ring buffer in memoria condivisa ---
+class ShmRing:
+    """
+    Ring buffer single-producer/single-consumer di campioni int16 in memoria condivisa.
+    Le posizioni sono contatori che crescono sempre e ognuna è scritta da un solo processo,
+    quindi non serve nessun lock. Il flush lo chiede il produttore (flush_to) e lo esegue
+    il consumatore alla lettura successiva: l'audio scritto dopo il flush non si perde.
+    """
+    _WRITE, _READ, _FLUSH = range(3)
+    _HEADER_BYTES = 32
+
+    def __init__(self, capacity=None, name=None):
+        if name is None:
+            self._shm = shared_memory.SharedMemory(create=True, size=self._HEADER_BYTES + 2 * capacity)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+            # Su 3.11 chi si collega registra il segmento e lo cancellerebbe uscendo: è di chi lo ha creato
+            resource_tracker.unregister(self._shm._name, "shared_memory")
+        self.owner = name is None
+        self.name = self._shm.name
+        self.capacity = (self._shm.size - self._HEADER_BYTES) // 2
+        self._pos = np.ndarray((3,), dtype=np.uint64, buffer=self._shm.buf)
+        self._data = np.ndarray((self.capacity,), dtype=np.int16, buffer=self._shm.buf, offset=self._HEADER_BYTES)
+        if self.owner:
+            self._pos[:] = 0
+
+    def available(self):
+        return int(self._pos[self._WRITE]) - int(self._pos[self._READ])
+
+    def space(self):
+        return self.capacity - self.available()
+
+    def write(self, samples):
+        """Scrive quanto ci sta (mai bloccante). Restituisce i campioni scritti."""
+        n = min(len(samples), self.space())
+        position = int(self._pos[self._WRITE])
+        start = position % self.capacity
+        first = min(n, self.capacity - start)
+        self._data[start:start + first] = samples[:first]
+        self._data[:n - first] = samples[first:n]
+        self._pos[self._WRITE] = position + n
+        return n
+
+    def read_into(self, out):
+        """Riempie `out` con quanto disponibile. Restituisce i campioni letti."""
+        if self._pos[self._FLUSH] > self._pos[self._READ]:
+            self._pos[self._READ] = self._pos[self._FLUSH]
+        n = min(len(out), self.available())
+        position = int(self._pos[self._READ])
+        start = position % self.capacity
+        first = min(n, self.capacity - start)
+        out[:first] = self._data[start:start + first]
+        out[first:n] = self._data[:n - first]
+        self._pos[self._READ] = position + n
+        return n
+
+    def flush(self):
+        """Lato produttore: tutto ciò che è già stato scritto va scartato."""
+        self._pos[self._FLUSH] = self._pos[self._WRITE]
+
+    def close(self):
+        self._pos = self._data = None
+        self._shm.close()
+        if self.owner:
+            self._shm.unlink()
+
+
+def _attach_stats(name=None):
+    if name is None:
+        shm = shared_memory.SharedMemory(create=True, size=8 * STATS_SIZE)
+    else:
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+    stats = np.ndarray((STATS_SIZE,), dtype=np.int64, buffer=shm.buf)
+    if name is None:
+        stats[:] = 0
+    return shm, stats
+
+
+def load_music(path, rate):
+    """WAV PCM16 della musica di sottofondo, mono e al sample rate di uscita."""
+    with wave.open(path, "rb") as f:
+        if f.getsampwidth() != 2:
+            raise ValueError(f"{path}: serve un WAV PCM16.")
+        data = np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16)
+        channels, file_rate = f.getnchannels(), f.getframerate()
+    if channels > 1:
+        data = data.reshape(-1, channels).mean(axis=1)
+    if file_rate != rate:
+        data = np.interp(np.arange(0, len(data), file_rate / rate), np.arange(len(data)), data)
+    return np.asarray(data, dtype=np.int16)
+
+
+# --- Lato processo audio ---
+class _Mixer:
+    """Le callback di PortAudio: niente lock, niente log, niente I/O."""
+
+    def __init__(self, playout, capture, stats, rate, music=None, music_gain=0.6):
+        self.playout = playout
+        self.capture = capture
+        self.stats = stats
+        self.rate = rate
+        self.music = music
+        self.music_gain = music_gain
+        self.music_playing = music is not None
+        self.duck_gain = DUCK_GAIN
+        self._music_pos = 0
+        self._gain = 0.0
+        self._streaming = False
+        self._starved_at = None
+        self._voice = np.zeros(0, dtype=np.int16)
+        self._mix = np.zeros(0, dtype=np.float32)
+
+    def output_callback(self, outdata, frames, time_info, status):
+        started = time.perf_counter()
+        if status and status.output_underflow:
+            self.stats[OUTPUT_XRUNS] += 1
+        if len(self._voice) < frames:
+            self._voice = np.zeros(frames, dtype=np.int16)
+            self._mix = np.zeros(frames, dtype=np.float32)
+        voice = self._voice[:frames]
+        n = self.playout.read_into(voice)
+        voice[n:] = 0
+        self._track_underruns(n, frames)
+
+        if self.music is not None and (self.music_playing or self._gain > 0):
+            target = (self.music_gain * (self.duck_gain if n else 1.0)) if self.music_playing else 0.0
+            mix = self._mix[:frames]
+            indices = (self._music_pos + np.arange(frames)) % len(self.music)
+            self._music_pos = int(indices[-1] + 1) % len(self.music)
+            # Rampa sul blocco: il duck non deve fare click
+            np.multiply(self.music[indices], np.linspace(self._gain, target, frames, dtype=np.float32), out=mix)
+            self._gain = target
+            mix += voice
+            np.clip(mix, -32768, 32767, out=mix)
+            outdata[:, 0] = mix
+        else:
+            outdata[:, 0] = voice
+
+        self.stats[CALLBACKS] += 1
+        elapsed_us = int((time.perf_counter() - started) * 1e6)
+        if elapsed_us > self.stats[MAX_CALLBACK_US]:
+            self.stats[MAX_CALLBACK_US] = elapsed_us
+
+    def _track_underruns(self, n, frames):
+        """Un buco breve in mezzo a una risposta è un glitch udibile; uno lungo è la fine della risposta."""
+        now = time.monotonic()
+        if n and self._starved_at is not None:
+            if now - self._starved_at < UNDERRUN_MAX_GAP_S:
+                self.stats[UNDERRUNS] += 1
+            self._starved_at = None
+        if n < frames and (self._streaming or n):
+            self._starved_at = now
+        self._streaming = n == frames
+
+    def input_callback(self, indata, frames, time_info, status):
+        if status and status.input_overflow:
+            self.stats[INPUT_XRUNS] += 1
+        written = self.capture.write(indata[:, 0])
+        if written < frames:
+            self.stats[CAPTURE_DROPPED] += frames - written
+
+    def command(self, message):
+        cmd = message.get("cmd")
+        if cmd == "music":
+            self.music_playing = bool(message.get("playing")) and self.music is not None
+        elif cmd == "duck":
+            self.duck_gain = float(message.get("gain", DUCK_GAIN))
+        elif cmd == "music_volume":
+            self.music_gain = float(message.get("gain", self.music_gain))
+
+
+def _raise_priority():
+    try:
+        os.nice(-10)
+    except (AttributeError, OSError):
+        pass
+
+
+def run_audio_process(argv=None):
+    parser = argparse.ArgumentParser(description="Processo audio isolato (avviato dall'agente).")
+    parser.add_argument("--playout", required=True)
+    parser.add_argument("--capture", required=True)
+    parser.add_argument("--stats", required=True)
+    parser.add_argument("--output-rate", type=int, default=24000)
+    parser.add_argument("--input-rate", type=int, default=16000)
+    parser.add_argument("--output-device", type=int)
+    parser.add_argument("--input-device", type=int)
+    parser.add_argument("--blocksize", type=int, default=0)
+    parser.add_argument("--music")
+    parser.add_argument("--music-gain", type=float, default=0.6)
+    args = parser.parse_args(argv)
+
+    import sounddevice as sd
+
+    playout, capture = ShmRing(name=args.playout), ShmRing(name=args.capture)
+    stats_shm, stats = _attach_stats(args.stats)
+    music = load_music(args.music, args.output_rate) if args.music else None
+    mixer = _Mixer(playout, capture, stats, args.output_rate, music=music, music_gain=args.music_gain)
+    _raise_priority()
+
+    output = sd.OutputStream(samplerate=args.output_rate, channels=1, dtype="int16", device=args.output_device,
+                             blocksize=args.blocksize, callback=mixer.output_callback)
+    microphone = sd.InputStream(samplerate=args.input_rate, channels=1, dtype="int16", device=args.input_device,
+                                blocksize=args.blocksize, callback=mixer.input_callback)
+    with output, microphone:
+        stats[DEVICE_LATENCY_US] = int(getattr(output, "latency", 0.0) * 1e6)
+        # Dopo l'avvio non si creano più cicli: il GC non deve mai fermare le callback
+        gc.collect()
+        gc.disable()
+        for line in sys.stdin:
+            message = json.loads(line)
+            if message.get("cmd") == "stop":
+                break
+            mixer.command(message)
+    # Le viste numpy sulla memoria condivisa vanno rilasciate prima di chiuderla
+    del output, microphone, mixer, stats
+    playout.close()
+    capture.close()
+    stats_shm.close()
+
+
+# --- Lato agente ---
+class AudioProcess:
+    """
+    Avvia il processo audio e scambia con lui PCM e comandi.
+    `launcher` è il comando che esegue questo file (di default l'interprete corrente).
+    """
+
+    def __init__(self, output_rate, input_rate, output_device=None, input_device=None,
+                 music=None, buffer_s=2.0, launcher=None):
+        self.output_rate = output_rate
+        self.input_rate = input_rate
+        self.output_device = output_device
+        self.input_device = input_device
+        self.music = music
+        self.buffer_s = buffer_s
+        self.launcher = launcher or LAUNCHER or [sys.executable]
+        self.playout = None
+        self.capture = None
+        self.stats = None
+        self._stats_shm = None
+        self._process = None
+
+    def start(self):
+        self.playout = ShmRing(int(self.buffer_s * self.output_rate))
+        self.capture = ShmRing(int(self.buffer_s * self.input_rate))
+        self._stats_shm, self.stats = _attach_stats()
+        command = [*self.launcher, os.path.abspath(__file__),
+                   "--playout", self.playout.name, "--capture", self.capture.name, "--stats", self._stats_shm.name,
+                   "--output-rate", str(self.output_rate), "--input-rate", str(self.input_rate)]
+        if self.output_device is not None: command += ["--output-device", str(self.output_device)]
+        if self.input_device is not None: command += ["--input-device", str(self.input_device)]
+        if self.music: command += ["--music", self.music]
+        self._process = subprocess.Popen(command, stdin=subprocess.PIPE, text=True)
+        for kind, index in XRUN_KINDS.items():
+            AUDIO_PROCESS_XRUNS.set_function(lambda index=index: int(self.stats[index]), kind=kind)
+        AUDIO_PROCESS_CALLBACK_MAX.set_function(lambda: self.stats[MAX_CALLBACK_US] / 1e6)
+        logger.info(f"🔊 Processo audio isolato avviato (pid {self._process.pid}).")
+
+    def alive(self):
+        return self._process is not None and self._process.poll() is None
+
+    async def write(self, samples):
+        """Scrive tutta la voce nel ring; se è pieno aspetta che il processo audio la consumi."""
+        while len(samples):
+            written = self.playout.write(samples)
+            samples = samples[written:]
+            if len(samples):
+                if not self.alive():
+                    raise RuntimeError("Il processo audio è terminato.")
+                await asyncio.sleep(min(0.01, len(samples) / self.output_rate))
+
+    def latency(self):
+        """Tra quanto suonerà il prossimo campione scritto: voce in coda più latenza del dispositivo."""
+        return self.playout.available() / self.output_rate + self.stats[DEVICE_LATENCY_US] / 1e6
+
+    def flush(self):
+        self.playout.flush()
+
+    async def microphone(self, blocksize):
+        """Blocchi del microfono man mano che arrivano."""
+        block_s = blocksize / self.input_rate
+        while self.alive():
+            if self.capture.available() >= blocksize:
+                block = np.empty(blocksize, dtype=np.int16)
+                self.capture.read_into(block)
+                yield block.reshape(-1, 1)
+            else:
+                await asyncio.sleep(block_s / 2)
+
+    def _send(self, message):
+        if self.alive():
+            try:
+                self._process.stdin.write(json.dumps(message) + "\n")
+                self._process.stdin.flush()
+            except (BrokenPipeError, OSError) as e:
+                logger.warning(f"Comando al processo audio non inviato: {e}")
+
+    # Stessa interfaccia del music_manager di pygame, così il guardiano di Spotify lo può usare
+    def pause(self):
+        self._send({"cmd": "music", "playing": False})
+
+    def resume(self):
+        self._send({"cmd": "music", "playing": True})
+
+    def duck(self, gain):
+        self._send({"cmd": "duck", "gain": gain})
+
+    def counters(self):
+        return {kind: int(self.stats[index]) for kind, index in XRUN_KINDS.items()} | {
+            "callbacks": int(self.stats[CALLBACKS]), "max_callback_ms": self.stats[MAX_CALLBACK_US] / 1000}
+
+    def stop(self):
+        if self._process:
+            self._send({"cmd": "stop"})
+            try:
+                self._process.stdin.close()
+                self._process.wait(timeout=2)
+            except (OSError, subprocess.TimeoutExpired):
+                self._process.kill()
+            self._process = None
+        for ring in (self.playout, self.capture):
+            if ring: ring.close()
+        if self._stats_shm:
+            self.stats = None
+            self._stats_shm.close()
+            self._stats_shm.unlink()
+            self._stats_shm = None
+        self.playout = self.capture = None
+
+
+if __name__ == "__main__":
+    run_audio_process()
@@ -0,0 +1,574 @@
+# Progetto_Stabile/benchmark.py
+"""
+Benchmark offline della pipeline conversazionale.
+
+Fa girare ConversationalAgent o ElevenLabsClient contro il mock di ElevenLabs,
+con Spotify, OpenAI e la scheda audio finti, e misura throughput, latenze per
+fase, CPU e memoria. Non serve rete né hardware: gira su una qualsiasi macchina Linux.
+
+Esempi (con i file dal nome "umano" lo script è "Benchmark.py"):
+    python benchmark.py --scenario agent --turns 20 --json risultati.json
+    python benchmark.py --scenario agent --speed 1 --check   # verifica automatica: esce con 1 se qualcosa non torna
+    python benchmark.py --scenario client --baseline risultati.json
+    python benchmark.py --scenario load --sessions 8 --speed 1
+    python benchmark.py --scenario audio --stress-threads 4 [--audio-process]
+    python benchmark.py --scenario formats --speed 1 --bandwidth 40000
+"""
+import argparse
+import asyncio
+import base64
+import contextlib
+import gc
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+
+import numpy as np
+
+try:
+    import fake_backends
+except ModuleNotFoundError:
+    # File dal nome "umano" ("Fake Backends.py"): si carica dal percorso, poi il suo finder pensa agli altri
+    import importlib.util
+
+    _spec = importlib.util.spec_from_file_location(
+        "fake_backends", os.path.join(os.path.dirname(os.path.abspath(__file__)), "Fake Backends.py"))
+    fake_backends = importlib.util.module_from_spec(_spec)
+    sys.modules["fake_backends"] = fake_backends
+    _spec.loader.exec_module(fake_backends)
+
+fake_backends.install_fakes()
+
+from log_setup import setup_logging  # noqa: E402
+from mock_elevenlabs_server import (MockConvaiServer, chunk_sequence, load_session, synthetic_session,  # noqa: E402
+                                   ulaw_chunk_sequence)
+
+logger = logging.getLogger("Benchmark")
+
+# Metriche confrontate con la baseline: (chiave appiattita, True se "più alto è meglio")
+REGRESSION_KEYS = (
+    ("messages_per_s", True),
+    ("cpu_s", False),
+    ("cpu_percent_per_session", False),
+    ("audio_latency_ms.p95", False),
+    ("ping_rtt_ms.p95", False),
+    ("effect_drift_ms.p95", False),
+    ("tool_latency_ms.*.p95", False),
+    ("detection_latency_ms.p95", False),
+    ("rtf", False),
+    ("glitches", False),
+)
+
+
+def _summary(values_s):
+    """p50/p95/max in millisecondi di una lista di durate in secondi."""
+    if not values_s:
+        return {"count": 0}
+    ms = np.asarray(values_s) * 1000
+    return {"count": int(len(ms)), "p50": round(float(np.percentile(ms, 50)), 3),
+            "p95": round(float(np.percentile(ms, 95)), 3), "max": round(float(ms.max()), 3)}
+
+
+def _max_rss_mb():
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+async def _wait_until(predicate, timeout):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+
+
+async def bench_agent(events, speed=0.0, spotify_latency=0.0, timeout=60.0, bandwidth=None, output_format=None,
+                      black_box=None):
+    """Guida ConversationalAgent attraverso una sessione completa (con `black_box`: registrando su quel file)."""
+    import agent
+    import config
+    from spotify_scheduler import TokenBucket, spotify_scheduler
+
+    if not speed:
+        # A velocità 0 il tempo è compresso: il rate limit di Spotify misurerebbe solo attese finte
+        spotify_scheduler.bucket = TokenBucket(rate=1e9, capacity=1e9)
+    server = await MockConvaiServer(events, speed=speed, bandwidth=bandwidth).start()
+    agent.WEBSOCKET_URL = server.url
+    config.OUTPUT_FORMAT = output_format
+    config.BLACK_BOX_PATH = black_box
+    fake_backends.virtual_audio.reset()
+    fake_backends.spotify_state.reset_calls()
+    fake_backends.spotify_state.latency = spotify_latency
+    expected_chunks = sum(1 for e in events if e["message"].get("type") == "audio")
+
+    conversational_agent = agent.ConversationalAgent()
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    agent_task = asyncio.create_task(conversational_agent.start())
+
+    await asyncio.wait_for(server.replay_done.wait(), timeout=timeout)
+    # Aspettiamo che l'audio rimasto in coda venga scritto sul dispositivo virtuale
+    await _wait_until(lambda: conversational_agent.audio_player._queue.empty(), timeout=5)
+    await asyncio.sleep(0.05)
+    wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+    effects = conversational_agent.audio_player.effects
+    effect_drift = []
+    # Senza --realtime-audio l'audio "suona" istantaneamente: lo scarto degli effetti non ha senso
+    if effects and fake_backends.virtual_audio.realtime:
+        effects.flush()
+        effect_drift = [abs(d) for d in effects.drifts]
+
+    conversational_agent.stop()
+    agent_task.cancel()
+    await server.stop()
+    with contextlib.suppress(asyncio.CancelledError):
+        await agent_task
+
+    audio_latency = []
+    for written_at, _, head in fake_backends.virtual_audio.output_writes:
+        seq = chunk_sequence(head)
+        sent_at = server.stats["audio_sent_at"].get(seq)
+        if sent_at is not None:
+            audio_latency.append(written_at - sent_at)
+
+    return {
+        "scenario": "agent",
+        "wall_s": round(wall, 3),
+        "cpu_s": round(cpu, 3),
+        "cpu_percent": round(100 * cpu / wall, 1),
+        "max_rss_mb": _max_rss_mb(),
+        "messages_per_s": round(server.stats["messages_sent"] / wall, 1),
+        "downstream_kb_per_s": round(server.stats["bytes_sent"] / wall / 1024, 1),
+        "audio_chunks_played": f"{len(audio_latency)}/{expected_chunks}",
+        "audio_latency_ms": _summary(audio_latency),
+        "ping_rtt_ms": _summary(server.stats["ping_rtt"]),
+        "tool_latency_ms": {name: _summary(v) for name, v in server.stats["tool_latency"].items()},
+        "effect_drift_ms": _summary(effect_drift),
+        "mic_chunks_sent": server.stats["mic_chunks"],
+        "contextual_updates": len(server.stats["contextual_updates"]),
+        "spotify_calls": dict(fake_backends.spotify_state.calls),
+        "output_format": conversational_agent.output_format,
+    }
+
+
+async def bench_formats(events, formats, speed=1.0, bandwidth=None):
+    """Una sessione per formato: banda consumata, CPU di decodifica e buchi nella voce."""
+    import audio_core
+    import metrics
+
+    # Le sessioni sono in PCM16 a 24 kHz (SESSION_FORMAT del mock)
+    audio_s = sum(len(base64.b64decode(e["message"]["audio_event"]["audio_base_64"])) // 2
+                  for e in events if e["message"].get("type") == "audio") / 24000
+    results = {"scenario": "formats", "bandwidth_kb_per_s": bandwidth and round(bandwidth / 1024, 1), "formats": {}}
+    for encoding in formats:
+        decode_before = audio_core.AUDIO_DECODE_SECONDS.value(format=encoding)
+        underruns_before = metrics.AUDIO_UNDERRUNS.value()
+        run = await bench_agent(events, speed=speed, bandwidth=bandwidth, output_format=encoding)
+        results["formats"][encoding] = {
+            "wall_s": run["wall_s"],
+            "downstream_kb_per_s": run["downstream_kb_per_s"],
+            "wire_kb_per_audio_s": round(run["downstream_kb_per_s"] * run["wall_s"] / audio_s, 1),
+            "decode_us_per_audio_s": round(
+                (audio_core.AUDIO_DECODE_SECONDS.value(format=encoding) - decode_before) / audio_s * 1e6, 1),
+            "underruns": metrics.AUDIO_UNDERRUNS.value() - underruns_before,
+        }
+    return results
+
+
+async def bench_client(events, speed=0.0, timeout=60.0):
+    """Guida ElevenLabsClient + AudioManager attraverso una sessione completa."""
+    import audio_manager
+    import elevenlabs_client
+
+    server = await MockConvaiServer(events, speed=speed, close_on_end=True).start()
+    elevenlabs_client.ELEVENLABS_WS_URI = server.url
+    manager = audio_manager.AudioManager()
+    received_at = {}
+    original_queue = manager.queue_audio_chunk
+
+    async def timed_queue(audio_base64):
+        # I primi 8 caratteri base64 contengono i byte µ-law con la sequenza
+        seq = ulaw_chunk_sequence(base64.b64decode(audio_base64[:8]))
+        await original_queue(audio_base64)
+        received_at[seq] = time.perf_counter()
+
+    manager.queue_audio_chunk = timed_queue
+    client = elevenlabs_client.ElevenLabsClient("agent_fake", manager)
+
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        await client.connect_dashboard_style()
+        await asyncio.wait_for(client.handle_messages(), timeout=timeout)
+    wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+    await server.stop()
+
+    latency = [received_at[seq] - sent for seq, sent in server.stats["audio_sent_at"].items() if seq in received_at]
+    return {
+        "scenario": "client",
+        "wall_s": round(wall, 3),
+        "cpu_s": round(cpu, 3),
+        "cpu_percent": round(100 * cpu / wall, 1),
+        "max_rss_mb": _max_rss_mb(),
+        "messages_per_s": round(server.stats["messages_sent"] / wall, 1),
+        "audio_chunks_queued": manager.audio_queue.qsize(),
+        "audio_latency_ms": _summary(latency),
+    }
+
+
+# --- Rituali: voce sintetica con formanti, per non dipendere da registrazioni ---
+_VOWELS = {"a": (800, 1200), "e": (500, 1900), "i": (300, 2300), "o": (500, 900), "u": (320, 800)}
+RITUAL_PHRASE = "aoeiu"
+
+
+def _synthetic_phrase(vowels, stretch, rng, rate=16000):
+    """Sequenza di vocali (armoniche pesate sulle formanti F1/F2), lunga circa 0.15 s * stretch per vocale."""
+    parts = []
+    for vowel in vowels:
+        f1, f2 = _VOWELS[vowel]
+        n = int(rate * 0.15 * stretch * rng.uniform(0.9, 1.1))
+        t = np.arange(n) / rate
+        f0 = rng.uniform(110, 150)
+        harmonics = np.arange(1, 30)[:, None]
+        weights = np.exp(-((harmonics * f0 - f1) / 150) ** 2) + 0.6 * np.exp(-((harmonics * f0 - f2) / 200) ** 2)
+        voice = (weights * np.sin(2 * np.pi * harmonics * f0 * t)).sum(axis=0)
+        envelope = np.minimum(1.0, np.minimum(t, t[::-1]) / 0.02)
+        parts.append(voice * envelope)
+    signal = np.concatenate(parts)
+    return signal / np.abs(signal).max() * 0.3
+
+
+def _pcm(signal, rng, snr_db=20):
+    noise = rng.normal(0, np.sqrt(np.mean(signal ** 2)) / 10 ** (snr_db / 20) if signal.any() else 0.001, len(signal))
+    return np.clip((signal + noise) * 32767, -32768, 32767).astype(np.int16)
+
+
+async def bench_load(events, sessions=4, speed=1.0, timeout=120.0):
+    """N barili sotto lo stesso supervisore, contro lo stesso mock: CPU per sessione concorrente."""
+    from spotify_scheduler import TokenBucket, spotify_scheduler
+    from supervisor import Supervisor
+
+    if not speed:
+        spotify_scheduler.bucket = TokenBucket(rate=1e9, capacity=1e9)
+    server = await MockConvaiServer(events, speed=speed).start()
+    fake_backends.virtual_audio.reset()
+    fake_backends.spotify_state.reset_calls()
+    expected_chunks = sessions * sum(1 for e in events if e["message"].get("type") == "audio")
+    barrels = [{"NAME": f"barile-{i}", "WEBSOCKET_URL": server.url, "OUTPUT_DEVICE_INDEX": i,
+                "SPOTIFY_DEVICE_NAME": fake_backends.FAKE_CONFIG["SPOTIFY_DEVICE_NAME"]} for i in range(sessions)]
+
+    supervisor = Supervisor(barrels)
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    run_task = asyncio.create_task(supervisor.run())
+
+    await asyncio.wait_for(_wait_until(lambda: server.stats["replays_done"] >= sessions, timeout), timeout=timeout + 1)
+    await _wait_until(lambda: all(a.audio_player._queue.empty() for a in supervisor.agents), timeout=5)
+    await asyncio.sleep(0.05)
+    wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+
+    supervisor.stop()
+    await server.stop()
+    with contextlib.suppress(asyncio.CancelledError):
+        await run_task
+
+    return {
+        "scenario": "load",
+        "sessions": sessions,
+        "completed_sessions": server.stats["replays_done"],
+        "wall_s": round(wall, 3),
+        "cpu_s": round(cpu, 3),
+        "cpu_percent": round(100 * cpu / wall, 1),
+        "cpu_percent_per_session": round(100 * cpu / wall / sessions, 2),
+        "max_rss_mb": _max_rss_mb(),
+        "messages_per_s": round(server.stats["messages_sent"] / wall, 1),
+        "audio_chunks_played": f"{len(fake_backends.virtual_audio.output_writes)}/{expected_chunks}",
+        "ping_rtt_ms": _summary(server.stats["ping_rtt"]),
+        "tool_latency_ms": {name: _summary(v) for name, v in server.stats["tool_latency"].items()},
+        "spotify_calls": dict(fake_backends.spotify_state.calls),
+    }
+
+
+# --- Audio sotto carico: processo audio isolato contro playout nel processo dell'agente ---
+# Il processo audio figlio gira anche lui con i backend finti
+_FAKE_AUDIO_LAUNCHER = (
+    "import importlib.util, runpy, sys\n"
+    "spec = importlib.util.spec_from_file_location('fake_backends', sys.argv[1])\n"
+    "fake_backends = importlib.util.module_from_spec(spec)\n"
+    "sys.modules['fake_backends'] = fake_backends\n"
+    "spec.loader.exec_module(fake_backends)\n"
+    "fake_backends.install_fakes()\n"
+    "sys.argv = sys.argv[2:]\n"
+    "runpy.run_path(sys.argv[0], run_name='__main__')\n"
+)
+# Buco minimo tra due scritture perché il dispositivo resti davvero senza voce
+PLAYOUT_GAP_S = 0.01
+
+
+def _tool_stress(stop):
+    """Un tool pesante in puro Python: JSON grandi e cicli di oggetti che tengono impegnati GIL e GC."""
+    payload = {"tracks": [{"name": f"Brano {i}", "artists": [{"name": "Ciurma"}] * 3, "popularity": i}
+                          for i in range(2000)]}
+    while not stop.is_set():
+        data = json.loads(json.dumps(payload))
+        for track in data["tracks"]:
+            track["self"] = track
+        gc.collect()
+
+
+def _playout_gaps(writes, rate):
+    """Buchi in mezzo a una risposta tra le scritture sul dispositivo virtuale (playout nel processo dell'agente)."""
+    from audio_core import UNDERRUN_MAX_GAP_S
+
+    gaps = 0
+    for (started, samples, _), (next_started, _, _) in zip(writes, writes[1:]):
+        gap = next_started - (started + samples / rate)
+        if PLAYOUT_GAP_S < gap < UNDERRUN_MAX_GAP_S:
+            gaps += 1
+    return gaps
+
+
+async def bench_audio(events, speed=2.0, stress_threads=4, isolated=False, timeout=120.0):
+    """Voce del Capitano in tempo reale mentre dei tool pesanti si contendono il GIL: quanti buchi si sentono."""
+    import agent
+    import audio_process
+    import config
+
+    server = await MockConvaiServer(events, speed=speed).start()
+    agent.WEBSOCKET_URL = server.url
+    fake_backends.virtual_audio.reset()
+    fake_backends.virtual_audio.realtime = True
+    config.AUDIO_PROCESS = isolated
+    audio_process.LAUNCHER = [sys.executable, "-c", _FAKE_AUDIO_LAUNCHER, fake_backends.__file__]
+
+    stop_stress = threading.Event()
+    stress = [threading.Thread(target=_tool_stress, args=(stop_stress,), daemon=True) for _ in range(stress_threads)]
+    conversational_agent = agent.ConversationalAgent()
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    agent_task = asyncio.create_task(conversational_agent.start())
+    for thread in stress:
+        thread.start()
+
+    await asyncio.wait_for(server.replay_done.wait(), timeout=timeout)
+    process = conversational_agent.audio_process
+    await _wait_until(lambda: conversational_agent.audio_player._queue.empty()
+                      and not (process and process.playout.available()), timeout=30)
+    await asyncio.sleep(0.2)
+    wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+    stop_stress.set()
+    counters = process.counters() if process else None
+
+    conversational_agent.stop()
+    agent_task.cancel()
+    await server.stop()
+    with contextlib.suppress(asyncio.CancelledError):
+        await agent_task
+    for thread in stress:
+        thread.join()
+
+    if counters:
+        glitches = counters["underrun"] + counters["output_xrun"]
+    else:
+        glitches = _playout_gaps(fake_backends.virtual_audio.output_writes, agent.TTS_OUTPUT_RATE)
+    return {
+        "scenario": "audio",
+        "audio_process": isolated,
+        "stress_threads": stress_threads,
+        "wall_s": round(wall, 3),
+        "cpu_s": round(cpu, 3),
+        "glitches": glitches,
+        "audio_process_counters": counters,
+        "ping_rtt_ms": _summary(server.stats["ping_rtt"]),
+    }
+
+
+def bench_ritual(occurrences=20, block_ms=20, seed=0, single_core=True):
+    """Latenza di riconoscimento e CPU dello spotter locale su un flusso con frasi, distrattori e rumore."""
+    import ritual_spotter
+
+    if single_core and hasattr(os, "sched_setaffinity"):
+        # Un solo core, come sul Raspberry Pi dove il resto del sistema occupa gli altri
+        os.sched_setaffinity(0, {min(os.sched_getaffinity(0))})
+    rng = np.random.default_rng(seed)
+    rate = ritual_spotter.SAMPLE_RATE
+    extractor = ritual_spotter.MfccExtractor(rate)
+    templates = [extractor.features(_pcm(_synthetic_phrase(RITUAL_PHRASE, stretch, rng), rng))
+                 for stretch in (0.95, 1.0, 1.05)]
+    spotter = ritual_spotter.RitualSpotter([ritual_spotter.Ritual("tempesta", templates)])
+
+    # Flusso: silenzio, distrattore (altre vocali), silenzio, frase rituale a velocità variabile
+    segments, phrase_spans, position = [], [], 0
+    for _ in range(occurrences):
+        distractor = "".join(rng.permutation(list(RITUAL_PHRASE)))
+        if distractor == RITUAL_PHRASE:
+            distractor = distractor[::-1]
+        for signal, is_phrase in ((np.zeros(int(rate * 0.8)), False),
+                                  (_synthetic_phrase(distractor, rng.uniform(0.8, 1.25), rng), False),
+                                  (np.zeros(int(rate * 0.8)), False),
+                                  (_synthetic_phrase(RITUAL_PHRASE, rng.uniform(0.8, 1.25), rng), True)):
+            pcm = _pcm(signal, rng)
+            if is_phrase:
+                phrase_spans.append((position, position + len(pcm)))
+            segments.append(pcm)
+            position += len(pcm)
+    stream = np.concatenate(segments)
+
+    block = int(rate * block_ms / 1000)
+    detections, block_times = [], []
+    cpu_start = time.process_time()
+    for start in range(0, len(stream), block):
+        began = time.perf_counter()
+        ritual = spotter.process(stream[start:start + block], time.monotonic())
+        elapsed = time.perf_counter() - began
+        block_times.append(elapsed)
+        if ritual:
+            detections.append((min(start + block, len(stream)), elapsed))
+    cpu = time.process_time() - cpu_start
+    audio_s = len(stream) / rate
+
+    latencies, matched, false_positives = [], set(), 0
+    for detected_at, elapsed in detections:
+        span = next((i for i, (begin, end) in enumerate(phrase_spans) if begin < detected_at <= end + rate * 0.3), None)
+        if span is None or span in matched:
+            false_positives += 1
+            continue
+        matched.add(span)
+        # Ritardo in audio (la frase deve essere finita nel blocco) + tempo di calcolo
+        latencies.append(max(0, detected_at - phrase_spans[span][1]) / rate + elapsed)
+
+    return {
+        "scenario": "ritual",
+        "audio_s": round(audio_s, 1),
+        "cpu_s": round(cpu, 3),
+        "rtf": round(cpu / audio_s, 4),
+        "block_ms": _summary(block_times),
+        "detection_latency_ms": _summary(latencies),
+        "hits": len(matched),
+        "misses": len(phrase_spans) - len(matched),
+        "false_positives": false_positives,
+    }
+
+
+def _flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def find_regressions(results, baseline, tolerance):
+    """Confronta con la baseline: restituisce le metriche peggiorate oltre la tolleranza."""
+    current, previous = _flatten(results), _flatten(baseline)
+    regressions = []
+    for pattern, higher_is_better in REGRESSION_KEYS:
+        head, _, tail = pattern.partition("*")
+        for key, old in previous.items():
+            matches = key == pattern if not tail else (key.startswith(head) and key.endswith(tail))
+            if not matches or key not in current or not old:
+                continue
+            change = (current[key] - old) / old
+            if (change < -tolerance) if higher_is_better else (change > tolerance):
+                regressions.append(f"{key}: {old} -> {current[key]} ({change:+.0%})")
+    return regressions
+
+
+def check_results(results, events, speed):
+    """Controlli minimi di correttezza di una corsa (--check): restituisce i problemi trovati."""
+    problems = []
+    if results["scenario"] == "agent":
+        played, _, expected = results["audio_chunks_played"].partition("/")
+        # A velocità 0 la risposta successiva arriva prima che la precedente finisca di suonare
+        # e la interrompe, come farebbe il server vero: lì si controlla solo che l'audio arrivi
+        if (played != expected) if speed else not int(played):
+            problems.append(f"chunk audio suonati {played} su {expected}")
+        called = {e["message"]["client_tool_call"]["tool_name"] for e in events
+                  if e["message"].get("type") == "client_tool_call"}
+        for name in sorted(called):
+            if not results["tool_latency_ms"].get(name, {}).get("count"):
+                problems.append(f"nessuna risposta al tool '{name}'")
+    elif results["scenario"] == "client":
+        expected = sum(1 for e in events if e["message"].get("audio"))
+        if results["audio_latency_ms"]["count"] != expected:
+            problems.append(f"chunk audio ricevuti {results['audio_latency_ms']['count']} su {expected}")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark offline della pipeline conversazionale.")
+    parser.add_argument("--scenario", choices=("agent", "client", "ritual", "load", "audio", "formats"), default="agent")
+    parser.add_argument("--session", help="Sessione registrata (JSONL). Di default una sessione sintetica.")
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--chunks-per-turn", type=int, default=20)
+    parser.add_argument("--speed", type=float, default=0.0, help="0 = più veloce possibile, 1 = tempo reale")
+    parser.add_argument("--bandwidth", type=float, help="Banda simulata del mock ElevenLabs (byte/s)")
+    parser.add_argument("--spotify-latency", type=float, default=0.0, help="Latenza simulata delle API Spotify (s)")
+    parser.add_argument("--sessions", type=int, default=4, help="Barili concorrenti (scenario load)")
+    parser.add_argument("--occurrences", type=int, default=20, help="Frasi rituali nel flusso (scenario ritual)")
+    parser.add_argument("--stress-threads", type=int, default=4, help="Tool pesanti concorrenti (scenario audio)")
+    parser.add_argument("--audio-process", action="store_true", help="Voce sul processo audio isolato (scenario audio)")
+    parser.add_argument("--realtime-audio", action="store_true", help="Il dispositivo di output suona in tempo reale")
+    parser.add_argument("--black-box", help="Registra la sessione in questa scatola nera (scenario agent)")
+    parser.add_argument("--json", help="Salva i risultati in questo file")
+    parser.add_argument("--baseline", help="Risultati precedenti con cui confrontarsi")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--check", action="store_true", help="Verifica i risultati (scenari agent e client)")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args(argv)
+
+    # Prima dell'import dell'agente: il livello scelto qui vale per tutta la corsa
+    setup_logging(level=args.log_level)
+    fake_backends.virtual_audio.realtime = args.realtime_audio
+
+    if args.scenario == "ritual":
+        events = None
+    elif args.session:
+        events = load_session(args.session)
+    else:
+        flavor = "client" if args.scenario == "client" else "agent"
+        events = synthetic_session(turns=args.turns, chunks_per_turn=args.chunks_per_turn, flavor=flavor)
+
+    if args.scenario == "ritual":
+        results = bench_ritual(occurrences=args.occurrences)
+    elif args.scenario == "audio":
+        results = asyncio.run(bench_audio(events, speed=args.speed or 2.0, stress_threads=args.stress_threads,
+                                          isolated=args.audio_process))
+    elif args.scenario == "load":
+        results = asyncio.run(bench_load(events, sessions=args.sessions, speed=args.speed))
+    elif args.scenario == "agent":
+        results = asyncio.run(bench_agent(events, speed=args.speed, spotify_latency=args.spotify_latency,
+                                          bandwidth=args.bandwidth, black_box=args.black_box))
+    elif args.scenario == "formats":
+        formats = fake_backends.FAKE_CONFIG["OUTPUT_FORMATS"]
+        results = asyncio.run(bench_formats(events, formats, speed=args.speed or 1.0, bandwidth=args.bandwidth))
+    else:
+        results = asyncio.run(bench_client(events, speed=args.speed))
+
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+    if args.check:
+        problems = check_results(results, events, args.speed)
+        if problems:
+            print("❌ Verifica fallita:")
+            for line in problems:
+                print(f"  - {line}")
+            return 1
+        print("✅ Verifica superata.")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = find_regressions(results, json.load(f), args.tolerance)
+        if regressions:
+            print("❌ Regressioni rispetto alla baseline:")
+            for line in regressions:
+                print(f"  - {line}")
+            return 1
+        print("✅ Nessuna regressione rispetto alla baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
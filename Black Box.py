@@ -0,0 +1,226 @@
+# Progetto_Stabile/black_box.py
+"""
+Scatola nera del barile: gli ultimi minuti di microfono, voce del Capitano ed eventi
+(websocket, tool, riconnessioni) in un file ad anello mappato in memoria.
+
+Il file ha dimensione fissa e sopravvive a crash e riavvii: dopo uno spettacolo andato storto
+si esporta la finestra che interessa e si vede se il problema era la rete, la scheda audio o un tool.
+
+    python black_box.py export /var/lib/rumbtide/barile.bb --last 60 --out glitch
+    # -> glitch_mic.wav, glitch_tts.wav, glitch_events.jsonl
+
+Scrive un solo thread (l'event loop): niente lock. I campioni vanno direttamente nella mappa,
+una sola copia per blocco; gli eventi sono record a dimensione fissa.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+import wave
+
+import numpy as np
+
+logger = logging.getLogger("BlackBox")
+
+MAGIC = "rumbtide-blackbox"
+VERSION = 1
+HEADER_BYTES = 4096
+# I contatori (posizioni di scrittura) stanno in fondo all'intestazione, dopo il JSON del layout
+COUNTERS_OFFSET = 3072
+MIC_SAMPLES, MIC_BLOCKS, TTS_SAMPLES, TTS_BLOCKS, EVENTS = range(5)
+
+# Indice dei blocchi audio: quando (wall clock) e dove sono finiti nell'anello
+BLOCK_DTYPE = np.dtype([("t", "<f8"), ("pos", "<u8"), ("n", "<u8")])
+# Un evento: 256 byte, testo UTF-8 troncato
+EVENT_DTYPE = np.dtype([("t", "<f8"), ("kind", "S16"), ("len", "<u2"), ("data", "S230")])
+# Blocchi indicizzati al secondo, per flusso (microfono a 20 blocchi/s, voce di solito meno)
+BLOCKS_PER_S = 50
+EVENTS_PER_S = 50
+
+
+def _layout(minutes, mic_rate, tts_rate):
+    """Offset e capacità di ogni sezione del file."""
+    seconds = int(minutes * 60)
+    sections = {}
+    offset = HEADER_BYTES
+    for name, dtype, count in (("mic", np.int16, seconds * mic_rate), ("mic_blocks", BLOCK_DTYPE, seconds * BLOCKS_PER_S),
+                               ("tts", np.int16, seconds * tts_rate), ("tts_blocks", BLOCK_DTYPE, seconds * BLOCKS_PER_S),
+                               ("events", EVENT_DTYPE, seconds * EVENTS_PER_S)):
+        sections[name] = {"offset": offset, "count": count}
+        offset += count * np.dtype(dtype).itemsize
+    return {"magic": MAGIC, "version": VERSION, "minutes": minutes, "mic_rate": mic_rate, "tts_rate": tts_rate,
+            "sections": sections, "size": offset}
+
+
+def _read_layout(path):
+    with open(path, "rb") as f:
+        raw = f.read(COUNTERS_OFFSET).rstrip(b"\0")
+    try:
+        layout = json.loads(raw)
+    except ValueError:
+        return None
+    return layout if layout.get("magic") == MAGIC and layout.get("version") == VERSION else None
+
+
+class _Views:
+    """Viste numpy sulle sezioni del file mappato."""
+
+    def __init__(self, path, layout, mode):
+        self.layout = layout
+        self._map = np.memmap(path, dtype=np.uint8, mode=mode, shape=(layout["size"],))
+        self.counters = np.ndarray((8,), dtype=np.uint64, buffer=self._map, offset=COUNTERS_OFFSET)
+        sections = layout["sections"]
+
+        def view(name, dtype):
+            return np.ndarray((sections[name]["count"],), dtype=dtype, buffer=self._map,
+                              offset=sections[name]["offset"])
+
+        self.mic, self.mic_blocks = view("mic", np.int16), view("mic_blocks", BLOCK_DTYPE)
+        self.tts, self.tts_blocks = view("tts", np.int16), view("tts_blocks", BLOCK_DTYPE)
+        self.events = view("events", EVENT_DTYPE)
+
+    def close(self):
+        self.counters = self.mic = self.mic_blocks = self.tts = self.tts_blocks = self.events = None
+        self._map._mmap.close()
+        self._map = None
+
+
+class BlackBox:
+    """
+    Registratore sempre acceso. Se il file esiste con lo stesso layout si continua da dove era
+    rimasto (il crash che si vuole indagare è lì dentro); se il layout è cambiato, il vecchio
+    file viene tenuto con suffisso .old.
+    """
+
+    def __init__(self, path, minutes=5, mic_rate=16000, tts_rate=24000):
+        self.path = path
+        layout = _layout(minutes, mic_rate, tts_rate)
+        existing = _read_layout(path) if os.path.exists(path) else None
+        if existing != layout:
+            if os.path.exists(path):
+                os.replace(path, path + ".old")
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(json.dumps(layout).encode().ljust(COUNTERS_OFFSET, b"\0"))
+                f.truncate(layout["size"])
+        self._views = _Views(path, layout, "r+")
+        logger.info(f"📼 Scatola nera attiva: {path} ({minutes} minuti, {layout['size'] / 1e6:.0f} MB).")
+
+    def _audio(self, samples, ring, blocks, samples_counter, blocks_counter):
+        counters = self._views.counters
+        n = len(samples)
+        if n > len(ring):
+            samples = samples[-len(ring):]
+            n = len(ring)
+        position = int(counters[samples_counter])
+        start = position % len(ring)
+        first = min(n, len(ring) - start)
+        ring[start:start + first] = samples[:first]
+        ring[:n - first] = samples[first:]
+        block = int(counters[blocks_counter])
+        entry = blocks[block % len(blocks)]
+        entry["t"], entry["pos"], entry["n"] = time.time(), position, n
+        # Prima i dati, poi i contatori: chi legge non vede mai un blocco a metà
+        counters[samples_counter] = position + n
+        counters[blocks_counter] = block + 1
+
+    def mic(self, block):
+        """Un blocco del microfono (int16) così come parte verso ElevenLabs."""
+        views = self._views
+        if views: self._audio(block.reshape(-1), views.mic, views.mic_blocks, MIC_SAMPLES, MIC_BLOCKS)
+
+    def tts(self, samples):
+        """Un chunk della voce del Capitano (int16) mentre viene scritto sul dispositivo."""
+        views = self._views
+        if views: self._audio(samples.reshape(-1), views.tts, views.tts_blocks, TTS_SAMPLES, TTS_BLOCKS)
+
+    def event(self, kind, text):
+        """Un evento testuale (es. kind='ws_in', 'tool', 'reconnect'); oltre 230 byte viene troncato."""
+        views = self._views
+        if not views: return
+        data = text.encode("utf-8", "replace")[:EVENT_DTYPE["data"].itemsize]
+        index = int(views.counters[EVENTS])
+        record = views.events[index % len(views.events)]
+        record["t"], record["kind"], record["len"], record["data"] = time.time(), kind, len(data), data
+        views.counters[EVENTS] = index + 1
+
+    def close(self):
+        if self._views:
+            self._views.close()
+            self._views = None
+
+
+# --- Esportazione ---
+def _blocks_in_window(blocks, count, start, end):
+    live = blocks if count >= len(blocks) else blocks[:count]
+    return live[(live["t"] >= start) & (live["t"] <= end)]
+
+
+def _export_audio(ring, blocks, written, rate, start, end, path):
+    """I blocchi della finestra, ognuno al suo istante (silenzio dove non c'è audio)."""
+    out = np.zeros(int((end - start) * rate), dtype=np.int16)
+    for block in np.sort(blocks, order="t"):
+        # Campioni già sovrascritti dall'anello: persi
+        if block["pos"] < written - len(ring):
+            continue
+        at = int((block["t"] - start) * rate)
+        n = min(int(block["n"]), len(out) - at)
+        if at < 0 or n <= 0:
+            continue
+        indices = (int(block["pos"]) + np.arange(n)) % len(ring)
+        out[at:at + n] = ring[indices]
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(out.tobytes())
+    return len(out) / rate
+
+
+def export(path, out_prefix, last=None, start=None, end=None):
+    """Scrive <out>_mic.wav, <out>_tts.wav e <out>_events.jsonl per la finestra richiesta."""
+    layout = _read_layout(path)
+    if layout is None:
+        raise ValueError(f"{path} non è un file della scatola nera.")
+    views = _Views(path, layout, "r")
+    try:
+        counters = [int(c) for c in views.counters]
+        latest = float(max(views.mic_blocks["t"].max(), views.tts_blocks["t"].max(), views.events["t"].max()))
+        end = end or latest
+        start = start or end - (last or 60)
+        _export_audio(views.mic, _blocks_in_window(views.mic_blocks, counters[MIC_BLOCKS], start, end),
+                      counters[MIC_SAMPLES], layout["mic_rate"], start, end, f"{out_prefix}_mic.wav")
+        _export_audio(views.tts, _blocks_in_window(views.tts_blocks, counters[TTS_BLOCKS], start, end),
+                      counters[TTS_SAMPLES], layout["tts_rate"], start, end, f"{out_prefix}_tts.wav")
+        events = _blocks_in_window(views.events, counters[EVENTS], start, end)
+        with open(f"{out_prefix}_events.jsonl", "w", encoding="utf-8") as f:
+            for record in np.sort(events, order="t"):
+                f.write(json.dumps({"t": round(float(record["t"]), 4), "offset_s": round(float(record["t"]) - start, 4),
+                                    "kind": record["kind"].decode(),
+                                    "text": bytes(record["data"][:record["len"]]).decode("utf-8", "replace")},
+                                   ensure_ascii=False) + "\n")
+        return {"start": start, "end": end, "events": len(events)}
+    finally:
+        views.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scatola nera del barile.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_cmd = commands.add_parser("export", help="Esporta una finestra in WAV + JSONL")
+    export_cmd.add_argument("file")
+    export_cmd.add_argument("--out", default="scatola_nera", help="Prefisso dei file esportati")
+    export_cmd.add_argument("--last", type=float, help="Gli ultimi N secondi registrati (default 60)")
+    export_cmd.add_argument("--start", type=float, help="Inizio della finestra (epoch, secondi)")
+    export_cmd.add_argument("--end", type=float, help="Fine della finestra (epoch, secondi)")
+    args = parser.parse_args(argv)
+
+    summary = export(args.file, args.out, last=args.last, start=args.start, end=args.end)
+    print(f"Esportati {summary['end'] - summary['start']:.1f}s ({summary['events']} eventi) in {args.out}_*.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
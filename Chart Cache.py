@@ -0,0 +1,113 @@
+# Progetto_Stabile/chart_cache.py
+"""
+Playlist di classifica già risolte, per (nome, proprietario): id, nome e URI delle tracce.
+
+Una classifica cambia al massimo una volta al giorno, mentre risolverla costa una ricerca,
+un filtro sul proprietario e la lettura delle tracce. Qui la risoluzione avviene in background:
+le classifiche di config.CHART_PLAYLISTS all'avvio e poi ogni CHART_REFRESH_S, quelle chieste
+dall'agente dalla prima richiesta in poi. Una voce scaduta viene restituita subito e aggiornata
+dietro le quinte (stale-while-revalidate); solo la prima richiesta di una classifica mai vista aspetta.
+"""
+import asyncio
+import logging
+import time
+
+import metrics
+
+logger = logging.getLogger("ChartCache")
+
+# Classifiche tenute in cache: nome e proprietario arrivano dall'LLM, quindi il numero va limitato
+MAX_ENTRIES = 32
+
+CHART_CACHE_RESULTS = metrics.registry.counter(
+    "rumbtide_chart_cache_total", "Esiti della cache delle classifiche (hit, stale, miss).", ("result",))
+CHART_REFRESHES = metrics.registry.counter(
+    "rumbtide_chart_refreshes_total", "Risoluzioni delle classifiche, per esito.", ("status",))
+
+
+class ChartCache:
+    """
+    `resolve(name, owner, background)` è la coroutine che interroga Spotify e restituisce
+    {"id", "name", "track_uris"} oppure None se la classifica non esiste.
+    Va usata da un solo event loop.
+    """
+
+    def __init__(self, resolve, refresh_s=6 * 3600, max_entries=MAX_ENTRIES):
+        self.resolve = resolve
+        self.refresh_s = refresh_s
+        self.max_entries = max_entries
+        # (nome, proprietario) -> (istante della risoluzione, voce), dalla meno usata di recente
+        self._entries = {}
+        self._inflight = {}
+        self._task = None
+
+    async def get(self, name, owner):
+        key = (name, owner)
+        cached = self._entries.get(key)
+        if cached is None:
+            CHART_CACHE_RESULTS.inc(result="miss")
+            return await asyncio.shield(self._revalidate(key, background=False))
+        resolved_at, entry = cached
+        self._entries[key] = self._entries.pop(key)
+        if time.monotonic() - resolved_at > self.refresh_s:
+            CHART_CACHE_RESULTS.inc(result="stale")
+            self._revalidate(key, background=True)
+        else:
+            CHART_CACHE_RESULTS.inc(result="hit")
+        return entry
+
+    def invalidate(self, name, owner):
+        """La voce non va più bene (es. playlist rimossa): la prossima richiesta la risolve di nuovo."""
+        self._entries.pop((name, owner), None)
+
+    def _revalidate(self, key, background):
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._inflight[key] = asyncio.get_running_loop().create_task(self._refresh(key, background))
+            task.add_done_callback(self._refresh_done)
+        return task
+
+    async def _refresh(self, key, background):
+        try:
+            entry = await self.resolve(*key, background)
+        finally:
+            del self._inflight[key]
+        if not entry:
+            # Playlist rimossa o rinominata: la voce vecchia non va più servita
+            if self._entries.pop(key, None):
+                logger.info(f"📉 Classifica '{key[0]}' di '{key[1]}' non più trovata: tolta dalla cache.")
+            return entry
+        self._entries.pop(key, None)
+        self._entries[key] = (time.monotonic(), entry)
+        while len(self._entries) > self.max_entries:
+            del self._entries[next(iter(self._entries))]
+        logger.info(f"📈 Classifica '{entry['name']}' aggiornata ({len(entry['track_uris'])} tracce).")
+        return entry
+
+    @staticmethod
+    def _refresh_done(task):
+        if task.cancelled():
+            return
+        error = task.exception()
+        CHART_REFRESHES.inc(status="error" if error else "success")
+        if error:
+            # Chi aspettava riceve l'errore; in background resta la voce vecchia, meglio di niente
+            logger.warning(f"Aggiornamento della classifica fallito: {error}")
+
+    async def _refresh_loop(self, playlists):
+        keys = [tuple(p) for p in playlists]
+        while True:
+            for key in set(keys) | set(self._entries):
+                try: await self._revalidate(key, background=True)
+                except Exception: pass
+            await asyncio.sleep(self.refresh_s)
+
+    def start(self, playlists=()):
+        """Risolve subito `playlists` ([nome, proprietario]) e poi aggiorna tutto ogni refresh_s."""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._refresh_loop(playlists))
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
@@ -27,3 +27,122 @@ SPOTIFY_CACHE_PATH = ".spotify_cache"
 
 # Questo non è necessario per il flusso 'client_credentials'
 # SPOTIPY_REDIRECT_URI = "http://localhost:**
+
+# --- Metriche (endpoint Prometheus locale) ---
+# Porta su cui esporre /metrics. None per disattivare l'endpoint.
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = None
+
+# --- Watchdog dell'event loop ---
+# Oltre questa soglia (secondi) il loop è considerato bloccato e lo stack viene loggato.
+# None per disattivare il watchdog.
+LOOP_WATCHDOG_THRESHOLD_S = 0.1
+
+# --- Profiler a campionamento (kill -USR2 <pid> oppure /profile sull'endpoint metriche) ---
+# Cartella dei profili (collapsed stacks per flamegraph/speedscope), campioni al secondo e durata di default
+PROFILE_DIR = "profili"
+PROFILER_HZ = 50
+PROFILE_SECONDS = 30
+
+# --- Stato di Spotify inviato all'agente ---
+# Se True l'agente avvia il Guardiano e manda a ElevenLabs un contextual_update
+# a ogni cambio di canzone o di play/pausa, così il modello non deve chiedere get_current_song.
+SPOTIFY_STATE_PUSH = True
+# Se True il Guardiano mette in pausa la musica di sottofondo quando Spotify suona e la riprende
+# quando si ferma. Indipendente da SPOTIFY_STATE_PUSH: di default la musica non viene toccata.
+SPOTIFY_PAUSES_MUSIC = False
+
+# --- Classifiche di play_top_charts ---
+# Playlist [nome, proprietario] risolte all'avvio e tenute in cache: "metti la classifica" costa un solo start_playback
+CHART_PLAYLISTS = [["Hit Del Momento 2025", "peermusic"]]
+# Ogni quanto ririsolverle in background (secondi); una voce scaduta si usa lo stesso mentre si aggiorna
+CHART_REFRESH_S = 6 * 3600
+
+# --- Effetti fisici sincronizzati con la voce ---
+# "serial" (Arduino), "gpio" (Raspberry Pi), "simulated" (solo log/test) oppure None per disattivarli.
+EFFECTS_BACKEND = None
+EFFECTS_SERIAL_PORT = "/dev/ttyACM0"
+EFFECTS_SERIAL_BAUDRATE = 115200
+# Pin BCM per il backend GPIO; JAW è la mascella (PWM), gli altri sono impulsi
+EFFECTS_GPIO_PINS = {"JAW": 18, "SMOKE": 17, "CHAINS": 27, "LIGHTS": 22}
+# Parole pronunciate dal Capitano che fanno partire un effetto nel momento esatto in cui le dice
+EFFECT_WORD_CUES = {"fumo": "SMOKE", "catene": "CHAINS", "maledizione": "LIGHTS", "tempesta": "LIGHTS"}
+
+# --- Rituali riconosciuti in locale (senza passare dal cloud) ---
+# Per ogni rituale: cartella con 3+ registrazioni WAV della frase (python ritual_spotter.py --record ...),
+# stinger audio opzionale ed effetti [secondi dall'inizio, comando]. Dizionario vuoto per disattivare.
+# Esempio:
+# RITUALS = {
+#     "tempesta": {"templates": "rituali/tempesta", "stinger": "rituali/tuono.wav",
+#                  "effects": [[0.0, "LIGHTS"], [0.6, "SMOKE"], [1.2, "CHAINS"]],
+#                  "announce": "Il mozzo ha evocato la tempesta: reagisci da Capitano."},
+# }
+RITUALS = {}
+
+# --- Battute fisse del Capitano pre-registrate (python voice_lines.py --rebuild) ---
+# Cartella della cache; None per far dire tutto al TTS nel cloud.
+VOICE_LINES_DIR = "voice_lines"
+# Quante battute tenere mappate in memoria contemporaneamente
+VOICE_LINES_MAX_MAPPED = 32
+# Voce del Capitano (la stessa dell'agente ElevenLabs) e modello usati per sintetizzare la cache
+ELEVEN_VOICE_ID = None
+VOICE_LINES_MODEL_ID = "eleven_multilingual_v2"
+# Modello e ottimizzazione della latenza (0-4) per il TTS in streaming di streaming_agent.py
+STREAMING_TTS_MODEL = "eleven_turbo_v2_5"
+STREAMING_TTS_LATENCY = 3
+
+# --- Letargo quando nessuno parla ---
+# Dopo questi secondi senza voce né risposte la sessione con ElevenLabs si chiude e resta
+# solo un rilevatore di energia locale sul microfono. None per restare sempre connessi.
+IDLE_HIBERNATE_S = 120
+# Livello (dBFS) e durata minima del suono che risvegliano il Capitano
+WAKE_THRESHOLD_DBFS = -40.0
+WAKE_MIN_S = 0.15
+# Secondi di audio prima del risveglio rimandati alla nuova sessione, per non perdere le prime parole
+PREROLL_S = 1.5
+
+# --- Più barili dalla stessa macchina (python supervisor.py) ---
+# Ogni barile sovrascrive le chiavi di questo file che gli servono diverse; le altre restano in comune.
+# Lista vuota: un solo barile configurato come sopra (python main.py).
+# Esempio:
+# BARRELS = [
+#     {"NAME": "prua", "ELEVEN_AGENT_ID": "agent_...", "INPUT_DEVICE_INDEX": 2, "OUTPUT_DEVICE_INDEX": 3,
+#      "SPOTIFY_DEVICE_NAME": "Barile prua", "EFFECTS_SERIAL_PORT": "/dev/ttyACM0"},
+#     {"NAME": "poppa", "ELEVEN_AGENT_ID": "agent_...", "INPUT_DEVICE_INDEX": 4, "OUTPUT_DEVICE_INDEX": 5,
+#      "SPOTIFY_DEVICE_NAME": "Barile poppa", "EFFECTS_SERIAL_PORT": "/dev/ttyACM1"},
+# ]
+BARRELS = []
+
+# --- Logging (scritto da un thread in background: mai bloccante per audio e websocket) ---
+LOG_LEVEL = "INFO"
+# Livelli per sottosistema (nome del logger), es. per zittire la diagnostica dei chunk
+LOG_LEVELS = {"AudioManager": "INFO", "ElevenLabsClient": "INFO", "StreamingAgent": "INFO"}
+# File di log con rotazione (oltre alla console); None per la sola console
+LOG_FILE = None
+
+# --- Processo audio isolato ---
+# True: microfono, voce e musica di sottofondo girano in un processo a parte (Audio Process.py),
+# al riparo da GC e tool pesanti dell'agente. Scambiano PCM in memoria condivisa.
+AUDIO_PROCESS = False
+# WAV della musica di sottofondo suonata e abbassata (duck) dal processo audio, al posto di pygame; None per nessuna
+AUDIO_PROCESS_MUSIC = None
+
+# --- Formato audio della sessione ElevenLabs ---
+# Formati ammessi, dal preferito al più leggero: a ogni connessione si sceglie il migliore che la rete regge
+OUTPUT_FORMATS = ["pcm_24000", "pcm_16000", "ulaw_8000"]
+# Formato fisso (es. "pcm_24000") invece della scelta automatica; None per negoziare
+OUTPUT_FORMAT = None
+
+# --- Scatola nera ---
+# File ad anello con gli ultimi minuti di microfono, voce ed eventi, per capire cosa è andato storto
+# ('python black_box.py export <file> --last 60'); {name} è il nome del barile. Sempre accesa:
+# circa 25 MB per barile con 5 minuti. None per disattivarla
+BLACK_BOX_PATH = "scatola_nera/{name}.bb"
+BLACK_BOX_MINUTES = 5
+
+# --- Storia dei visitatori ---
+# Cartella con journal e snapshot della storia di ogni barile/visitatore: alla riconnessione il Capitano
+# riprende da dove era rimasto. None per ricominciare ogni sessione da zero
+NARRATIVE_DIR = "storie"
+# Eventi dopo i quali lo stato viene compattato in uno snapshot e il journal svuotato
+NARRATIVE_SNAPSHOT_EVERY = 50
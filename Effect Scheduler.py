@@ -0,0 +1,267 @@
+# Progetto_Stabile/effect_scheduler.py
+import asyncio
+import collections
+import logging
+import re
+import time
+
+import metrics
+
+logger = logging.getLogger("EffectScheduler")
+
+# Obiettivo di sincronia tra la voce del Capitano e gli effetti fisici
+DRIFT_TARGET_S = 0.020
+# Durata dell'impulso per gli effetti on/off (fumo, catene, luci) sul GPIO
+PULSE_S = 0.3
+
+# Apertura della mascella (0-100) per i visemi in stile Oculus/Azure
+VISEME_OPENING = {
+    "sil": 0, "PP": 0, "FF": 15, "TH": 20, "DD": 30, "kk": 35, "CH": 30, "SS": 15,
+    "nn": 25, "RR": 35, "aa": 100, "E": 70, "I": 50, "O": 85, "U": 55,
+}
+
+EFFECT_DRIFT = metrics.registry.histogram(
+    "rumbtide_effect_drift_seconds", "Scarto tra l'avvio di un effetto e il campione audio a cui è legato.",
+    ("backend",), buckets=(0.001, 0.0025, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25))
+EFFECTS_LATE = metrics.registry.counter(
+    "rumbtide_effects_late_total", "Effetti partiti con uno scarto oltre l'obiettivo di sincronia.", ("backend",))
+CLOCK_CORRECTION = metrics.registry.histogram(
+    "rumbtide_audio_clock_correction_seconds", "Correzioni della stima dell'orologio di riproduzione.",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25))
+
+
+# --- Orologio di riproduzione ---
+class PlayoutClock:
+    """
+    Orologio a campioni dello stream di output: sa quanti campioni sono stati scritti
+    e stima l'istante (loop.time) in cui ciascuno arriva al DAC.
+    Una scrittura bloccante che ritorna vuol dire che l'ultimo campione scritto
+    suonerà dopo la latenza del dispositivo: è il momento in cui correggiamo la stima.
+    """
+
+    # Sotto questa durata la write non ha aspettato spazio nel buffer: non dice nulla sull'orologio
+    BLOCKING_WRITE_S = 0.002
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.samples_written = 0
+        # Istante stimato in cui l'ultimo campione scritto arriva al DAC
+        self._end_at = 0.0
+
+    def begin_chunk(self, samples, now, latency):
+        """Restituisce l'istante stimato del primo campione del chunk che sta per essere scritto."""
+        start_at = max(self._end_at, now + latency)
+        self._end_at = start_at + samples / self.rate
+        self.samples_written += samples
+        return start_at
+
+    def end_chunk(self, write_started, now, latency):
+        """Corregge la stima dopo la write. Restituisce la correzione applicata (secondi)."""
+        if now - write_started < self.BLOCKING_WRITE_S:
+            return 0.0
+        correction = (now + latency) - self._end_at
+        self._end_at += correction
+        CLOCK_CORRECTION.observe(abs(correction))
+        return correction
+
+    def reset(self):
+        self._end_at = 0.0
+
+
+# --- Backend degli effetti ---
+class SimulatedBackend:
+    """Non tocca l'hardware: registra i comandi con l'istante di invio. Per test e benchmark."""
+    name = "simulated"
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, command):
+        self.sent.append((time.monotonic(), command))
+
+    def close(self):
+        pass
+
+
+class SerialBackend:
+    """Arduino (o simili) su seriale: un comando testuale per riga, es. 'SMOKE' o 'JAW 80'."""
+    name = "serial"
+
+    def __init__(self, port, baudrate=115200):
+        try:
+            import serial
+        except ImportError as e:
+            raise RuntimeError("Per il backend seriale serve pyserial (pip install pyserial).") from e
+        # write_timeout=0: la scrittura non blocca mai l'event loop
+        self._serial = serial.Serial(port, baudrate=baudrate, write_timeout=0)
+        logger.info(f"Backend effetti seriale aperto su {port} a {baudrate} baud.")
+
+    def send(self, command):
+        self._serial.write(f"{command}\n".encode("ascii"))
+
+    def close(self):
+        self._serial.close()
+
+
+class GpioBackend:
+    """Raspberry Pi: ogni effetto è un pin. JAW è PWM (apertura), gli altri un impulso."""
+    name = "gpio"
+
+    def __init__(self, pins):
+        try:
+            from gpiozero import DigitalOutputDevice, PWMOutputDevice
+        except ImportError as e:
+            raise RuntimeError("Per il backend GPIO serve gpiozero (pip install gpiozero).") from e
+        self._devices = {
+            name: PWMOutputDevice(pin) if name == "JAW" else DigitalOutputDevice(pin)
+            for name, pin in pins.items()
+        }
+
+    def send(self, command):
+        name, _, value = command.partition(" ")
+        device = self._devices.get(name)
+        if device is None:
+            return
+        if name == "JAW":
+            device.value = int(value or 0) / 100
+        else:
+            # blink in background: non blocca il chiamante
+            device.blink(on_time=PULSE_S, off_time=0, n=1, background=True)
+
+    def close(self):
+        for device in self._devices.values():
+            device.close()
+
+
+def create_backend(name, serial_port=None, serial_baudrate=115200, gpio_pins=None):
+    if name == "simulated":
+        return SimulatedBackend()
+    if name == "serial":
+        return SerialBackend(serial_port, serial_baudrate)
+    if name == "gpio":
+        return GpioBackend(gpio_pins or {})
+    raise ValueError(f"Backend degli effetti sconosciuto: {name}")
+
+
+# --- Cue dai dati di temporizzazione di ElevenLabs ---
+def _words(alignment):
+    """(inizio_ms, parola) dall'allineamento per carattere dell'evento audio."""
+    chars = alignment.get("chars") or []
+    starts = alignment.get("char_start_times_ms") or []
+    word, word_start = [], None
+    for char, start in zip(chars, starts):
+        if char.isalnum() or char == "'":
+            if not word:
+                word_start = start
+            word.append(char)
+        elif word:
+            yield word_start, "".join(word)
+            word = []
+    if word:
+        yield word_start, "".join(word)
+
+
+def cues_from_audio_event(audio_event, word_cues):
+    """
+    Estrae (offset dall'inizio del chunk in secondi, comando) da un evento audio:
+    i visemi muovono la mascella, le parole chiave (es. 'fumo') fanno partire gli effetti.
+    """
+    cues = []
+    for viseme in audio_event.get("visemes") or []:
+        opening = VISEME_OPENING.get(viseme.get("viseme"))
+        offset_ms = viseme.get("start_time_ms", viseme.get("time_ms"))
+        if opening is not None and offset_ms is not None:
+            cues.append((offset_ms / 1000, f"JAW {opening}"))
+    alignment = audio_event.get("alignment") or audio_event.get("normalized_alignment")
+    if alignment and word_cues:
+        for start_ms, word in _words(alignment):
+            command = word_cues.get(re.sub(r"\W", "", word.lower()))
+            if command:
+                cues.append((start_ms / 1000, command))
+    return cues
+
+
+# --- Scheduler ---
+class _Cue:
+    __slots__ = ("target", "command", "handle", "fired_at")
+
+    def __init__(self, target, command):
+        self.target = target
+        self.command = command
+        self.handle = None
+        self.fired_at = None
+
+
+class EffectScheduler:
+    """
+    Fa partire gli effetti all'istante in cui il campione audio corrispondente
+    arriva al DAC, secondo il PlayoutClock dell'AudioPlayer.
+    Lo scarto di un effetto si misura alla correzione successiva dell'orologio,
+    quando si conosce meglio l'istante reale del suo campione.
+    """
+
+    def __init__(self, backend, word_cues=None):
+        self.backend = backend
+        self.word_cues = {word.lower(): command for word, command in (word_cues or {}).items()}
+        self.drifts = collections.deque(maxlen=1000)
+        self._pending = set()
+        self._unconfirmed = []
+
+    def cues_for(self, audio_event):
+        return cues_from_audio_event(audio_event, self.word_cues)
+
+    def schedule(self, cues, chunk_start_at):
+        """Programma i cue di un chunk che inizia a suonare a chunk_start_at (loop.time)."""
+        loop = asyncio.get_running_loop()
+        for offset, command in cues:
+            cue = _Cue(chunk_start_at + offset, command)
+            cue.handle = loop.call_at(cue.target, self._fire, cue)
+            self._pending.add(cue)
+
+    def retime(self, correction):
+        """L'orologio è stato corretto: misuriamo gli effetti già partiti e spostiamo gli altri."""
+        for cue in self._unconfirmed:
+            self._observe(cue.fired_at - (cue.target + correction))
+        self._unconfirmed.clear()
+        if abs(correction) < 0.001 or not self._pending:
+            return
+        loop = asyncio.get_running_loop()
+        for cue in self._pending:
+            cue.handle.cancel()
+            cue.target += correction
+            cue.handle = loop.call_at(cue.target, self._fire, cue)
+
+    def _fire(self, cue):
+        self._pending.discard(cue)
+        cue.fired_at = asyncio.get_running_loop().time()
+        try:
+            self.backend.send(cue.command)
+        except Exception as e:
+            logger.error(f"Errore nell'invio dell'effetto '{cue.command}': {e}")
+            return
+        self._unconfirmed.append(cue)
+
+    def _observe(self, drift):
+        self.drifts.append(drift)
+        EFFECT_DRIFT.observe(abs(drift), backend=self.backend.name)
+        if abs(drift) > DRIFT_TARGET_S:
+            EFFECTS_LATE.inc(backend=self.backend.name)
+
+    def interrupt(self):
+        """Barge-in: gli effetti dell'audio scartato non devono partire, la mascella si chiude."""
+        for cue in self._pending:
+            cue.handle.cancel()
+        self._pending.clear()
+        self.flush()
+        try:
+            self.backend.send("JAW 0")
+        except Exception as e:
+            logger.error(f"Errore nel reset degli effetti: {e}")
+
+    def flush(self):
+        """Misura gli effetti partiti senza correzioni successive (fine risposta)."""
+        self.retime(0.0)
+
+    def close(self):
+        self.interrupt()
+        self.backend.close()
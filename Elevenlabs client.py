@@ -2,12 +2,16 @@
 
 import asyncio
 import json
+import logging
 import time
 import websockets
 from typing import Optional
 
 from config import ELEVEN_API_KEY, AUDIO_CONFIG, VAD_THRESHOLD, BARGE_IN_ENABLED
 from audio_manager import AudioManager
+from log_setup import RateLimited
+
+logger = logging.getLogger("ElevenLabsClient")
 
 ELEVENLABS_WS_URI = "wss://api.elevenlabs.io/v1/convai/conversation"
 
@@ -21,9 +25,13 @@ class ElevenLabsClient:
         # Stato per la gestione del barge-in
         self.last_user_activity = 0.0
         self.is_interrupted = False
+        # Diagnostica per messaggio (chunk, punteggi VAD, eventi ignorati): al massimo una riga al secondo
+        self._chunk_log = RateLimited(logger)
+        self._vad_log = RateLimited(logger, level=logging.INFO)
+        self._unhandled_log = RateLimited(logger)
 
     async def connect_dashboard_style(self):
-        print("Tentativo di connessione a ElevenLabs...")
+        logger.info("Tentativo di connessione a ElevenLabs...")
         headers = {
             "xi-api-key": ELEVEN_API_KEY,
             "User-Agent": "ElevenLabs-Dashboard-Replica/1.0"
@@ -33,7 +41,7 @@ class ElevenLabsClient:
             self.websocket = await websockets.connect(
                 ELEVENLABS_WS_URI, extra_headers=headers
             )
-            print("✅ Connessione WebSocket stabilita.")
+            logger.info("✅ Connessione WebSocket stabilita.")
 
             conversation_initiation_data = {
                 "type": "conversation_initiation_client_data",
@@ -51,17 +59,17 @@ class ElevenLabsClient:
                 conversation_initiation_data["user_config"]["voice_id"] = self.voice_id
 
             await self.websocket.send(json.dumps(conversation_initiation_data))
-            print("📤 Messaggio di inizializzazione inviato.")
+            logger.info("📤 Messaggio di inizializzazione inviato.")
 
         except Exception as e:
-            print(f"❌ Errore durante la connessione: {e}")
+            logger.error(f"❌ Errore durante la connessione: {e}")
 
     async def handle_messages(self):
         if not self.websocket:
-            print("Errore: la connessione WebSocket non è attiva.")
+            logger.error("La connessione WebSocket non è attiva.")
             return
 
-        print("👂 In ascolto dei messaggi dal server...")
+        logger.info("👂 In ascolto dei messaggi dal server...")
         try:
             async for message in self.websocket:
                 try:
@@ -69,34 +77,34 @@ class ElevenLabsClient:
                     event_type = data.get("type")
 
                     if event_type == "conversation_initiation_metadata":
-                        print("🎉 Ricevuto evento: METADATI CONVERSAZIONE")
+                        logger.info("🎉 Ricevuto evento: METADATI CONVERSAZIONE")
 
                     elif event_type == "vad_score":
                         await self.process_vad_dashboard_style(data.get("score", 0.0))
 
                     elif event_type == "agent_response_correction":
-                        print("🔄 Ricevuto evento: CORREZIONE RISPOSTA AGENTE")
+                        logger.info("🔄 Ricevuto evento: CORREZIONE RISPOSTA AGENTE")
                         await self.handle_dashboard_interruption()
 
                     elif event_type == "agent_response":
                         if self.is_interrupted:
-                            print("🤖 Risposta agente ignorata a causa di interruzione.")
+                            self._chunk_log.log("🤖 Risposta agente ignorata a causa di interruzione.")
                             continue
 
-                        print("🤖 Ricevuto evento: RISPOSTA AGENTE")
+                        self._chunk_log.log("🤖 Ricevuto evento: RISPOSTA AGENTE")
                         if "audio" in data:
                             await self.audio_manager.queue_audio_chunk(data["audio"])
 
                     else:
-                        print(f"❓ Ricevuto evento non gestito: {event_type}")
+                        self._unhandled_log.log("❓ Ricevuto evento non gestito: %s", event_type)
 
                 except json.JSONDecodeError:
-                    print(f"⚠️ Messaggio non JSON ricevuto: {message[:100]}...")
+                    logger.warning("⚠️ Messaggio non JSON ricevuto: %.100s...", message)
 
         except websockets.exceptions.ConnectionClosed as e:
-            print(f"🔌 Connessione WebSocket chiusa: {e.code} {e.reason}")
+            logger.warning(f"🔌 Connessione WebSocket chiusa: {e.code} {e.reason}")
         except Exception as e:
-            print(f"Errore irreversibile nel gestore messaggi: {e}")
+            logger.error(f"Errore irreversibile nel gestore messaggi: {e}", exc_info=True)
 
     async def process_vad_dashboard_style(self, vad_score: float):
         """
@@ -105,14 +113,14 @@ class ElevenLabsClient:
         """
         if self.audio_manager.is_playing and BARGE_IN_ENABLED:
             if vad_score > VAD_THRESHOLD:
-                print(f"VAD score ({vad_score:.2f}) > soglia ({VAD_THRESHOLD}). Utente sta parlando.")
+                self._vad_log.log("VAD score (%.2f) > soglia (%s). Utente sta parlando.", vad_score, VAD_THRESHOLD)
                 self.last_user_activity = time.time()
                 await self.prepare_barge_in()
             else:
                 # Se l'utente smette di parlare, resetta il flag di interruzione
                 if self.is_interrupted:
                     self.is_interrupted = False
-                    print("Utente ha smesso di parlare, interruzione resettata.")
+                    logger.info("Utente ha smesso di parlare, interruzione resettata.")
 
     async def prepare_barge_in(self):
         """
@@ -120,7 +128,7 @@ class ElevenLabsClient:
         e impostando il flag di interruzione.
         """
         if not self.is_interrupted:
-            print("⚡️ INTERRUZIONE! L'utente sta parlando sopra l'agente.")
+            logger.info("⚡️ INTERRUZIONE! L'utente sta parlando sopra l'agente.")
             self.is_interrupted = True
             await self.audio_manager.stop_playback()
             await self.audio_manager.clear_audio_queue()
@@ -130,7 +138,7 @@ class ElevenLabsClient:
         Gestisce il reset dopo che un'interruzione è stata completamente
         processata (es. ricevendo agent_response_correction).
         """
-        print(" resettando lo stato dopo l'interruzione.")
+        logger.info("Reset dello stato dopo l'interruzione.")
         await self.audio_manager.stop_playback()
         await self.audio_manager.clear_audio_queue()
         self.is_interrupted = False # Resetta il flag
@@ -140,4 +148,4 @@ class ElevenLabsClient:
     async def close(self):
         if self.websocket and self.websocket.open:
             await self.websocket.close()
-            print("🔌 Connessione WebSocket chiusa.")
+            logger.info("🔌 Connessione WebSocket chiusa.")
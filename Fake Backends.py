@@ -0,0 +1,520 @@
+# Progetto_Stabile/fake_backends.py
+"""
+Backend finti per far girare il progetto senza rete, microfono né Spotify.
+
+`install_fakes()` registra in sys.modules delle versioni finte di spotipy,
+openai, sounddevice, pygame, config e background_music_manager, e un finder
+che carica i moduli del progetto dal loro file (es. `agent` -> "Agent.py").
+Va chiamata PRIMA di importare i moduli del progetto.
+"""
+import importlib.abc
+import importlib.util
+import logging
+import os
+import sys
+import threading
+import time
+import types
+
+import numpy as np
+
+logger = logging.getLogger("FakeBackends")
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Valori usati al posto di config.py (che contiene le chiavi reali)
+FAKE_CONFIG = {
+    "ELEVEN_API_KEY": "sk_fake",
+    "ELEVEN_AGENT_ID": "agent_fake",
+    "OPENAI_API_KEY": "sk-proj-fake",
+    "SPOTIPY_CLIENT_ID": "fake",
+    "SPOTIPY_CLIENT_SECRET": "fake",
+    "SPOTIFY_DEVICE_NAME": "Barile",
+    "SPOTIFY_CACHE_PATH": ".spotify_cache_fake",
+    "AUDIO_CONFIG": {"input_sample_rate": 16000, "output_sample_rate": 24000, "channels": 1, "format": "pcm_16000"},
+    "VAD_THRESHOLD": 0.5,
+    "BARGE_IN_ENABLED": True,
+    "METRICS_HOST": "127.0.0.1",
+    "METRICS_PORT": None,
+    "LOOP_WATCHDOG_THRESHOLD_S": None,
+    "SPOTIFY_STATE_PUSH": True,
+    "SPOTIFY_PAUSES_MUSIC": False,
+    "EFFECTS_BACKEND": "simulated",
+    "EFFECTS_SERIAL_PORT": None,
+    "EFFECTS_SERIAL_BAUDRATE": 115200,
+    "EFFECTS_GPIO_PINS": {},
+    "EFFECT_WORD_CUES": {"fumo": "SMOKE", "catene": "CHAINS"},
+    "VOICE_LINES_MAX_MAPPED": 32,
+    # Il benchmark misura sessioni sempre aperte: il letargo si prova a parte
+    "IDLE_HIBERNATE_S": None,
+    "WAKE_THRESHOLD_DBFS": -40.0,
+    "WAKE_MIN_S": 0.15,
+    "PREROLL_S": 1.5,
+    "LOG_LEVEL": "INFO",
+    "LOG_LEVELS": {},
+    "LOG_FILE": None,
+    "AUDIO_PROCESS": False,
+    "AUDIO_PROCESS_MUSIC": None,
+    "OUTPUT_FORMATS": ["pcm_24000", "pcm_16000", "ulaw_8000"],
+    "OUTPUT_FORMAT": None,
+    "BLACK_BOX_PATH": None,
+    "BLACK_BOX_MINUTES": 5,
+    "CHART_PLAYLISTS": [["Hit Del Momento 2025", "peermusic"]],
+    "CHART_REFRESH_S": 6 * 3600,
+    "NARRATIVE_DIR": None,
+    "NARRATIVE_SNAPSHOT_EVERY": 50,
+    "PROFILE_DIR": "/tmp/profili_fake",
+    "PROFILER_HZ": 50,
+    "PROFILE_SECONDS": 30,
+}
+
+
+# --- Caricamento dei moduli del progetto dai file con nome "umano" ---
+def _project_module_files():
+    """Mappa nome di import -> file, leggendo l'intestazione '# Progetto_Stabile/<nome>.py'."""
+    mapping = {}
+    for file_name in os.listdir(PROJECT_DIR):
+        if not file_name.endswith(".py"):
+            continue
+        path = os.path.join(PROJECT_DIR, file_name)
+        with open(path, encoding="utf-8") as f:
+            first_line = f.readline().strip()
+        if first_line.startswith("# Progetto_Stabile/") and first_line.endswith(".py"):
+            module_name = first_line[len("# Progetto_Stabile/"):-3]
+        else:
+            module_name = file_name[:-3].lower().replace(" ", "_")
+        mapping[module_name] = path
+    return mapping
+
+
+class _ProjectFinder(importlib.abc.MetaPathFinder):
+    def __init__(self):
+        self.files = _project_module_files()
+
+    def find_spec(self, fullname, path=None, target=None):
+        file_path = self.files.get(fullname)
+        if file_path is None:
+            return None
+        return importlib.util.spec_from_file_location(fullname, file_path)
+
+
+# --- Spotify finto ---
+class FakeSpotifyException(Exception):
+    def __init__(self, http_status, code, msg, reason=None, headers=None):
+        super().__init__(msg)
+        self.http_status = http_status
+        self.code = code
+        self.msg = msg
+        self.reason = reason
+        self.headers = headers or {}
+
+
+class FakeSpotifyState:
+    """Stato condiviso da tutte le istanze di FakeSpotify (come un vero account)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency = 0.0
+        self.calls = {}
+        self.devices = [{"id": "device-barile", "name": FAKE_CONFIG["SPOTIFY_DEVICE_NAME"], "volume_percent": 50}]
+        self.tracks = [
+            {"name": f"Canzone {i}", "uri": f"spotify:track:{i:04d}", "duration_ms": 180000,
+             "artists": [{"name": f"Artista {i % 7}"}]}
+            for i in range(50)
+        ]
+        self.playlists = [{"name": "Ciurma", "uri": "spotify:playlist:ciurma", "id": "ciurma",
+                           "owner": {"display_name": "capitano"}}]
+        self.charts = [{"name": "Hit Del Momento 2025", "uri": "spotify:playlist:hit", "id": "hit",
+                        "owner": {"display_name": "peermusic"}}]
+        self.queue = []
+        self.current = None
+        self.is_playing = False
+        self.progress_ms = 0
+        self.volume = 50
+        # Eccezioni da sollevare alle prossime chiamate, per simulare 429 e simili
+        self.pending_errors = []
+
+    def reset_calls(self):
+        with self.lock:
+            self.calls = {}
+
+
+spotify_state = FakeSpotifyState()
+
+
+class FakeSpotify:
+    def __init__(self, auth_manager=None, **kwargs):
+        self.auth_manager = auth_manager
+
+    def _call(self, name):
+        with spotify_state.lock:
+            spotify_state.calls[name] = spotify_state.calls.get(name, 0) + 1
+            error = spotify_state.pending_errors.pop(0) if spotify_state.pending_errors else None
+        if spotify_state.latency:
+            time.sleep(spotify_state.latency)
+        if error is not None:
+            raise error
+
+    def current_user(self):
+        self._call("current_user")
+        return {"id": "capitano", "display_name": "Capitano"}
+
+    def devices(self):
+        self._call("devices")
+        return {"devices": [dict(d, volume_percent=spotify_state.volume) for d in spotify_state.devices]}
+
+    def current_playback(self):
+        self._call("current_playback")
+        if spotify_state.current is None:
+            return None
+        return {"is_playing": spotify_state.is_playing, "item": spotify_state.current,
+                "progress_ms": spotify_state.progress_ms,
+                "device": dict(spotify_state.devices[0], volume_percent=spotify_state.volume)}
+
+    def current_user_playing_track(self):
+        return self.current_playback()
+
+    def queue(self):
+        self._call("queue")
+        return {"currently_playing": spotify_state.current, "queue": list(spotify_state.queue)}
+
+    def search(self, q, limit=10, offset=0, type="track", market=None):
+        self._call("search")
+        if type == "playlist":
+            return {"playlists": {"items": list(spotify_state.charts)}}
+        index = sum(map(ord, q)) % len(spotify_state.tracks)
+        return {"tracks": {"items": spotify_state.tracks[index:index + limit]}}
+
+    def current_user_playlists(self, limit=50, offset=0):
+        self._call("current_user_playlists")
+        return {"items": list(spotify_state.playlists)}
+
+    def playlist_tracks(self, playlist_id, fields=None, limit=100, offset=0, market=None, additional_types=("track",)):
+        self._call("playlist_tracks")
+        return {"items": [{"track": {"uri": t["uri"]}} for t in spotify_state.tracks[:limit]]}
+
+    def start_playback(self, device_id=None, context_uri=None, uris=None, offset=None, position_ms=None):
+        self._call("start_playback")
+        with spotify_state.lock:
+            if uris:
+                by_uri = {t["uri"]: t for t in spotify_state.tracks}
+                selected = [by_uri.get(u, spotify_state.tracks[0]) for u in uris]
+                spotify_state.current, spotify_state.queue = selected[0], selected[1:]
+            elif context_uri:
+                spotify_state.current, spotify_state.queue = spotify_state.tracks[0], spotify_state.tracks[1:20]
+            elif spotify_state.current is None:
+                raise FakeSpotifyException(404, -1, "Player command failed", reason="NO_ACTIVE_DEVICE")
+            spotify_state.is_playing = True
+            spotify_state.progress_ms = 0
+
+    def pause_playback(self, device_id=None):
+        self._call("pause_playback")
+        spotify_state.is_playing = False
+
+    def next_track(self, device_id=None):
+        self._call("next_track")
+        with spotify_state.lock:
+            if spotify_state.queue:
+                spotify_state.current = spotify_state.queue.pop(0)
+            spotify_state.progress_ms = 0
+
+    def previous_track(self, device_id=None):
+        self._call("previous_track")
+        spotify_state.progress_ms = 0
+
+    def volume(self, volume_percent, device_id=None):
+        self._call("volume")
+        spotify_state.volume = volume_percent
+
+
+class FakeSpotifyOAuth:
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+
+
+# --- OpenAI finto ---
+class _FakeCompletions:
+    def __init__(self, owner):
+        self.owner = owner
+
+    def create(self, model=None, messages=None, temperature=None, **kwargs):
+        self.owner.calls += 1
+        if self.owner.latency:
+            time.sleep(self.owner.latency)
+        prompt = messages[-1]["content"] if messages else ""
+        content = "Titolo: Canzone 1, Artista: Artista 1" if "Titolo:" in prompt else "Canzone 1 Artista 1"
+        message = types.SimpleNamespace(content=content)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+
+class FakeOpenAI:
+    latency = 0.0
+    calls = 0
+
+    def __init__(self, api_key=None, **kwargs):
+        self.chat = types.SimpleNamespace(completions=_FakeCompletions(FakeOpenAI))
+
+
+# --- sounddevice virtuale ---
+class FakePortAudioError(Exception):
+    pass
+
+
+class VirtualAudio:
+    """Configurazione e registro dei dispositivi audio virtuali."""
+
+    def __init__(self):
+        self.realtime = False
+        self.input_source = None
+        self.block_duration = 0.05
+        self.output_writes = []
+        self.lock = threading.Lock()
+
+    def reset(self):
+        with self.lock:
+            self.output_writes = []
+
+
+virtual_audio = VirtualAudio()
+
+
+class FakeCallbackFlags:
+    """Come sounddevice.CallbackFlags: vera se c'è almeno un problema."""
+
+    def __init__(self, input_overflow=False, output_underflow=False):
+        self.input_overflow = input_overflow
+        self.output_underflow = output_underflow
+
+    def __bool__(self):
+        return self.input_overflow or self.output_underflow
+
+    def __str__(self):
+        return ", ".join(name.replace("_", " ") for name in ("input_overflow", "output_underflow") if getattr(self, name))
+
+
+class VirtualInputStream:
+    """Chiama la callback da un thread, come PortAudio, con blocchi dalla sorgente configurata."""
+
+    def __init__(self, samplerate=16000, device=None, channels=1, dtype="int16", callback=None, blocksize=0, **kwargs):
+        self.samplerate = samplerate
+        self.device = device
+        self.channels = channels
+        self.dtype = np.dtype(dtype)
+        self.callback = callback
+        self.blocksize = blocksize or int(samplerate * virtual_audio.block_duration)
+        self.active = False
+        self._thread = None
+
+    def _run(self):
+        source = virtual_audio.input_source
+        position = 0
+        block_time = self.blocksize / self.samplerate
+        next_at = time.monotonic()
+        overflow = False
+        while self.active:
+            if source is not None and len(source):
+                block = np.take(source, range(position, position + self.blocksize), mode="wrap")
+                position = (position + self.blocksize) % len(source)
+            else:
+                block = np.zeros(self.blocksize)
+            block = block.astype(self.dtype).reshape(-1, 1)
+            if self.callback:
+                self.callback(block, self.blocksize, None, FakeCallbackFlags(input_overflow=overflow))
+            next_at += block_time
+            # Il dispositivo tiene un blocco: se la callback arriva ancora più tardi, il blocco si perde
+            overflow = time.monotonic() > next_at + block_time
+            if overflow:
+                next_at = time.monotonic()
+            time.sleep(max(0.0, next_at - time.monotonic()))
+
+    def start(self):
+        self.active = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.active = False
+        # Come PortAudio: dopo stop() la callback non viene più chiamata
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=1)
+
+    def close(self):
+        self.stop()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class VirtualOutputStream:
+    """
+    Registra ogni scrittura (istante, numero di campioni, primi campioni) per le misure.
+    Con una callback si comporta come PortAudio: un thread chiede un blocco alla volta, in tempo reale.
+    """
+
+    def __init__(self, samplerate=24000, channels=1, dtype="int16", device=None, callback=None, blocksize=0,
+                 **kwargs):
+        self.samplerate = samplerate
+        self.channels = channels
+        self.dtype = dtype
+        self.device = device
+        self.callback = callback
+        self.blocksize = blocksize or int(samplerate * virtual_audio.block_duration)
+        # Il dispositivo virtuale non ha buffer: la write ritorna quando il chunk ha finito di suonare.
+        # In modalità callback tiene un blocco in coda.
+        self.latency = self.blocksize / samplerate if callback else 0.0
+        self.active = False
+        self._thread = None
+
+    def write(self, data):
+        data = np.asarray(data)
+        self._record(data)
+        if virtual_audio.realtime:
+            time.sleep(len(data) / self.samplerate)
+        return False
+
+    def _record(self, data):
+        with virtual_audio.lock:
+            virtual_audio.output_writes.append((time.perf_counter(), len(data), data[:2].tolist()))
+
+    def _run(self):
+        block_time = self.blocksize / self.samplerate
+        next_at = time.monotonic()
+        underflow = False
+        while self.active:
+            outdata = np.zeros((self.blocksize, self.channels), dtype=self.dtype)
+            self.callback(outdata, self.blocksize, None, FakeCallbackFlags(output_underflow=underflow))
+            if outdata.any():
+                self._record(outdata[:, 0])
+            next_at += block_time
+            # Il blocco in coda è finito prima che la callback consegnasse il successivo: buco udibile
+            underflow = time.monotonic() > next_at + block_time
+            if underflow:
+                next_at = time.monotonic()
+            time.sleep(max(0.0, next_at - time.monotonic()))
+
+    def start(self):
+        self.active = True
+        if self.callback:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self.active = False
+        # Come PortAudio: dopo stop() la callback non viene più chiamata
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=1)
+
+    def close(self):
+        self.stop()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def _fake_sounddevice():
+    module = types.ModuleType("sounddevice")
+    module.InputStream = VirtualInputStream
+    module.OutputStream = VirtualOutputStream
+    module.PortAudioError = FakePortAudioError
+    module.CallbackFlags = FakeCallbackFlags
+    module.default = types.SimpleNamespace(device=[0, 1], samplerate=None)
+    module.query_devices = lambda device=None, kind=None: {
+        "name": f"Virtuale {device}", "default_samplerate": 48000.0,
+        "max_input_channels": 1, "max_output_channels": 2}
+    module.check_input_settings = lambda *a, **k: None
+    module.check_output_settings = lambda *a, **k: None
+
+    def play(data, samplerate=None, device=None, **kwargs):
+        VirtualOutputStream(samplerate=samplerate or 24000, device=device).write(data)
+
+    module.play = play
+    module.wait = lambda: None
+    module.stop = lambda: None
+    return module
+
+
+# --- pygame e musica di sottofondo finti ---
+class FakeMusicManager:
+    def __init__(self):
+        self.is_playing = False
+        self.events = []
+
+    def start(self):
+        self.is_playing = True
+        self.events.append("start")
+
+    def pause(self):
+        self.is_playing = False
+        self.events.append("pause")
+
+    def resume(self):
+        self.is_playing = True
+        self.events.append("resume")
+
+    def stop(self):
+        self.is_playing = False
+        self.events.append("stop")
+
+
+def _fake_pygame():
+    module = types.ModuleType("pygame")
+    state = {"busy": False, "volume": 1.0}
+    music = types.SimpleNamespace(
+        load=lambda path: None,
+        play=lambda loops=0: state.update(busy=True),
+        pause=lambda: state.update(busy=False),
+        unpause=lambda: state.update(busy=True),
+        stop=lambda: state.update(busy=False),
+        get_busy=lambda: state["busy"],
+        set_volume=lambda v: state.update(volume=v),
+        get_volume=lambda: state["volume"],
+    )
+    module.mixer = types.SimpleNamespace(
+        init=lambda *a, **k: None, quit=lambda: None, get_init=lambda: True, music=music)
+    module.error = RuntimeError
+    return module
+
+
+def _module(name, **attributes):
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    return module
+
+
+def _missing_config_value(name):
+    if name.startswith("__"):
+        raise AttributeError(name)
+    return None
+
+
+def install_fakes():
+    """Installa tutti i backend finti e il finder dei moduli del progetto."""
+    spotipy = _module("spotipy", Spotify=FakeSpotify)
+    spotipy.exceptions = _module("spotipy.exceptions", SpotifyException=FakeSpotifyException)
+    spotipy.oauth2 = _module("spotipy.oauth2", SpotifyOAuth=FakeSpotifyOAuth)
+    config = _module("config", **FAKE_CONFIG)
+    # Le chiavi non previste valgono None, così i moduli nuovi non richiedono di aggiornare lo stub
+    config.__getattr__ = _missing_config_value
+    sys.modules.update({
+        "spotipy": spotipy,
+        "spotipy.exceptions": spotipy.exceptions,
+        "spotipy.oauth2": spotipy.oauth2,
+        "openai": _module("openai", OpenAI=FakeOpenAI),
+        "sounddevice": _fake_sounddevice(),
+        "pygame": _fake_pygame(),
+        "config": config,
+        "background_music_manager": _module("background_music_manager", music_manager=FakeMusicManager()),
+    })
+    if not any(isinstance(finder, _ProjectFinder) for finder in sys.meta_path):
+        sys.meta_path.append(_ProjectFinder())
+    logger.info("Backend finti installati (spotipy, openai, sounddevice, pygame, config).")
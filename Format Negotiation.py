@@ -0,0 +1,130 @@
+# Progetto_Stabile/format_negotiation.py
+"""
+Scelta del formato audio della sessione ElevenLabs in base alla rete.
+
+Il formato si decide all'apertura di ogni sessione (è un parametro dell'URL) tra quelli
+di config.OUTPUT_FORMATS, in ordine di preferenza. Durante la sessione LinkEstimator misura
+le raffiche di audio di ogni risposta: quanti byte al secondo arrivano e se arrivano almeno
+in tempo reale. Alla riconnessione successiva si scende a un formato più leggero se la rete
+non ce la fa, e si risale se la banda misurata basta per uno migliore.
+"""
+import logging
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import metrics
+from audio_core import encoding_rate
+
+logger = logging.getLogger("FormatNegotiation")
+
+# Formati di uscita di ElevenLabs, dal più fedele al più leggero
+SUPPORTED_FORMATS = ("pcm_44100", "pcm_24000", "pcm_22050", "pcm_16000", "ulaw_8000")
+# Il base64 nel JSON gonfia i byte di 4/3
+BASE64_OVERHEAD = 4 / 3
+# Banda richiesta = banda del formato * margine (le raffiche devono arrivare più veloci del tempo reale)
+HEADROOM = 1.5
+# Con un RTT alto il margine cresce: ogni ritrasmissione costa un giro in più
+HIGH_RTT_S = 0.3
+HIGH_RTT_HEADROOM = 1.5
+# Raffiche più corte non dicono nulla sulla banda
+MIN_BURST_S = 0.3
+# Peso delle misure nuove nelle medie mobili
+EWMA_ALPHA = 0.3
+
+LINK_THROUGHPUT = metrics.registry.gauge(
+    "rumbtide_link_throughput_bytes_per_second", "Banda stimata verso ElevenLabs (byte sul websocket al secondo).")
+LINK_RTT = metrics.registry.gauge("rumbtide_link_rtt_seconds", "RTT stimato verso ElevenLabs.")
+LINK_REALTIME_RATIO = metrics.registry.gauge(
+    "rumbtide_link_realtime_ratio", "Secondi di audio ricevuti per secondo durante le risposte (<1: la rete non regge).")
+OUTPUT_FORMAT_CHOSEN = metrics.registry.counter(
+    "rumbtide_output_format_sessions_total", "Sessioni aperte, per formato audio scelto.", ("format",))
+
+
+def bytes_per_second(encoding):
+    """Byte al secondo dell'audio decodificato dal base64: µ-law 1 byte per campione, PCM 2."""
+    rate = encoding_rate(encoding)
+    return rate * (1 if encoding.startswith("ulaw") else 2)
+
+
+def wire_bytes_per_second(encoding):
+    return bytes_per_second(encoding) * BASE64_OVERHEAD
+
+
+def choose_output_format(formats, current=None, throughput=None, realtime_ratio=None, rtt_s=None):
+    """
+    Il formato più fedele che ci sta nella banda misurata, con margine.
+    La banda misurata è un limite inferiore (il server può mandare più piano di quanto la rete permetta):
+    se il formato attuale arriva già in tempo reale non si scende solo perché la stima è bassa.
+    """
+    if throughput is None:
+        return current or formats[0]
+    headroom = HEADROOM * (HIGH_RTT_HEADROOM if rtt_s and rtt_s > HIGH_RTT_S else 1)
+    fitting = [f for f in formats if wire_bytes_per_second(f) * headroom <= throughput]
+    best = fitting[0] if fitting else formats[-1]
+    keeps_up = realtime_ratio is not None and realtime_ratio >= 1.0
+    if current in formats and keeps_up and formats.index(best) > formats.index(current):
+        return current
+    return best
+
+
+def with_output_format(url, encoding):
+    """L'URL della conversazione con `output_format` impostato (sostituito se c'era già)."""
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query) if k != "output_format"] + [("output_format", encoding)]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+class LinkEstimator:
+    """Stima banda, tempo reale e RTT dalle risposte della sessione; sopravvive alle riconnessioni."""
+
+    def __init__(self):
+        self.throughput = None
+        self.realtime_ratio = None
+        self.rtt_s = None
+        self._burst_started = None
+        self._burst_last = None
+        self._burst_bytes = 0
+        self._burst_audio_s = 0.0
+
+    def begin_response(self):
+        self.end_response()
+
+    def on_audio(self, wire_bytes, audio_s, now=None):
+        now = time.monotonic() if now is None else now
+        if self._burst_started is None:
+            # Il primo chunk segna solo l'inizio: la sua durata di trasferimento non è nota
+            self._burst_started = now
+        else:
+            self._burst_bytes += wire_bytes
+            self._burst_audio_s += audio_s
+        self._burst_last = now
+
+    def end_response(self):
+        if self._burst_started is not None:
+            elapsed = self._burst_last - self._burst_started
+            if elapsed >= MIN_BURST_S:
+                self.throughput = self._ewma(self.throughput, self._burst_bytes / elapsed)
+                self.realtime_ratio = self._ewma(self.realtime_ratio, self._burst_audio_s / elapsed)
+                LINK_THROUGHPUT.set(self.throughput)
+                LINK_REALTIME_RATIO.set(self.realtime_ratio)
+        self._burst_started = self._burst_last = None
+        self._burst_bytes, self._burst_audio_s = 0, 0.0
+
+    def on_rtt(self, rtt_s):
+        self.rtt_s = self._ewma(self.rtt_s, rtt_s)
+        LINK_RTT.set(self.rtt_s)
+
+    @staticmethod
+    def _ewma(previous, sample):
+        return sample if previous is None else (1 - EWMA_ALPHA) * previous + EWMA_ALPHA * sample
+
+    def choose(self, formats, current=None):
+        """Formato per la prossima sessione. La risposta in corso conta come misura conclusa."""
+        self.end_response()
+        chosen = choose_output_format(formats, current, self.throughput, self.realtime_ratio, self.rtt_s)
+        if chosen != current:
+            estimate = f"{self.throughput / 1024:.0f} KB/s" if self.throughput else "nessuna misura"
+            logger.info(f"🎚️  Formato audio: {chosen} (banda: {estimate}, "
+                        f"RTT: {f'{self.rtt_s * 1000:.0f} ms' if self.rtt_s else '?'}).")
+        OUTPUT_FORMAT_CHOSEN.inc(format=chosen)
+        return chosen
@@ -0,0 +1,104 @@
+# Progetto_Stabile/hibernation.py
+import asyncio
+import collections
+import logging
+import time
+
+import numpy as np
+
+import metrics
+
+logger = logging.getLogger("Hibernation")
+
+HIBERNATING = metrics.registry.gauge(
+    "rumbtide_agent_hibernating", "1 se l'agente è in letargo (nessuna sessione con ElevenLabs).")
+HIBERNATIONS = metrics.registry.counter(
+    "rumbtide_hibernations_total", "Sessioni chiuse per inattività.")
+WAKE_TO_CONNECTED = metrics.registry.histogram(
+    "rumbtide_wake_to_connected_seconds", "Tempo tra il risveglio e la sessione di nuovo aperta.")
+
+
+def level_dbfs(block):
+    """Energia di un blocco PCM16 in dB rispetto al fondo scala."""
+    rms = np.sqrt(np.mean(np.square(block, dtype=np.float32)))
+    return 20 * np.log10(rms / 32768.0 + 1e-9)
+
+
+class Hibernation:
+    """
+    Stato veglia/letargo dell'agente.
+    In letargo la sessione con ElevenLabs è chiusa e resta solo un rilevatore di energia
+    sul microfono; l'audio degli ultimi istanti è tenuto da parte (pre-roll) e viene
+    rimandato appena la nuova sessione è aperta, così le prime parole non si perdono.
+    Tutti i metodi vanno chiamati dall'event loop.
+    """
+
+    def __init__(self, rate, idle_after_s, wake_dbfs=-40.0, wake_min_s=0.15, preroll_s=1.5, preroll_max_s=10.0):
+        self.rate = rate
+        self.idle_after_s = idle_after_s
+        self.wake_dbfs = wake_dbfs
+        self.wake_min_samples = int(wake_min_s * rate)
+        self.preroll_samples = int(preroll_s * rate)
+        # Dopo il risveglio teniamo tutto fino alla connessione, entro questo limite
+        self.preroll_max_samples = int(preroll_max_s * rate)
+        self.asleep = False
+        self.last_activity = time.monotonic()
+        self._woken = asyncio.Event()
+        self._woken_at = None
+        self._loud_samples = 0
+        self._preroll = collections.deque()
+        self._buffered = 0
+        HIBERNATING.set(0)
+
+    def touch(self):
+        """Qualcosa è successo (voce, risposta, tool): il conto alla rovescia riparte."""
+        self.last_activity = time.monotonic()
+
+    def is_idle(self):
+        return time.monotonic() - self.last_activity > self.idle_after_s
+
+    def on_block(self, block):
+        """Rilevatore di energia: costa una media per blocco, niente base64 né JSON."""
+        if level_dbfs(block) < self.wake_dbfs:
+            self._loud_samples = 0
+            return
+        self.touch()
+        self._loud_samples += len(block)
+        if self.asleep and not self._woken.is_set() and self._loud_samples >= self.wake_min_samples:
+            self._woken_at = time.monotonic()
+            self._woken.set()
+            logger.info("👂 Qualcuno si avvicina al barile: risveglio del Capitano.")
+
+    def buffer(self, block):
+        """Pre-roll: conserva l'audio mentre non c'è una sessione a cui mandarlo."""
+        self._preroll.append(block)
+        self._buffered += len(block)
+        limit = self.preroll_max_samples if self._woken.is_set() else self.preroll_samples
+        while self._buffered > limit and len(self._preroll) > 1:
+            self._buffered -= len(self._preroll.popleft())
+
+    def take_preroll(self):
+        blocks = list(self._preroll)
+        self._preroll.clear()
+        self._buffered = 0
+        return blocks
+
+    def sleep(self):
+        self.asleep = True
+        self._woken.clear()
+        self._loud_samples = 0
+        HIBERNATIONS.inc()
+        HIBERNATING.set(1)
+        logger.info(f"💤 Nessuno parla da {self.idle_after_s:.0f}s: sessione chiusa, il Capitano riposa.")
+
+    async def wait_for_wake(self):
+        await self._woken.wait()
+        self.asleep = False
+        HIBERNATING.set(0)
+
+    def connected(self):
+        """Da chiamare quando la sessione è aperta: misura il tempo dal risveglio."""
+        if self._woken_at is not None:
+            WAKE_TO_CONNECTED.observe(time.monotonic() - self._woken_at)
+            self._woken_at = None
+        self.touch()
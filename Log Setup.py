@@ -0,0 +1,108 @@
+# Progetto_Stabile/log_setup.py
+"""
+Logging che non blocca mai l'audio né il websocket.
+
+Chi logga mette solo il record in una coda (niente formattazione, niente I/O);
+un thread in background formatta e scrive su console e, se configurato, su file.
+Se la coda è piena il record viene scartato e contato, invece di aspettare.
+"""
+import atexit
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+import config
+import metrics
+
+LOG_FORMAT = '%(asctime)s - %(name)-15s - %(levelname)-8s - %(message)s'
+# Record in attesa di essere scritti: oltre, si scarta invece di bloccare chi logga
+QUEUE_SIZE = 10000
+
+LOG_RECORDS_DROPPED = metrics.registry.counter(
+    "rumbtide_log_records_dropped_total", "Record di log scartati perché la coda del writer era piena.")
+
+_listener = None
+_lock = threading.Lock()
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Nessuna formattazione qui: messaggio, argomenti e traceback li formatta il thread del writer
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+
+def setup_logging(level=None, levels=None, log_file=None):
+    """
+    Installa la pipeline sul logger root. Idempotente: la prima chiamata vince,
+    così un entry point (benchmark, supervisore) può scegliere il livello prima dell'agente.
+    `levels` sono i livelli per sottosistema, es. {"AudioManager": "WARNING"}.
+    """
+    global _listener
+    with _lock:
+        if _listener is not None:
+            return
+        handlers = [logging.StreamHandler()]
+        log_file = log_file or config.LOG_FILE
+        if log_file:
+            handlers.append(logging.handlers.RotatingFileHandler(log_file, maxBytes=10_000_000, backupCount=3,
+                                                                 encoding="utf-8"))
+        formatter = logging.Formatter(LOG_FORMAT)
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        log_queue = queue.Queue(maxsize=QUEUE_SIZE)
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(_NonBlockingQueueHandler(log_queue))
+        root.setLevel(level or config.LOG_LEVEL)
+        for name, subsystem_level in {**config.LOG_LEVELS, **(levels or {})}.items():
+            logging.getLogger(name).setLevel(subsystem_level)
+
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Scrive i record rimasti e ferma il writer."""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+class RateLimited:
+    """
+    Diagnostica per chunk: al massimo un record ogni `interval` secondi,
+    con il numero di record simili saltati nel frattempo.
+    Se il livello non è attivo non costa nulla: niente formattazione, niente orologio.
+    """
+
+    def __init__(self, logger, interval=1.0, level=logging.DEBUG):
+        self.logger = logger
+        self.interval = interval
+        self.level = level
+        self._last = 0.0
+        self._suppressed = 0
+
+    def log(self, msg, *args):
+        if not self.logger.isEnabledFor(self.level):
+            return
+        now = time.monotonic()
+        if now - self._last < self.interval:
+            self._suppressed += 1
+            return
+        if self._suppressed:
+            msg, args = msg + " (+%d simili)", (*args, self._suppressed)
+        self._last, self._suppressed = now, 0
+        self.logger.log(self.level, msg, *args)
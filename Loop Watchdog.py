@@ -0,0 +1,96 @@
+# Progetto_Stabile/loop_watchdog.py
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+import metrics
+
+logger = logging.getLogger("LoopWatchdog")
+
+LOOP_BLOCKED = metrics.registry.counter(
+    "rumbtide_event_loop_blocked_total", "Blocchi dell'event loop oltre soglia, per punto di blocco.", ("site",))
+
+# Cartella del progetto: serve a distinguere il nostro codice da librerie e stdlib
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _blocking_site(stack):
+    """Restituisce la funzione del progetto più interna nello stack (es. '_search_and_play_track')."""
+    for frame in reversed(stack):
+        if os.path.abspath(frame.filename).startswith(PROJECT_DIR) and frame.filename != __file__:
+            return frame.name
+    return stack[-1].name if stack else "unknown"
+
+
+class LoopWatchdog:
+    """
+    Misura il ritardo di schedulazione dell'event loop con un battito periodico.
+    Un thread separato controlla il battito: se il loop resta fermo oltre la soglia,
+    cattura lo stack del thread del loop mentre è ancora bloccato, così si vede
+    esattamente quale chiamata (es. spotify.search) lo sta tenendo occupato.
+    """
+
+    def __init__(self, threshold=0.1, interval=0.05, log_interval=30.0):
+        self.threshold = threshold
+        self.interval = interval
+        self.log_interval = log_interval
+        self._last_beat = time.monotonic()
+        self._loop_thread_id = None
+        self._stop_event = threading.Event()
+        self._monitor_thread = None
+        self._task = None
+        self._last_logged = {}
+
+    async def _heartbeat(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            self._last_beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            metrics.LOOP_LAG.observe(max(0.0, loop.time() - expected))
+
+    def _monitor_loop(self):
+        reported = False
+        while not self._stop_event.wait(self.interval):
+            stalled_for = time.monotonic() - self._last_beat - self.interval
+            if stalled_for < self.threshold:
+                reported = False
+                continue
+            if reported:
+                # Stesso episodio di blocco: lo abbiamo già contato
+                continue
+            reported = True
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame)
+            site = _blocking_site(stack)
+            LOOP_BLOCKED.inc(site=site)
+            self._log_blocked(site, stalled_for, stack)
+
+    def _log_blocked(self, site, stalled_for, stack):
+        now = time.monotonic()
+        if now - self._last_logged.get(site, -self.log_interval) < self.log_interval:
+            return
+        self._last_logged[site] = now
+        formatted = "".join(traceback.format_list(stack[-12:]))
+        logger.warning(f"⏳ Event loop bloccato da oltre {stalled_for * 1000:.0f} ms in '{site}':\n{formatted}")
+
+    def start(self):
+        """Avvia battito e thread di controllo. Va chiamato dall'interno dell'event loop."""
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop_event.clear()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._monitor_thread = threading.Thread(target=self._monitor_loop, name="LoopWatchdog", daemon=True)
+        self._monitor_thread.start()
+        logger.info(f"Watchdog dell'event loop attivo (soglia {self.threshold * 1000:.0f} ms).")
+
+    def stop(self):
+        self._stop_event.set()
+        if self._task:
+            self._task.cancel()
@@ -2,13 +2,16 @@
 import asyncio
 import signal
 
+import config
 from agent import ConversationalAgent, logger
+from supervisor import Supervisor
 
 async def main():
     """
     Funzione principale per avviare e gestire l'agente conversazionale.
     """
-    agent = ConversationalAgent()
+    # Con più barili configurati li fa girare tutti il supervisore, sullo stesso loop
+    agent = Supervisor(config.BARRELS) if config.BARRELS else ConversationalAgent()
 
     # Gestione dell'arresto pulito con Ctrl+C
     loop = asyncio.get_running_loop()
@@ -16,7 +19,7 @@ async def main():
     loop.add_signal_handler(signal.SIGINT, stop.set_result, None)
 
     # Avvia i task principali
-    agent_task = asyncio.create_task(agent.start())
+    agent_task = asyncio.create_task(agent.run() if config.BARRELS else agent.start())
 
     logger.info("Sistema avviato. Premi Ctrl+C per terminare.")
 
@@ -26,7 +29,7 @@ async def main():
     logger.info("Segnale di arresto ricevuto. Pulizia in corso...")
 
     # Ferma l'agente e cancella il task
-    await agent.stop()
+    agent.stop()
     agent_task.cancel()
 
     try:
@@ -39,4 +42,3 @@ if __name__ == "__main__":
         asyncio.run(main())
     except KeyboardInterrupt:
         logger.info("Programma terminato.")
-omar@Omar:~/ProgettoBotte/ProgettoModulare_Funzionante/Progetto_Stabile$
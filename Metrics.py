@@ -0,0 +1,265 @@
+# Progetto_Stabile/metrics.py
+import asyncio
+import bisect
+import logging
+import threading
+import time
+from urllib.parse import parse_qsl
+
+logger = logging.getLogger("Metrics")
+
+# Bucket di default (in secondi), pensati per latenze di rete e audio
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape_label(value):
+    """Escape del formato testuale di Prometheus: un valore con virgolette o a capo non rompe lo scrape."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    body = ",".join(f'{k}="{_escape_label(v)}"' for k, v in pairs)
+    return "{" + body + "}"
+
+
+class _Metric:
+    """Base comune: nome, descrizione, etichette e un lock per i thread."""
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self._values = {}
+        self._functions = {}
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, fn, **labels):
+        """Il valore viene letto da `fn` solo al momento dello scrape."""
+        key = self._key(labels)
+        with self._lock:
+            self._functions[key] = fn
+
+    def _samples(self):
+        with self._lock:
+            values = dict(self._values)
+            functions = list(self._functions.items())
+        for key, fn in functions:
+            try:
+                values[key] = fn()
+            except Exception:
+                continue
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # [conteggi per bucket..., +Inf] e somma
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def time(self, **labels):
+        """Context manager che osserva la durata del blocco."""
+        return _Timer(self, labels)
+
+    def _samples(self):
+        with self._lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self._series.items()]
+        lines = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', bound))} {cumulative}")
+            cumulative += counts[-1]
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', '+Inf'))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class MetricsRegistry:
+    """Raccoglie tutte le metriche e le rende nel formato testuale di Prometheus."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+# Creiamo un registro unico che verrà usato in tutto il progetto
+registry = MetricsRegistry()
+
+# --- Metriche del progetto ---
+AUDIO_QUEUE_DEPTH = registry.gauge(
+    "rumbtide_audio_queue_depth", "Chunk audio TTS in attesa di riproduzione, per barile.", ("barrel",))
+AUDIO_UNDERRUNS = registry.counter(
+    "rumbtide_audio_underruns_total", "Volte in cui la riproduzione è rimasta senza audio a metà risposta.")
+WS_RECONNECTS = registry.counter(
+    "rumbtide_websocket_reconnects_total", "Riconnessioni al websocket ElevenLabs.", ("reason",))
+WS_RECONNECT_DURATION = registry.histogram(
+    "rumbtide_websocket_reconnect_duration_seconds", "Tempo dalla disconnessione alla nuova connessione.",
+    buckets=(0.5, 1.0, 2.5, 5.0, 7.5, 10.0, 30.0, 60.0))
+TOOL_CALLS = registry.counter(
+    "rumbtide_tool_calls_total", "Chiamate ai tool per esito.", ("tool", "status"))
+TOOL_LATENCY = registry.histogram(
+    "rumbtide_tool_latency_seconds", "Durata di esecuzione dei tool.", ("tool",))
+API_ERRORS = registry.counter(
+    "rumbtide_external_api_errors_total", "Errori delle API esterne per servizio e status HTTP.", ("service", "status"))
+# Alimentata dal watchdog dell'event loop (loop_watchdog.py)
+LOOP_LAG = registry.histogram(
+    "rumbtide_event_loop_lag_seconds", "Ritardo di schedulazione dell'event loop.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+
+
+def record_api_error(service: str, error: Exception):
+    """Conta un errore di un'API esterna, usando lo status HTTP se disponibile."""
+    status = getattr(error, "http_status", None) or getattr(error, "status_code", None) or "n/a"
+    API_ERRORS.inc(service=service, status=status)
+
+
+class MetricsServer:
+    """
+    Piccolo server HTTP sull'event loop corrente che espone /metrics.
+    Le metriche vengono formattate solo quando qualcuno fa lo scrape.
+    Altri percorsi di amministrazione si aggiungono in `routes`: path -> handler(query) che
+    restituisce (status, testo).
+    """
+
+    def __init__(self, host="127.0.0.1", port=9108):
+        self.host = host
+        self.port = port
+        self.routes = {}
+        self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Consumiamo gli header fino alla riga vuota
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=5)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+            parts = request_line.decode("latin-1").split()
+            path, _, query = (parts[1] if len(parts) > 1 else "/").partition("?")
+            if path == "/metrics":
+                status, content_type = "200 OK", "text/plain; version=0.0.4; charset=utf-8"
+                body = registry.render().encode("utf-8")
+            elif path in self.routes:
+                status, text = self.routes[path](dict(parse_qsl(query)))
+                content_type, body = "text/plain; charset=utf-8", text.encode("utf-8")
+            else:
+                status, content_type, body = "404 Not Found", "text/plain; charset=utf-8", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+            )
+            await writer.drain()
+        except Exception as e:
+            logger.debug(f"Richiesta metriche non valida: {e}")
+        finally:
+            writer.close()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"📈 Endpoint metriche attivo su http://{self.host}:{self.port}/metrics")
+
+    def stop(self):
+        if self._server:
+            self._server.close()
+            logger.info("Endpoint metriche fermato.")
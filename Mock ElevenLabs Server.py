@@ -0,0 +1,297 @@
+# Progetto_Stabile/mock_elevenlabs_server.py
+"""
+Server websocket locale che imita il convai di ElevenLabs riproducendo sessioni registrate.
+
+Una sessione è un file JSONL: una riga per messaggio server->client,
+    {"t": 0.25, "message": {"type": "audio", "audio_event": {...}}}
+dove `t` sono i secondi dall'inizio della sessione. I messaggi `client_tool_call`
+aspettano la `client_tool_response` del client prima di proseguire, come il server vero.
+"""
+import asyncio
+import base64
+import json
+import logging
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import websockets
+
+logger = logging.getLogger("MockElevenLabs")
+
+TOOL_RESPONSE_TIMEOUT_S = 30
+# Formato dell'audio nelle sessioni (registrate e sintetiche); il client può chiederne un altro nell'URL
+SESSION_FORMAT = "pcm_24000"
+# Formato delle sessioni flavor="client": ElevenLabsClient chiede "ulaw", che ElevenLabs manda solo a 8 kHz
+CLIENT_FORMAT = "ulaw_8000"
+
+
+def load_session(path):
+    """Carica una sessione registrata da file JSONL."""
+    events = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                events.append(json.loads(line))
+    return events
+
+
+def save_session(path, events):
+    with open(path, "w", encoding="utf-8") as f:
+        for event in events:
+            f.write(json.dumps(event) + "\n")
+
+
+def _tone_chunk(seq, samples, rate, encoding="pcm"):
+    """
+    Chunk di un tono con il numero di sequenza in testa (per le misure): nei primi due campioni
+    se PCM16, nei primi quattro byte se µ-law (la codifica con perdita non lo conserverebbe).
+    """
+    t = np.arange(samples) / rate
+    pcm = (np.sin(2 * np.pi * 220 * t) * 8000).astype(np.int16)
+    if encoding.startswith("ulaw"):
+        from audio_core import encode
+
+        payload = bytearray(encode(pcm, "ulaw"))
+        payload[:4] = bytes((0x7A, 0x7A, (seq >> 8) & 0x7F, seq & 0xFF))
+        return base64.b64encode(payload).decode("ascii")
+    pcm[0], pcm[1] = 0x7A7A, seq & 0x7FFF
+    return base64.b64encode(pcm.tobytes()).decode("ascii")
+
+
+def chunk_sequence(samples):
+    """Recupera il numero di sequenza messo da `_tone_chunk`, o None se il chunk non è marcato."""
+    if len(samples) >= 2 and samples[0] == 0x7A7A:
+        return int(samples[1])
+    return None
+
+
+def ulaw_chunk_sequence(payload):
+    """Come chunk_sequence, per i byte µ-law non ancora decodificati."""
+    if len(payload) >= 4 and payload[0] == payload[1] == 0x7A:
+        return (payload[2] << 8) | payload[3]
+    return None
+
+
+_PHRASES = ("arr fumo dal barile", "sento le catene", "la mia maledizione", "mozzo ascolta")
+_VISEMES = ("aa", "O", "PP", "E", "sil")
+
+
+def _timing(seq, chunk_ms):
+    """Allineamento per carattere e visemi sintetici, distribuiti sulla durata del chunk."""
+    text = _PHRASES[seq % len(_PHRASES)]
+    step = chunk_ms / len(text)
+    alignment = {"chars": list(text), "char_start_times_ms": [round(i * step) for i in range(len(text))],
+                 "char_durations_ms": [round(step)] * len(text)}
+    visemes = [{"viseme": v, "start_time_ms": round(i * chunk_ms / len(_VISEMES))} for i, v in enumerate(_VISEMES)]
+    return alignment, visemes
+
+
+def synthetic_session(turns=5, chunks_per_turn=20, chunk_ms=100, rate=24000, flavor="agent",
+                      tools=("get_current_song", "volume_up", "next_track"), turn_gap=0.5):
+    """
+    Genera una sessione deterministica senza bisogno di registrazioni.
+    flavor="agent" produce gli eventi letti da ConversationalAgent,
+    flavor="client" quelli letti da ElevenLabsClient.
+    """
+    from audio_core import encoding_rate
+
+    events = []
+    t = 0.0
+    seq = 0
+    samples = int(rate * chunk_ms / 1000)
+    client_rate = encoding_rate(CLIENT_FORMAT)
+    client_samples = int(client_rate * chunk_ms / 1000)
+    for turn in range(turns):
+        if flavor == "agent":
+            events.append({"t": t, "message": {"type": "user_transcript",
+                           "user_transcription_event": {"user_transcript": f"Capitano, domanda numero {turn}"}}})
+            events.append({"t": t, "message": {"type": "ping", "ping_event": {"event_id": turn, "ping_ms": 0}}})
+            if tools:
+                tool_name = tools[turn % len(tools)]
+                events.append({"t": t, "message": {"type": "client_tool_call", "client_tool_call": {
+                    "tool_name": tool_name, "tool_call_id": f"call_{turn}", "parameters": {}}}})
+            events.append({"t": t, "message": {"type": "agent_response_start"}})
+            for _ in range(chunks_per_turn):
+                alignment, visemes = _timing(seq, chunk_ms)
+                events.append({"t": t, "message": {"type": "audio", "audio_event": {
+                    "audio_base_64": _tone_chunk(seq, samples, rate), "event_id": seq,
+                    "alignment": alignment, "visemes": visemes}}})
+                seq += 1
+                t += chunk_ms / 1000
+            events.append({"t": t, "message": {"type": "agent_response", "agent_response_event": {
+                "agent_response": f"Arr, risposta numero {turn}."}}})
+        else:
+            events.append({"t": t, "message": {"type": "conversation_initiation_metadata"}})
+            for _ in range(chunks_per_turn):
+                events.append({"t": t, "message": {"type": "agent_response", "seq": seq,
+                                                   "audio": _tone_chunk(seq, client_samples, client_rate,
+                                                                        CLIENT_FORMAT)}})
+                events.append({"t": t, "message": {"type": "vad_score", "score": 0.1}})
+                seq += 1
+                t += chunk_ms / 1000
+        t += turn_gap
+    return events
+
+
+class MockConvaiServer:
+    """
+    Riproduce una sessione verso ogni client che si connette e raccoglie le statistiche:
+    tempi di invio di audio/ping/tool e tempi di risposta del client.
+    speed=0 riproduce il più velocemente possibile, 1.0 in tempo reale.
+    bandwidth (byte/s) simula una rete lenta: ogni messaggio occupa il collegamento per len/bandwidth.
+    """
+
+    def __init__(self, events, host="127.0.0.1", port=0, speed=0.0, close_on_end=False, bandwidth=None):
+        self.events = events
+        self.host = host
+        self.port = port
+        self.speed = speed
+        self.close_on_end = close_on_end
+        self.bandwidth = bandwidth
+        self._server = None
+        # Chunk già convertiti, per (event_id, formato)
+        self._transcoded = {}
+        self.replay_done = asyncio.Event()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {
+            "connections": 0,
+            "replays_done": 0,
+            "messages_sent": 0,
+            "bytes_sent": 0,
+            "client_messages": 0,
+            "mic_chunks": 0,
+            "mic_bytes": 0,
+            "initiation": None,
+            "output_formats": [],
+            "audio_sent_at": {},
+            "ping_rtt": [],
+            "tool_latency": {},
+            "contextual_updates": [],
+        }
+        self._ping_sent_at = {}
+        self._tool_sent_at = {}
+        self._tool_done = {}
+
+    @property
+    def url(self):
+        return f"ws://{self.host}:{self.port}/v1/convai/conversation"
+
+    async def start(self):
+        self._server = await websockets.serve(self._handler, self.host, self.port, max_size=None)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"Mock ElevenLabs in ascolto su {self.url}")
+        return self
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _read_client(self, websocket):
+        async for raw in websocket:
+            now = time.perf_counter()
+            self.stats["client_messages"] += 1
+            message = json.loads(raw)
+            if "user_audio_chunk" in message:
+                self.stats["mic_chunks"] += 1
+                self.stats["mic_bytes"] += len(message["user_audio_chunk"])
+                continue
+            msg_type = message.get("type")
+            if msg_type == "pong":
+                sent_at = self._ping_sent_at.pop((id(websocket), message.get("event_id")), None)
+                if sent_at is not None:
+                    self.stats["ping_rtt"].append(now - sent_at)
+            elif msg_type == "client_tool_response":
+                call_id = message["client_tool_response"].get("tool_call_id")
+                sent = self._tool_sent_at.pop((id(websocket), call_id), None)
+                if sent is not None:
+                    tool_name, sent_at = sent
+                    self.stats["tool_latency"].setdefault(tool_name, []).append(now - sent_at)
+                done = self._tool_done.pop((id(websocket), call_id), None)
+                if done is not None:
+                    done.set()
+            elif msg_type == "conversation_initiation_client_data":
+                self.stats["initiation"] = message
+            elif msg_type == "contextual_update":
+                self.stats["contextual_updates"].append(message.get("text"))
+
+    def _transcode(self, message, encoding):
+        """Lo stesso evento audio nel formato chiesto dal client."""
+        from audio_core import encode, encoding_rate
+
+        audio_event = message["audio_event"]
+        key = (audio_event.get("event_id"), encoding)
+        if key not in self._transcoded:
+            samples = np.frombuffer(base64.b64decode(audio_event["audio_base_64"]), dtype=np.int16)
+            source_rate, rate = encoding_rate(SESSION_FORMAT), encoding_rate(encoding)
+            if rate != source_rate:
+                positions = np.arange(0, len(samples), source_rate / rate)
+                samples = np.interp(positions, np.arange(len(samples)), samples).astype(np.int16)
+            self._transcoded[key] = base64.b64encode(encode(samples, encoding)).decode("ascii")
+        return {**message, "audio_event": {**audio_event, "audio_base_64": self._transcoded[key]}}
+
+    async def _send(self, websocket, message, encoding=SESSION_FORMAT):
+        msg_type = message.get("type")
+        if msg_type == "audio" and encoding != SESSION_FORMAT:
+            message = self._transcode(message, encoding)
+        payload = json.dumps(message)
+        now = time.perf_counter()
+        if msg_type == "audio":
+            self.stats["audio_sent_at"][message["audio_event"].get("event_id")] = now
+        elif msg_type == "agent_response" and "seq" in message:
+            self.stats["audio_sent_at"][message["seq"]] = now
+        elif msg_type == "ping":
+            self._ping_sent_at[(id(websocket), message["ping_event"]["event_id"])] = now
+        await websocket.send(payload)
+        self.stats["messages_sent"] += 1
+        self.stats["bytes_sent"] += len(payload)
+        if self.bandwidth:
+            await asyncio.sleep(len(payload) / self.bandwidth)
+
+    async def _replay(self, websocket, encoding=SESSION_FORMAT):
+        started = time.perf_counter()
+        for event in self.events:
+            if self.speed:
+                delay = event["t"] / self.speed - (time.perf_counter() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            message = event["message"]
+            if message.get("type") == "client_tool_call":
+                call = message["client_tool_call"]
+                # Le sessioni riprodotte in parallelo hanno gli stessi id: li distingue la connessione
+                key = (id(websocket), call["tool_call_id"])
+                done = self._tool_done[key] = asyncio.Event()
+                self._tool_sent_at[key] = (call["tool_name"], time.perf_counter())
+                await self._send(websocket, message, encoding)
+                try:
+                    await asyncio.wait_for(done.wait(), timeout=TOOL_RESPONSE_TIMEOUT_S)
+                except asyncio.TimeoutError:
+                    logger.warning(f"Nessuna risposta al tool '{call['tool_name']}' entro {TOOL_RESPONSE_TIMEOUT_S}s.")
+            else:
+                await self._send(websocket, message, encoding)
+            if not self.speed:
+                # Lasciamo respirare il loop anche in modalità "più veloce possibile"
+                await asyncio.sleep(0)
+
+    async def _handler(self, websocket, path=None):
+        self.stats["connections"] += 1
+        query = parse_qs(urlsplit(path or getattr(websocket, "path", "")).query)
+        encoding = query.get("output_format", [SESSION_FORMAT])[0]
+        self.stats["output_formats"].append(encoding)
+        reader = asyncio.create_task(self._read_client(websocket))
+        try:
+            await self._replay(websocket, encoding)
+            self.stats["replays_done"] += 1
+            self.replay_done.set()
+            if self.close_on_end:
+                await websocket.close()
+            else:
+                await reader
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            reader.cancel()
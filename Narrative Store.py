@@ -0,0 +1,155 @@
+# Progetto_Stabile/narrative_store.py
+"""
+La storia di ogni visitatore, salvata in locale: chi riconnette o torna riprende da dove era rimasto.
+
+Per ogni chiave (visitatore o sessione) due file nella cartella NARRATIVE_DIR:
+- <chiave>.journal: un evento JSON per riga, solo in aggiunta (battute, rituali, tool);
+- <chiave>.snapshot.json: lo stato compatto, riscritto ogni NARRATIVE_SNAPSHOT_EVERY eventi,
+  dopo il quale il journal riparte da vuoto.
+Caricare una storia costa quindi uno snapshot e al più quella manciata di righe, qualunque sia
+la sua lunghezza. All'apertura della sessione l'agente ne manda un riassunto come
+contextual_update: niente storia da far rileggere all'LLM.
+"""
+import json
+import logging
+import os
+import re
+import time
+
+import metrics
+
+logger = logging.getLogger("NarrativeStore")
+
+# Scambi recenti tenuti nello stato (e raccontati alla riconnessione)
+RECENT_EXCHANGES = 6
+# Lunghezza massima di una battuta salvata
+MAX_LINE_CHARS = 200
+
+STORY_LOAD_SECONDS = metrics.registry.histogram(
+    "rumbtide_story_load_seconds", "Tempo per caricare la storia di un visitatore (snapshot + journal).")
+
+
+def _empty_state():
+    return {"turns": 0, "recent": [], "rituals": {}, "tools": {}, "started_at": round(time.time(), 3)}
+
+
+def apply(state, entry):
+    """Applica un evento del journal allo stato. Deve restare deterministica: serve anche al replay."""
+    kind, text = entry["kind"], entry.get("text")
+    if kind in ("user", "agent"):
+        if kind == "user": state["turns"] += 1
+        state["recent"] = (state["recent"] + [[kind, text]])[-RECENT_EXCHANGES:]
+    elif kind == "ritual":
+        state["rituals"][text] = state["rituals"].get(text, 0) + 1
+    elif kind == "tool":
+        state["tools"][text] = state["tools"].get(text, 0) + 1
+    elif kind == "new_visitor":
+        state.clear()
+        state.update(_empty_state())
+    state["updated_at"] = entry["t"]
+
+
+def describe(state):
+    """Riassunto per il contextual_update: poche righe, quanto basta per riprendere il filo."""
+    parts = [f"Storia finora con questo visitatore: {state['turns']} scambi."]
+    if state["rituals"]:
+        parts.append("Rituali già evocati: " + ", ".join(f"{n} (x{c})" for n, c in state["rituals"].items()) + ".")
+    if state["tools"]:
+        parts.append("Richieste già fatte: " + ", ".join(sorted(state["tools"])) + ".")
+    if state["recent"]:
+        speakers = {"user": "Visitatore", "agent": "Capitano"}
+        parts.append("Ultimi scambi: " + " / ".join(f"{speakers[who]}: '{text}'" for who, text in state["recent"]))
+    parts.append("Riprendi la storia da qui, senza ricominciare da capo.")
+    return " ".join(parts)
+
+
+class Story:
+    """La storia aperta di una chiave. Va usata da un solo thread (l'event loop dell'agente)."""
+
+    def __init__(self, store, key, state, seq, snapshot_seq, journal):
+        self.store = store
+        self.key = key
+        self.state = state
+        self.seq = seq
+        self._snapshot_seq = snapshot_seq
+        self._journal = journal
+
+    def record(self, kind, text=None):
+        if self._journal is None: return
+        if isinstance(text, str): text = text.strip()[:MAX_LINE_CHARS]
+        self.seq += 1
+        entry = {"seq": self.seq, "t": round(time.time(), 3), "kind": kind, "text": text}
+        apply(self.state, entry)
+        self._journal.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._journal.flush()
+        if self.seq - self._snapshot_seq >= self.store.snapshot_every:
+            self.snapshot()
+
+    def snapshot(self):
+        """Riscrive lo stato compatto e svuota il journal. Prima lo snapshot: un crash a metà non perde nulla."""
+        snapshot_path, _ = self.store.paths(self.key)
+        temporary = snapshot_path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump({"key": self.key, "seq": self.seq, "state": self.state}, f, ensure_ascii=False)
+        os.replace(temporary, snapshot_path)
+        self._journal.truncate(0)
+        self._snapshot_seq = self.seq
+
+    def has_history(self):
+        return self.state["turns"] > 0 or bool(self.state["rituals"])
+
+    def describe(self):
+        return describe(self.state)
+
+    def close(self):
+        if self._journal:
+            self._journal.close()
+            self._journal = None
+
+
+class NarrativeStore:
+    def __init__(self, directory, snapshot_every=50):
+        self.directory = directory
+        self.snapshot_every = snapshot_every
+        os.makedirs(directory, exist_ok=True)
+
+    def paths(self, key):
+        name = re.sub(r"[^\w.-]", "_", key)
+        return (os.path.join(self.directory, f"{name}.snapshot.json"),
+                os.path.join(self.directory, f"{name}.journal"))
+
+    def open(self, key):
+        """Carica la storia di `key` (vuota se nuova) e la tiene aperta per aggiungere eventi."""
+        started_at = time.perf_counter()
+        snapshot_path, journal_path = self.paths(key)
+        state, seq = _empty_state(), 0
+        if os.path.exists(snapshot_path):
+            try:
+                with open(snapshot_path, encoding="utf-8") as f:
+                    snapshot = json.load(f)
+                state, seq = snapshot["state"], snapshot["seq"]
+            except (OSError, ValueError, KeyError) as e:
+                logger.error(f"Snapshot della storia '{key}' illeggibile, riparto dal journal: {e}")
+        snapshot_seq = seq
+        if os.path.exists(journal_path):
+            valid_bytes = 0
+            with open(journal_path, "rb") as f:
+                for line in f:
+                    try:
+                        if not line.endswith(b"\n"): raise ValueError("riga incompleta")
+                        entry = json.loads(line)
+                    except ValueError:
+                        break
+                    valid_bytes += len(line)
+                    # Eventi già nello snapshot (crash tra snapshot e svuotamento del journal)
+                    if entry["seq"] > seq:
+                        apply(state, entry)
+                        seq = entry["seq"]
+            if valid_bytes < os.path.getsize(journal_path):
+                # Riga scritta a metà durante un crash: è per forza l'ultima, la si toglie
+                os.truncate(journal_path, valid_bytes)
+        journal = open(journal_path, "a", encoding="utf-8")
+        elapsed = time.perf_counter() - started_at
+        STORY_LOAD_SECONDS.observe(elapsed)
+        logger.info(f"📖 Storia '{key}' caricata in {elapsed * 1000:.1f} ms ({state['turns']} scambi).")
+        return Story(self, key, state, seq, snapshot_seq, journal)
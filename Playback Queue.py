@@ -0,0 +1,197 @@
+# Progetto_Stabile/playback_queue.py
+"""
+La coda di riproduzione di Spotify, letta in anticipo e tenuta in locale.
+
+A ogni play o cambio di canzone pubblicato su playback_state si legge /me/player/queue
+(una chiamata, a priorità di background): brano corrente e i prossimi QUEUE_DEPTH, ridotti
+ai pochi campi che servono. Da qui "cosa suona?" e "cosa viene dopo?" si rispondono senza
+chiamate, alla fine stimata del brano la coda si rilegge e next_track aggiorna lo stato subito,
+prima che Spotify confermi (e lo ripristina se il comando fallisce).
+"""
+import asyncio
+import logging
+import time
+
+import metrics
+from playback_state import playback_state
+from player_scheduler import player_scheduler
+from spotify_client import get_spotify_client
+from spotify_scheduler import PRIORITY_BACKGROUND, spotify_scheduler
+from tool_cache import tool_cache
+
+logger = logging.getLogger("PlaybackQueue")
+
+# Brani in coda tenuti in memoria
+QUEUE_DEPTH = 5
+# Oltre questa età lo stato locale non basta per rispondere: si chiede a Spotify
+LOCAL_ANSWER_MAX_AGE_S = 5.0
+# La fine del brano stimata in locale scatta un po' dopo quella vera, mai prima
+TRACK_END_GRACE_S = 0.5
+# Dopo un cambio ottimistico la coda si rilegge quando Spotify ha avuto il tempo di adeguarsi
+CONFIRM_DELAY_S = 1.5
+# Risposte dei tool in cache che un cambio di brano locale rende vecchie
+_PLAYBACK_READS = ("get_current_song", "get_next_song")
+
+QUEUE_FETCHES = metrics.registry.counter(
+    "rumbtide_playback_queue_fetches_total", "Letture della coda di Spotify, per esito.", ("status",))
+TRACK_ENDS = metrics.registry.counter(
+    "rumbtide_playback_track_ends_total", "Fini brano stimate in locale.")
+PLAYBACK_ANSWERS = metrics.registry.counter(
+    "rumbtide_playback_answers_total", "Domande su brano corrente e successivo, per fonte (local, live).",
+    ("tool", "source"))
+
+
+def compact(track):
+    """Solo i campi che servono, nella stessa forma di un item di current_playback()."""
+    if not track:
+        return None
+    artists = track.get('artists') or [{}]
+    return {"name": track.get('name'), "artists": [{"name": artists[0].get('name')}],
+            "uri": track.get('uri'), "duration_ms": track.get('duration_ms')}
+
+
+class PlaybackQueue:
+    """Segue playback_state dall'event loop dei tool; start() e stop() li chiama ProcessServices."""
+
+    def __init__(self, client_factory=get_spotify_client, depth=QUEUE_DEPTH):
+        self.client_factory = client_factory
+        self.depth = depth
+        self.current = None
+        self.upcoming = []
+        self.fetched_at = 0.0
+        self._task = None
+        self._fetch_task = None
+        self._end_timer = None
+
+    # --- Risposte locali ---
+    def _state_age(self):
+        return time.monotonic() - player_scheduler.state.updated_at
+
+    def now_playing(self):
+        """Lo stato pubblicato, se abbastanza recente da rispondere senza chiamate; altrimenti None."""
+        version, snapshot = playback_state.current()
+        if not version or self._state_age() > LOCAL_ANSWER_MAX_AGE_S:
+            return None
+        return {"snapshot": snapshot}
+
+    def up_next(self):
+        """Il prossimo brano, se la coda letta corrisponde al brano che sta suonando; altrimenti None."""
+        _, snapshot = playback_state.current()
+        if not self.current or not snapshot or snapshot["uri"] != self.current["uri"]:
+            return None
+        return {"track": self.upcoming[0] if self.upcoming else None}
+
+    # --- Lettura della coda ---
+    def refresh(self, delay=0.0):
+        """
+        Rilegge la coda in background (una lettura alla volta). Restituisce il task,
+        che vale True se la lettura è riuscita e False se Spotify non ha risposto.
+        """
+        if self._fetch_task is None or self._fetch_task.done():
+            self._fetch_task = asyncio.get_running_loop().create_task(self._fetch(delay))
+        return self._fetch_task
+
+    async def _fetch(self, delay):
+        if delay: await asyncio.sleep(delay)
+        spotify = self.client_factory()
+        if spotify is None: return False
+        try:
+            response = await spotify_scheduler.call(spotify.queue, priority=PRIORITY_BACKGROUND)
+        except Exception as e:
+            QUEUE_FETCHES.inc(status="error")
+            logger.warning(f"Lettura della coda di Spotify fallita: {e}")
+            return False
+        QUEUE_FETCHES.inc(status="success")
+        response = response or {}
+        self.current = compact(response.get('currently_playing'))
+        self.upcoming = [compact(t) for t in (response.get('queue') or [])[:self.depth] if t]
+        self.fetched_at = time.monotonic()
+        self._schedule_track_end()
+        return True
+
+    # --- Fine brano ---
+    def _schedule_track_end(self):
+        if self._end_timer: self._end_timer.cancel()
+        self._end_timer = None
+        state = player_scheduler.state
+        progress = state.estimated_progress_ms()
+        _, snapshot = playback_state.current()
+        if not self.current or not self.current["duration_ms"] or progress is None or not state.is_playing:
+            return
+        # L'avanzamento locale vale solo se descrive il brano in coda; se dice che è già finito
+        # è vecchio (brano appena cambiato, repeat): si aspetta la prossima lettura
+        if not snapshot or snapshot["uri"] != self.current["uri"] or progress >= self.current["duration_ms"]:
+            return
+        remaining = (self.current["duration_ms"] - progress) / 1000
+        self._end_timer = asyncio.get_running_loop().call_later(remaining + TRACK_END_GRACE_S, self._on_track_end)
+
+    def _on_track_end(self):
+        """
+        Fine stimata: si rilegge soltanto la coda. Nessuno stato inventato viene pubblicato,
+        perché con repeat, crossfade o un orologio che deriva il brano successivo sarebbe un'ipotesi.
+        """
+        self._end_timer = None
+        TRACK_ENDS.inc()
+        self.refresh(delay=CONFIRM_DELAY_S)
+
+    # --- Cambi ottimistici ---
+    def advance(self):
+        """
+        Passa in locale al prossimo brano della coda e lo pubblica, senza aspettare Spotify.
+        Restituisce lo stato precedente per rollback(); la coda si rilegge poco dopo per conferma.
+        """
+        previous = (self.current, list(self.upcoming))
+        if self.upcoming:
+            self.current = self.upcoming.pop(0)
+            with player_scheduler.state.lock:
+                player_scheduler.state.progress_ms = 0
+                player_scheduler.state.is_playing = True
+                player_scheduler.state.updated_at = time.monotonic()
+            playback_state.publish({"item": self.current, "is_playing": True})
+            tool_cache.invalidate(*_PLAYBACK_READS)
+            self._schedule_track_end()
+        self.refresh(delay=CONFIRM_DELAY_S)
+        return previous
+
+    def rollback(self, previous):
+        """Il comando è fallito: torna allo stato di prima."""
+        self.current, self.upcoming = previous
+        if self.current: playback_state.publish({"item": self.current, "is_playing": True})
+        tool_cache.invalidate(*_PLAYBACK_READS)
+        self._schedule_track_end()
+
+    # --- Ciclo principale ---
+    def _on_state(self, snapshot):
+        if snapshot is None or not snapshot["is_playing"]:
+            # In pausa il brano non finisce
+            if self._end_timer: self._end_timer.cancel()
+            self._end_timer = None
+        elif self.current and snapshot["uri"] == self.current["uri"]:
+            # Stesso brano (ripresa dopo una pausa, o il nostro cambio ottimistico): basta riprogrammare la fine
+            self._schedule_track_end()
+        else:
+            self.refresh()
+
+    async def _follow(self):
+        subscription = playback_state.subscribe()
+        try:
+            while True:
+                self._on_state(await subscription.next())
+        finally:
+            playback_state.unsubscribe(subscription)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._follow())
+            player_scheduler.queue = self
+
+    def stop(self):
+        if player_scheduler.queue is self: player_scheduler.queue = None
+        for task in (self._task, self._fetch_task):
+            if task: task.cancel()
+        if self._end_timer: self._end_timer.cancel()
+        self._task = self._fetch_task = self._end_timer = None
+
+
+# Creiamo un'istanza unica che verrà usata in tutto il progetto
+playback_queue = PlaybackQueue()
@@ -0,0 +1,112 @@
+# Progetto_Stabile/playback_state.py
+import asyncio
+import logging
+import threading
+
+import metrics
+
+logger = logging.getLogger("PlaybackState")
+
+STATE_CHANGES = metrics.registry.counter(
+    "rumbtide_playback_state_changes_total", "Cambi di stato della riproduzione pubblicati agli iscritti.")
+
+
+def summarize(playback):
+    """Riduce una risposta di current_playback() ai soli campi che interessano all'agente."""
+    if not playback or not playback.get('item'):
+        return None
+    track = playback['item']
+    artists = track.get('artists') or [{}]
+    return {
+        "track": track.get('name'),
+        "artist": artists[0].get('name'),
+        "uri": track.get('uri'),
+        "is_playing": bool(playback.get('is_playing')),
+    }
+
+
+def describe(snapshot):
+    """Testo compatto per il contextual_update: poche parole, pochi token."""
+    if snapshot is None:
+        return "Stato Spotify: nessuna canzone in riproduzione."
+    status = "in riproduzione" if snapshot["is_playing"] else "in pausa"
+    return f"Stato Spotify: {status} '{snapshot['track']}' di {snapshot['artist']}."
+
+
+class Subscription:
+    """
+    Iscrizione di un event loop ai cambi di stato. Tiene solo l'ultimo valore:
+    una raffica di cambi mentre l'agente è occupato diventa un solo aggiornamento.
+    """
+
+    def __init__(self, hub, loop):
+        self.hub = hub
+        self._loop = loop
+        self._changed = asyncio.Event()
+        self._last_version = 0
+
+    def _notify(self):
+        try:
+            self._loop.call_soon_threadsafe(self._changed.set)
+        except RuntimeError:
+            # Loop già chiuso: l'iscrizione è orfana
+            self.hub.unsubscribe(self)
+
+    async def next(self):
+        """Aspetta un cambio rispetto all'ultimo valore restituito e restituisce lo stato attuale."""
+        while True:
+            version, snapshot = self.hub.current()
+            if version != self._last_version:
+                self._last_version = version
+                return snapshot
+            self._changed.clear()
+            await self._changed.wait()
+
+
+class PlaybackStateHub:
+    """
+    Punto unico in cui arriva lo stato di Spotify letto da chiunque (Guardiano, tool).
+    Pubblica agli iscritti solo i cambi di canzone o di stato play/pausa.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+        # Nessuno stato noto finché non arriva la prima lettura
+        self._version = 0
+        self._subscribers = set()
+
+    def publish(self, playback):
+        """Chiamabile da qualsiasi thread con la risposta di current_playback()."""
+        snapshot = summarize(playback)
+        with self._lock:
+            if self._version and snapshot == self._snapshot:
+                return False
+            self._snapshot = snapshot
+            self._version += 1
+            subscribers = list(self._subscribers)
+        STATE_CHANGES.inc()
+        logger.info(f"🎵 {describe(snapshot)}")
+        for subscription in subscribers:
+            subscription._notify()
+        return True
+
+    def current(self):
+        """(versione, stato): versione 0 vuol dire che lo stato non è ancora noto."""
+        with self._lock:
+            return self._version, self._snapshot
+
+    def subscribe(self):
+        """Iscrive l'event loop corrente. Il primo next() restituisce subito lo stato se già noto."""
+        subscription = Subscription(self, asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+
+# Creiamo un'istanza unica che verrà usata in tutto il progetto
+playback_state = PlaybackStateHub()
@@ -0,0 +1,209 @@
+# Progetto_Stabile/player_scheduler.py
+import asyncio
+import logging
+import threading
+import time
+
+import metrics
+from spotify_client import get_spotify_client
+from spotify_scheduler import spotify_scheduler
+
+logger = logging.getLogger("PlayerScheduler")
+
+# Finestra in cui i comandi arrivati durante un invio vengono raccolti e fusi
+DEBOUNCE_S = 0.1
+# Oltre questa età lo stato locale del player non è più affidabile e va riletto
+STATE_MAX_AGE_S = 30.0
+# Spotify riavvia la traccia corrente se "indietro" arriva dopo i primi secondi
+PREVIOUS_RESTART_MS = 3000
+
+PLAYER_COMMANDS = metrics.registry.counter(
+    "rumbtide_player_commands_total", "Comandi del player richiesti e chiamate effettivamente inviate.",
+    ("command", "outcome"))
+
+
+class PlayerState:
+    """Stato del player mantenuto in locale, aggiornato da comandi e letture (anche del Guardiano)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.volume = None
+        self.is_playing = None
+        self.progress_ms = None
+        self.updated_at = 0.0
+
+    def observe(self, playback):
+        """Aggiorna lo stato da una risposta di current_playback()."""
+        with self.lock:
+            self.updated_at = time.monotonic()
+            if not playback:
+                self.volume = None
+                self.is_playing = False
+                self.progress_ms = None
+                return
+            device = playback.get('device') or {}
+            self.volume = device.get('volume_percent')
+            self.is_playing = bool(playback.get('is_playing'))
+            self.progress_ms = playback.get('progress_ms')
+
+    def is_fresh(self):
+        return time.monotonic() - self.updated_at < STATE_MAX_AGE_S
+
+    def estimated_progress_ms(self):
+        with self.lock:
+            if self.progress_ms is None or not self.is_fresh():
+                return None
+            elapsed = (time.monotonic() - self.updated_at) * 1000 if self.is_playing else 0
+            return self.progress_ms + elapsed
+
+
+class _Batch:
+    def __init__(self):
+        self.futures = []
+        self.requests = 0
+        self.delta = 0
+        self.action = None
+
+
+class PlayerCommandScheduler:
+    """
+    Sta davanti ai controlli del player Spotify e fonde le raffiche di comandi.
+    Il primo comando parte subito; quelli che arrivano mentre è in volo vengono
+    raccolti e inviati come un'unica chiamata (es. tre "volume su" diventano un
+    solo volume() assoluto, più "salta" di fila diventano un solo next_track()).
+    Le chiamate a spotipy passano dallo scheduler Spotify, con priorità utente.
+    """
+
+    def __init__(self, client_factory=get_spotify_client, debounce=DEBOUNCE_S):
+        self.client_factory = client_factory
+        self.debounce = debounce
+        self.state = PlayerState()
+        # Coda letta in anticipo (playback_queue), se attiva: "next" la fa avanzare prima della conferma
+        self.queue = None
+        self._pending = {}
+        self._running = {}
+
+    async def _spotify_call(self, method_name, *args):
+        spotify = self.client_factory()
+        if spotify is None:
+            raise RuntimeError("Client Spotify non disponibile.")
+        return await spotify_scheduler.call(getattr(spotify, method_name), *args)
+
+    async def _submit(self, command, merge):
+        batch = self._pending.get(command)
+        if batch is None:
+            batch = self._pending[command] = _Batch()
+        else:
+            PLAYER_COMMANDS.inc(command=command, outcome="merged")
+        batch.requests += 1
+        merge(batch)
+        future = asyncio.get_running_loop().create_future()
+        batch.futures.append(future)
+        if command not in self._running:
+            self._running[command] = asyncio.create_task(self._drain(command))
+        return await future
+
+    async def _drain(self, command):
+        first = True
+        try:
+            while self._pending.get(command):
+                if not first:
+                    await asyncio.sleep(self.debounce)
+                first = False
+                batch = self._pending.pop(command)
+                PLAYER_COMMANDS.inc(command=command, outcome="sent")
+                try:
+                    result = await self._execute(command, batch)
+                except Exception as e:
+                    for future in batch.futures:
+                        if not future.done():
+                            future.set_exception(e)
+                            # Ogni chiamante gestisce l'errore: evitiamo avvisi per futures non lette
+                            future.exception()
+                    continue
+                for future in batch.futures:
+                    if not future.done():
+                        future.set_result(result)
+        finally:
+            self._running.pop(command, None)
+
+    async def _execute(self, command, batch):
+        if command == "volume":
+            return await self._apply_volume(batch.delta)
+        if command == "next":
+            if batch.requests > 1:
+                logger.info(f"Raffica di {batch.requests} skip fusa in un solo comando.")
+            queue = self.queue
+            previous = queue.advance() if queue else None
+            try:
+                await self._spotify_call("next_track")
+            except Exception:
+                if queue: queue.rollback(previous)
+                raise
+            self._after_track_change()
+            return True
+        if command == "previous":
+            progress = self.state.estimated_progress_ms()
+            # Il doppio comando serve solo se Spotify riavvierebbe la traccia corrente
+            presses = 1 if progress is not None and progress < PREVIOUS_RESTART_MS else 2
+            for _ in range(presses):
+                await self._spotify_call("previous_track")
+            self._after_track_change()
+            return presses
+        if command == "play_state":
+            if batch.action == "pause":
+                await self._spotify_call("pause_playback")
+            else:
+                await self._spotify_call("start_playback")
+            with self.state.lock:
+                self.state.is_playing = batch.action != "pause"
+            return batch.action
+        raise ValueError(f"Comando sconosciuto: {command}")
+
+    async def _apply_volume(self, delta):
+        with self.state.lock:
+            volume = self.state.volume if self.state.is_fresh() else None
+        if volume is None:
+            playback = await self._spotify_call("current_playback")
+            self.state.observe(playback)
+            if not playback or not playback.get('device'):
+                return None
+            volume = playback['device']['volume_percent']
+        new_volume = max(0, min(100, volume + delta))
+        await self._spotify_call("volume", new_volume)
+        with self.state.lock:
+            self.state.volume = new_volume
+        return new_volume
+
+    def _after_track_change(self):
+        with self.state.lock:
+            self.state.progress_ms = 0
+            self.state.is_playing = True
+            self.state.updated_at = time.monotonic()
+
+    # --- API usate dai tool ---
+    async def change_volume(self, increment: int):
+        """Restituisce il nuovo volume, o None se non c'è niente in riproduzione."""
+        def merge(batch):
+            batch.delta += increment
+        return await self._submit("volume", merge)
+
+    async def next_track(self):
+        return await self._submit("next", lambda batch: None)
+
+    async def previous_track(self):
+        return await self._submit("previous", lambda batch: None)
+
+    async def pause(self):
+        def merge(batch):
+            batch.action = "pause"
+        return await self._submit("play_state", merge)
+
+    async def resume(self):
+        def merge(batch):
+            batch.action = "resume"
+        return await self._submit("play_state", merge)
+
+
+# Creiamo un'istanza unica che verrà usata in tutto il progetto
+player_scheduler = PlayerCommandScheduler()
@@ -0,0 +1,340 @@
+# Progetto_Stabile/ritual_spotter.py
+"""
+Riconoscimento locale delle frasi rituali sul flusso del microfono.
+
+Niente cloud: MFCC calcolati in numpy e confronto con registrazioni di esempio
+(template) tramite DTW a sottosequenza. Gira su un thread suo, in parallelo allo
+streaming verso ElevenLabs, e scatta entro ~100 ms dalla fine della frase.
+
+Per registrare i template di un rituale:
+    python ritual_spotter.py --record tempesta --takes 3 --out rituali/tempesta
+"""
+import argparse
+import glob
+import logging
+import os
+import queue
+import threading
+import time
+import wave
+
+import numpy as np
+
+import metrics
+
+logger = logging.getLogger("RitualSpotter")
+
+SAMPLE_RATE = 16000
+FRAME_MS = 25
+HOP_MS = 10
+N_FFT = 512
+N_MELS = 26
+N_MFCC = 13
+# Ogni quanti frame nuovi si rifà il confronto (5 x 10 ms = 50 ms)
+CHECK_EVERY_FRAMES = 5
+# Distanza media per frame sotto la quale la frase è riconosciuta, se c'è un solo template
+DEFAULT_THRESHOLD = 3.0
+# Con più template la soglia si ricava da quanto differiscono tra loro le registrazioni
+AUTO_THRESHOLD_FACTOR = 1.5
+# Dopo un rituale ignoriamo il microfono per un po': niente doppi scatti
+COOLDOWN_S = 1.5
+# Sotto questa energia (dB rispetto al fondo scala) la finestra è silenzio e il DTW non serve
+SILENCE_DBFS = -50.0
+# Blocchi del microfono in attesa del DTW: oltre, i più vecchi si scartano (meglio perdere audio che restare indietro)
+MAX_PENDING_BLOCKS = 50
+
+DETECTION_LATENCY = metrics.registry.histogram(
+    "rumbtide_ritual_detection_seconds", "Tempo tra l'arrivo dell'audio che chiude la frase e il riconoscimento.",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.2, 0.5))
+RITUALS_DETECTED = metrics.registry.counter(
+    "rumbtide_rituals_total", "Frasi rituali riconosciute in locale.", ("ritual",))
+SPOTTER_CPU = metrics.registry.histogram(
+    "rumbtide_ritual_spotter_block_seconds", "Tempo di elaborazione di un blocco del microfono.",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05))
+SPOTTER_DROPPED = metrics.registry.counter(
+    "rumbtide_ritual_spotter_dropped_blocks_total", "Blocchi del microfono scartati perché lo spotter era indietro.")
+
+
+# --- MFCC vettorizzati ---
+def _mel_filterbank(rate, n_fft, n_mels):
+    def hz_to_mel(hz): return 2595 * np.log10(1 + hz / 700)
+    def mel_to_hz(mel): return 700 * (10 ** (mel / 2595) - 1)
+    points = mel_to_hz(np.linspace(hz_to_mel(0), hz_to_mel(rate / 2), n_mels + 2))
+    bins = np.floor((n_fft + 1) * points / rate).astype(int)
+    bank = np.zeros((n_mels, n_fft // 2 + 1), dtype=np.float32)
+    for m in range(1, n_mels + 1):
+        left, center, right = bins[m - 1], bins[m], bins[m + 1]
+        if center > left:
+            bank[m - 1, left:center] = (np.arange(left, center) - left) / (center - left)
+        if right > center:
+            bank[m - 1, center:right] = (right - np.arange(center, right)) / (right - center)
+    return bank
+
+
+def _dct_matrix(n_in, n_out):
+    n = np.arange(n_in)
+    # DCT-II ortonormale: le distanze non dipendono dal numero di filtri mel
+    return (np.sqrt(2 / n_in) * np.cos(np.pi / n_in * (n + 0.5) * np.arange(n_out)[:, None])).astype(np.float32)
+
+
+class MfccExtractor:
+    """MFCC in streaming: push() accetta blocchi di qualsiasi lunghezza e restituisce i frame completi."""
+
+    def __init__(self, rate=SAMPLE_RATE):
+        self.rate = rate
+        self.frame = int(rate * FRAME_MS / 1000)
+        self.hop = int(rate * HOP_MS / 1000)
+        self.window = np.hamming(self.frame).astype(np.float32)
+        self.mel = _mel_filterbank(rate, N_FFT, N_MELS)
+        # c0 (energia) escluso: il volume della voce non deve cambiare il confronto
+        self.dct = _dct_matrix(N_MELS, N_MFCC)[1:]
+        self._pending = np.zeros(0, dtype=np.float32)
+        self._last_sample = 0.0
+
+    def push(self, samples):
+        x = np.asarray(samples, dtype=np.float32).reshape(-1) / 32768.0
+        if not len(x):
+            return np.zeros((0, N_MFCC - 1), dtype=np.float32)
+        # Pre-enfasi continua tra un blocco e l'altro
+        emphasized = np.empty_like(x)
+        emphasized[0] = x[0] - 0.97 * self._last_sample
+        emphasized[1:] = x[1:] - 0.97 * x[:-1]
+        self._last_sample = x[-1]
+        buffer = np.concatenate((self._pending, emphasized))
+        count = 0 if len(buffer) < self.frame else 1 + (len(buffer) - self.frame) // self.hop
+        self._pending = buffer[count * self.hop:]
+        if count == 0:
+            return np.zeros((0, N_MFCC - 1), dtype=np.float32)
+        frames = np.lib.stride_tricks.sliding_window_view(buffer, self.frame)[::self.hop][:count] * self.window
+        power = np.abs(np.fft.rfft(frames, N_FFT)) ** 2
+        return np.log(power @ self.mel.T + 1e-10) @ self.dct.T
+
+    def features(self, samples):
+        """MFCC di un segnale intero (template)."""
+        return MfccExtractor(self.rate).push(samples)
+
+
+def subsequence_dtw(template, window):
+    """
+    Distanza media per frame del template contro ogni punto finale della finestra.
+    Passi (1,1), (1,2) e (2,1): la frase può essere detta da metà al doppio della velocità.
+    Ogni riga si calcola in un'unica operazione numpy sulla finestra intera.
+    """
+    cost = np.sqrt(((template[:, None, :] - window[None, :, :]) ** 2).sum(axis=2))
+    inf = np.full(2, np.inf, dtype=cost.dtype)
+    before = np.full(window.shape[0], np.inf, dtype=cost.dtype)
+    # Inizio libero: la frase può cominciare in qualsiasi punto della finestra
+    previous = cost[0]
+    for i in range(1, len(template)):
+        diagonal = np.concatenate((inf[:1], previous[:-1]))
+        stretched = np.concatenate((inf, previous[:-2]))
+        compressed = np.concatenate((inf[:1], before[:-1])) + cost[i - 1]
+        before, previous = previous, cost[i] + np.minimum(np.minimum(diagonal, stretched), compressed)
+    return previous / len(template)
+
+
+# --- Rituali ---
+def _read_wav(path, rate):
+    with wave.open(path, "rb") as f:
+        if f.getsampwidth() != 2:
+            raise ValueError(f"{path}: serve un WAV PCM a 16 bit.")
+        data = np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16)
+        if f.getnchannels() > 1:
+            data = data.reshape(-1, f.getnchannels()).mean(axis=1).astype(np.int16)
+        source_rate = f.getframerate()
+    if source_rate != rate:
+        positions = np.arange(0, len(data), source_rate / rate)
+        data = np.interp(positions, np.arange(len(data)), data).astype(np.int16)
+    return data
+
+
+def auto_threshold(templates):
+    """Soglia proporzionale alla distanza massima tra le registrazioni dello stesso rituale."""
+    if len(templates) < 2:
+        return DEFAULT_THRESHOLD
+    return AUTO_THRESHOLD_FACTOR * max(subsequence_dtw(a, b).min()
+                                       for a in templates for b in templates if a is not b)
+
+
+class Ritual:
+    def __init__(self, name, templates, threshold=None, stinger=None, cues=(), announce=None):
+        self.name = name
+        self.templates = templates
+        self.threshold = threshold if threshold is not None else auto_threshold(templates)
+        # PCM16 già al sample rate dell'output, pronto per l'AudioPlayer
+        self.stinger = stinger
+        self.cues = [tuple(cue) for cue in cues]
+        self.announce = announce or f"Il mozzo ha pronunciato il rituale '{name}'."
+
+
+def load_rituals(definitions, output_rate=24000):
+    """
+    Costruisce i rituali dalla configurazione (config.RITUALS):
+    {"nome": {"templates": cartella con i WAV, "threshold": ..., "stinger": WAV, "effects": [[offset_s, comando]], "announce": testo}}
+    """
+    extractor = MfccExtractor()
+    rituals = []
+    for name, definition in definitions.items():
+        paths = sorted(glob.glob(os.path.join(definition["templates"], "*.wav")))
+        if not paths:
+            logger.warning(f"Nessun template per il rituale '{name}' in {definition['templates']}.")
+            continue
+        templates = [extractor.features(_read_wav(path, SAMPLE_RATE)) for path in paths]
+        stinger = _read_wav(definition["stinger"], output_rate).tobytes() if definition.get("stinger") else None
+        rituals.append(Ritual(name, templates, definition.get("threshold"), stinger,
+                              definition.get("effects", ()), definition.get("announce")))
+        logger.info(f"Rituale '{name}' caricato con {len(templates)} template (soglia {rituals[-1].threshold:.2f}).")
+    return rituals
+
+
+class RitualSpotter:
+    """
+    Riceve i blocchi del microfono dal callback audio (feed) e li elabora su un thread suo.
+    on_detect(ritual, latency_s) viene chiamata dal thread dello spotter.
+    """
+
+    def __init__(self, rituals, on_detect=None, rate=SAMPLE_RATE, max_pending=MAX_PENDING_BLOCKS):
+        self.rituals = rituals
+        self.on_detect = on_detect
+        self.rate = rate
+        self.mfcc = MfccExtractor(rate)
+        longest = max((len(t) for ritual in rituals for t in ritual.templates), default=0)
+        self.max_frames = 2 * longest + CHECK_EVERY_FRAMES
+        self._features = np.zeros((0, N_MFCC - 1), dtype=np.float32)
+        self._levels = np.zeros(0, dtype=np.float32)
+        self._since_check = 0
+        # Conteggio in frame audio, non in secondi: vale anche quando l'audio arriva a raffiche
+        self._cooldown_frames = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self.dropped = 0
+        self._thread = None
+
+    def feed(self, samples):
+        """Chiamabile dal callback audio: solo un put, niente calcoli."""
+        self._put((time.monotonic(), samples))
+
+    def _put(self, item):
+        """Non blocca mai: con la coda piena scarta il blocco più vecchio."""
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    dropped = self._queue.get_nowait()
+                except queue.Empty:
+                    continue
+                if dropped is None:
+                    # Lo stop non si perde: torna in fondo al posto del blocco nuovo
+                    item = None
+                    continue
+                self.dropped += 1
+                SPOTTER_DROPPED.inc()
+
+    def process(self, samples, received_at):
+        """Elabora un blocco; restituisce il rituale riconosciuto o None."""
+        started = time.perf_counter()
+        try:
+            frames = self.mfcc.push(samples)
+            if not len(frames):
+                return None
+            level = 20 * np.log10(np.sqrt(np.mean(np.square(samples, dtype=np.float32))) / 32768.0 + 1e-9)
+            self._features = np.concatenate((self._features, frames))[-self.max_frames:]
+            self._levels = np.concatenate((self._levels, np.full(len(frames), level, dtype=np.float32)))[-self.max_frames:]
+            self._since_check += len(frames)
+            if self._cooldown_frames > 0:
+                self._cooldown_frames -= len(frames)
+                return None
+            if self._since_check < CHECK_EVERY_FRAMES:
+                return None
+            new_frames, self._since_check = self._since_check, 0
+            if self._levels[-new_frames * 4:].max() < SILENCE_DBFS:
+                return None
+            ritual = self._match(new_frames)
+            if ritual is None:
+                return None
+            self._cooldown_frames = int(COOLDOWN_S * 1000 / HOP_MS)
+            self._features = self._features[:0]
+            self._levels = self._levels[:0]
+            latency = time.monotonic() - received_at
+            DETECTION_LATENCY.observe(latency)
+            RITUALS_DETECTED.inc(ritual=ritual.name)
+            logger.info(f"🔮 Rituale '{ritual.name}' riconosciuto in {latency * 1000:.0f} ms.")
+            if self.on_detect:
+                self.on_detect(ritual, latency)
+            return ritual
+        finally:
+            SPOTTER_CPU.observe(time.perf_counter() - started)
+
+    def _match(self, new_frames):
+        best, best_score = None, None
+        for ritual in self.rituals:
+            for template in ritual.templates:
+                if len(self._features) < len(template) // 2:
+                    continue
+                # Conta solo una frase che finisce nei frame appena arrivati
+                score = subsequence_dtw(template, self._features)[-new_frames:].min()
+                if score < ritual.threshold and (best_score is None or score < best_score):
+                    best, best_score = ritual, score
+        return best
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            received_at, samples = item
+            try:
+                self.process(samples, received_at)
+            except Exception as e:
+                logger.error(f"Errore nel riconoscimento dei rituali: {e}", exc_info=True)
+
+    def start(self):
+        if not self._thread or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="RitualSpotter", daemon=True)
+            self._thread.start()
+            logger.info(f"Riconoscimento locale dei rituali attivo ({len(self.rituals)} rituali).")
+
+    def stop(self):
+        if self._thread:
+            self._put(None)
+            self._thread.join(timeout=1)
+            self._thread = None
+
+
+# --- Registrazione dei template ---
+def _trim_silence(samples, rate):
+    hop = rate // 100
+    levels = np.array([np.abs(samples[i:i + hop]).mean() for i in range(0, len(samples) - hop, hop)])
+    voiced = np.flatnonzero(levels > levels.max() * 0.1)
+    if not len(voiced):
+        return samples
+    return samples[max(0, (voiced[0] - 5) * hop):(voiced[-1] + 5) * hop]
+
+
+def record_templates(name, takes, seconds, out_dir):
+    import sounddevice as sd
+
+    os.makedirs(out_dir, exist_ok=True)
+    for take in range(takes):
+        input(f"Premi Invio e pronuncia il rituale '{name}' ({take + 1}/{takes})...")
+        audio = sd.rec(int(seconds * SAMPLE_RATE), samplerate=SAMPLE_RATE, channels=1, dtype="int16")
+        sd.wait()
+        samples = _trim_silence(audio.reshape(-1), SAMPLE_RATE)
+        path = os.path.join(out_dir, f"{name}_{take + 1}.wav")
+        with wave.open(path, "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(SAMPLE_RATE)
+            f.writeframes(samples.tobytes())
+        print(f"✅ Salvato {path} ({len(samples) / SAMPLE_RATE:.2f}s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Registra i template di una frase rituale.")
+    parser.add_argument("--record", required=True, help="Nome del rituale")
+    parser.add_argument("--takes", type=int, default=3)
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--out", required=True, help="Cartella dei template")
+    args = parser.parse_args()
+    record_templates(args.record, args.takes, args.seconds, args.out)
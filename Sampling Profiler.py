@@ -0,0 +1,189 @@
+# Progetto_Stabile/sampling_profiler.py
+"""
+Profiler a campionamento da accendere a caldo, senza riavviare lo spettacolo.
+
+Un thread legge lo stack di tutti i thread (event loop, Guardiano, musica, worker degli executor)
+PROFILER_HZ volte al secondo per una finestra limitata, poi scrive un file in formato
+"collapsed stacks" da dare a flamegraph.pl o speedscope:
+
+    kill -USR2 <pid>                                   # accende per PROFILE_SECONDS (di nuovo: ferma)
+    curl 'http://127.0.0.1:9108/profile?seconds=30'    # dall'endpoint metriche, solo in locale
+    curl 'http://127.0.0.1:9108/profile/stop'
+
+In modalità "cpu" (default) ogni campione pesa i microsecondi di CPU consumati dal thread
+dall'ultimo campione: i thread fermi in attesa non compaiono e resta solo il codice caldo.
+"wall" conta invece un campione per thread, attese comprese.
+"""
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+import config
+import metrics
+
+logger = logging.getLogger("SamplingProfiler")
+
+# Finestra massima: il profiler non resta acceso per sbaglio tutta la sera
+MAX_SECONDS = 300
+# Punti in cui un thread aspetta senza lavorare (funzione, file). In modalità "cpu" un thread
+# fermo qui non sta consumando: la CPU spesa prima appartiene a un altro stack, non a questo
+IDLE_LEAVES = {("select", "selectors.py"), ("wait", "threading.py"), ("_wait_for_tstate_lock", "threading.py"),
+               ("get", "queue.py"), ("_worker", "thread.py")}
+
+PROFILES = metrics.registry.counter(
+    "rumbtide_profiles_total", "Profili a campionamento scritti, per modalità.", ("mode",))
+PROFILER_RUNNING = metrics.registry.gauge(
+    "rumbtide_profiler_running", "1 mentre il profiler a campionamento è acceso.")
+
+
+def _thread_group(name):
+    """I worker di uno stesso pool finiscono in un solo ramo (es. 'ThreadPoolExecutor-0_3' -> 'ThreadPoolExecutor-0')."""
+    return re.sub(r"_\d+$", "", name)
+
+
+class SamplingProfiler:
+    def __init__(self, directory="profili", hz=50, default_seconds=30):
+        self.directory = directory
+        self.hz = hz
+        self.default_seconds = default_seconds
+        self._thread = None
+        self._stop_event = threading.Event()
+        # Etichette "funzione (file:riga)" per code object, calcolate una volta sola
+        self._labels = {}
+        self._idle = {}
+        self.last_path = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds=None, mode="cpu"):
+        """Avvia una cattura. Restituisce False se ce n'è già una in corso."""
+        if self.running:
+            return False
+        if mode == "cpu" and not hasattr(time, "pthread_getcpuclockid"):
+            logger.warning("Tempo di CPU per thread non disponibile su questo sistema: profilo in modalità 'wall'.")
+            mode = "wall"
+        seconds = min(float(seconds or self.default_seconds), MAX_SECONDS)
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, args=(seconds, mode), name="SamplingProfiler", daemon=True)
+        self._thread.start()
+        logger.info(f"🔬 Profiler acceso per {seconds:.0f}s a {self.hz} Hz (modalità {mode}).")
+        return True
+
+    def stop(self):
+        """Chiude in anticipo la cattura in corso; il profilo raccolto fin qui viene scritto."""
+        self._stop_event.set()
+
+    def toggle(self):
+        if self.running: self.stop()
+        else: self.start()
+
+    # --- Endpoint HTTP (registrati sul MetricsServer) ---
+    def http_start(self, query):
+        try:
+            seconds = float(query.get("seconds") or self.default_seconds)
+        except ValueError:
+            return "400 Bad Request", "seconds deve essere un numero\n"
+        mode = query.get("mode", "cpu")
+        if mode not in ("cpu", "wall"):
+            return "400 Bad Request", "mode: cpu oppure wall\n"
+        if not self.start(seconds, mode):
+            return "409 Conflict", "profiler già acceso\n"
+        return "202 Accepted", f"profiler acceso per {min(seconds, MAX_SECONDS):.0f}s, output in {self.directory}/\n"
+
+    def http_stop(self, query):
+        if not self.running:
+            return "409 Conflict", f"profiler spento (ultimo profilo: {self.last_path})\n"
+        # Niente join: la scrittura finisce nel thread del profiler, l'event loop non aspetta
+        self.stop()
+        return "202 Accepted", f"profiler fermato, il profilo viene scritto in {self.directory}/\n"
+
+    def _is_idle(self, code):
+        idle = self._idle.get(code)
+        if idle is None:
+            idle = self._idle[code] = (code.co_name, os.path.basename(code.co_filename)) in IDLE_LEAVES
+        return idle
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        return label
+
+    def _run(self, seconds, mode):
+        PROFILER_RUNNING.set(1)
+        own = threading.get_ident()
+        interval = 1.0 / self.hz
+        # (gruppo del thread, stack di code object) -> peso
+        weights = {}
+        clocks, last_cpu = {}, {}
+        names, names_at = {}, 0.0
+        samples = 0
+        started_at = time.monotonic()
+        deadline = started_at + seconds
+        try:
+            while not self._stop_event.is_set() and time.monotonic() < deadline:
+                now = time.monotonic()
+                if now - names_at > 1.0 or not names_at:
+                    names = {t.ident: _thread_group(t.name) for t in threading.enumerate()}
+                    names_at = now
+                frames = sys._current_frames()
+                if not frames.keys() <= names.keys():
+                    # Thread nuovo (es. worker appena creato): il nome serve subito
+                    names_at = 0.0
+                for ident, frame in frames.items():
+                    if ident == own:
+                        continue
+                    weight = 1
+                    if mode == "cpu":
+                        try:
+                            clock = clocks.get(ident)
+                            if clock is None: clock = clocks[ident] = time.pthread_getcpuclockid(ident)
+                            cpu = time.clock_gettime_ns(clock)
+                        except OSError:
+                            # Thread appena terminato
+                            continue
+                        previous = last_cpu.get(ident)
+                        last_cpu[ident] = cpu
+                        if previous is None: continue
+                        weight = (cpu - previous) // 1000
+                        if weight <= 0 or self._is_idle(frame.f_code): continue
+                    stack = []
+                    while frame is not None:
+                        stack.append(frame.f_code)
+                        frame = frame.f_back
+                    key = (names.get(ident, str(ident)), tuple(stack))
+                    weights[key] = weights.get(key, 0) + weight
+                samples += 1
+                self._stop_event.wait(interval)
+            self.last_path = self._write(weights, mode, samples, time.monotonic() - started_at)
+        except Exception as e:
+            logger.error(f"Errore nel profiler a campionamento: {e}", exc_info=True)
+        finally:
+            PROFILER_RUNNING.set(0)
+
+    def _write(self, weights, mode, samples, elapsed):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"profile-{time.strftime('%Y%m%d-%H%M%S')}-{mode}.folded")
+        leaves = {}
+        with open(path, "w", encoding="utf-8") as f:
+            for (thread, stack), weight in sorted(weights.items(), key=lambda item: -item[1]):
+                # Lo stack è dal più interno: il formato collapsed vuole dalla radice
+                f.write(";".join([thread] + [self._label(code) for code in reversed(stack)]) + f" {weight}\n")
+                leaf = f"{thread}: {self._label(stack[0])}" if stack else thread
+                leaves[leaf] = leaves.get(leaf, 0) + weight
+        PROFILES.inc(mode=mode)
+        total = sum(leaves.values()) or 1
+        hottest = ", ".join(f"{leaf} {100 * w / total:.0f}%"
+                            for leaf, w in sorted(leaves.items(), key=lambda item: -item[1])[:5])
+        logger.info(f"🔬 Profilo scritto: {path} ({samples} campioni in {elapsed:.1f}s). Più caldi: {hottest}")
+        return path
+
+
+# Creiamo un'istanza unica che verrà usata in tutto il progetto
+profiler = SamplingProfiler(config.PROFILE_DIR or "profili", hz=config.PROFILER_HZ or 50,
+                            default_seconds=config.PROFILE_SECONDS or 30)
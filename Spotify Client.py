@@ -3,6 +3,7 @@ import logging
 import spotipy
 from spotipy.oauth2 import SpotifyOAuth
 import config
+from spotify_scheduler import SPOTIPY_OPTIONS
 
 logger = logging.getLogger("SpotifyClient")
 
@@ -17,7 +18,7 @@ try:
         open_browser=False,
         cache_path=config.SPOTIFY_CACHE_PATH
     )
-    spotify_instance = spotipy.Spotify(auth_manager=auth_manager)
+    spotify_instance = spotipy.Spotify(auth_manager=auth_manager, **SPOTIPY_OPTIONS)
     # Eseguiamo una chiamata leggera per forzare l'autenticazione all'avvio
     spotify_instance.current_user()
     logger.info("✅ Cliente Spotify Unificato inizializzato e autenticato con successo.")
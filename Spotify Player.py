@@ -3,6 +3,15 @@ import logging
 import spotipy
 from spotipy.oauth2 import SpotifyOAuth
 import config
+import metrics
+from playback_queue import PLAYBACK_ANSWERS, playback_queue
+from playback_state import playback_state, summarize
+from player_scheduler import player_scheduler
+from spotify_scheduler import SPOTIPY_OPTIONS, spotify_scheduler
+from tool_registry import tool
+
+# I comandi che cambiano canzone o stato rendono obsolete le risposte su brano corrente e successivo
+_PLAYBACK_READS = ("get_current_song", "get_next_song")
 
 logger = logging.getLogger("SpotifyPlayerControls")
 
@@ -23,17 +32,18 @@ except Exception as e:
     auth_manager = None
 
 # --- TOOL: PLAY/RESUME ---
+@tool(lane="spotify_playback", merge_key="play_state", invalidates=_PLAYBACK_READS)
 async def resume_playback():
     """Riprende la riproduzione corrente su Spotify."""
     logger.info("TOOL ESEGUITO: resume_playback")
     if not auth_manager:
         return {"status": "error", "message": "Spotify non configurato."}
     try:
-        spotify = spotipy.Spotify(auth_manager=auth_manager)
-        spotify.start_playback()
+        await player_scheduler.resume()
         logger.info("✅ COMANDO INVIATO: Riproduzione ripresa.")
         return {"status": "success", "message": "Musica ripresa."}
     except spotipy.exceptions.SpotifyException as e:
+        metrics.record_api_error("spotify", e)
         logger.error(f"Errore durante il comando di ripresa: {e.reason}")
         if e.reason == 'NO_ACTIVE_DEVICE':
             return {"status": "error", "message": "Non trovo un dispositivo attivo su cui riprendere, mozzo!"}
@@ -44,17 +54,18 @@ async def resume_playback():
 
 
 # --- TOOL: PAUSA ---
+@tool(lane="spotify_playback", merge_key="play_state", invalidates=_PLAYBACK_READS)
 async def pause_playback():
     """Mette in pausa la riproduzione corrente su Spotify."""
     logger.info("TOOL ESEGUITO: pause_playback")
     if not auth_manager:
         return {"status": "error", "message": "Spotify non configurato."}
     try:
-        spotify = spotipy.Spotify(auth_manager=auth_manager)
-        spotify.pause_playback()
+        await player_scheduler.pause()
         logger.info("✅ COMANDO INVIATO: Riproduzione messa in pausa.")
         return {"status": "success", "message": "Ok, ho messo in pausa la musica."}
     except spotipy.exceptions.SpotifyException as e:
+        metrics.record_api_error("spotify", e)
         logger.error(f"Errore durante il comando di pausa: {e.reason}")
         if e.reason == 'NO_ACTIVE_DEVICE':
             return {"status": "success", "message": "Non c'è musica da mettere in pausa, mozzo!"}
@@ -65,50 +76,59 @@ async def pause_playback():
 
 # --- TOOL: VOLUME ---
 async def _change_volume(increment: int):
-    """Funzione helper per modificare il volume."""
+    """
+    Funzione helper per modificare il volume.
+    Lo scheduler parte dal volume tracciato in locale e fonde le raffiche
+    (es. tre "volume su" di fila) in un'unica impostazione assoluta.
+    """
     if not auth_manager:
         return {"status": "error", "message": "Spotify non configurato."}
     try:
-        spotify = spotipy.Spotify(auth_manager=auth_manager)
-        playback = spotify.current_playback()
-        if not playback or not playback.get('device'):
+        new_volume = await player_scheduler.change_volume(increment)
+        if new_volume is None:
             return {"status": "success", "message": "Non c'è niente in riproduzione, quindi non posso regolare il volume."}
 
-        current_volume = playback['device']['volume_percent']
-        new_volume = max(0, min(100, current_volume + increment))
-
-        spotify.volume(new_volume)
         logger.info(f"✅ COMANDO INVIATO: Volume impostato a {new_volume}%.")
         return {"status": "success", "message": f"Fatto! Volume impostato al {new_volume}%."}
     except spotipy.exceptions.SpotifyException as e:
+        metrics.record_api_error("spotify", e)
         logger.error(f"Errore durante la modifica del volume: {e.reason}")
         return {"status": "error", "message": "Problema con Spotify durante la regolazione del volume."}
     except Exception as e:
         logger.error(f"Errore imprevisto in _change_volume: {e}", exc_info=True)
         return {"status": "error", "message": "Qualcosa è andato storto."}
 
+@tool(lane="spotify_volume", merge_key="volume")
 async def volume_up():
     """Aumenta il volume di Spotify del 30%."""
     logger.info("TOOL ESEGUITO: volume_up")
     return await _change_volume(30)
 
+@tool(lane="spotify_volume", merge_key="volume")
 async def volume_down():
     """Diminuisce il volume di Spotify del 30%."""
     logger.info("TOOL ESEGUITO: volume_down")
     return await _change_volume(-30)
 
 # --- TOOL: SKIP AVANTI E INDIETRO ---
+@tool(lane="spotify_playback", merge_key="next", invalidates=_PLAYBACK_READS)
 async def next_track():
     """Salta alla traccia successiva su Spotify."""
     logger.info("TOOL ESEGUITO: next_track")
     if not auth_manager:
         return {"status": "error", "message": "Spotify non configurato."}
     try:
-        spotify = spotipy.Spotify(auth_manager=auth_manager)
-        spotify.next_track()
+        await player_scheduler.next_track()
         logger.info("✅ COMANDO INVIATO: Saltato alla traccia successiva.")
+        upcoming = playback_queue.up_next()
+        if upcoming is not None and playback_queue.current:
+            # La coda letta in anticipo dice già cosa sta suonando adesso
+            track = playback_queue.current
+            return {"status": "success",
+                    "message": f"Aye aye! Ora suona '{track['name']}' di {track['artists'][0]['name']}."}
         return {"status": "success", "message": "Aye aye! Canzone successiva!"}
     except spotipy.exceptions.SpotifyException as e:
+        metrics.record_api_error("spotify", e)
         logger.error(f"Errore durante lo skip avanti: {e.reason}")
         if e.reason == 'NO_ACTIVE_DEVICE':
             return {"status": "success", "message": "Non c'è niente in riproduzione da saltare, mozzo!"}
@@ -117,23 +137,24 @@ async def next_track():
         logger.error(f"Errore imprevisto in next_track: {e}", exc_info=True)
         return {"status": "error", "message": "Qualcosa è andato storto."}
 
+@tool(description="Torna alla traccia precedente su Spotify.",
+      lane="spotify_playback", merge_key="previous", invalidates=_PLAYBACK_READS)
 async def previous_track():
     """
     Torna alla traccia precedente su Spotify.
-    Esegue il comando due volte per garantire il salto alla traccia precedente
-    invece di riavviare semplicemente quella corrente.
+    Se la traccia corrente è oltre i primi secondi il comando va inviato due volte,
+    altrimenti Spotify si limita a riavviarla: lo scheduler lo decide dalla
+    posizione tracciata in locale, senza rileggere lo stato.
     """
-    logger.info("TOOL ESEGUITO: previous_track (con doppio comando)")
+    logger.info("TOOL ESEGUITO: previous_track")
     if not auth_manager:
         return {"status": "error", "message": "Spotify non configurato."}
     try:
-        spotify = spotipy.Spotify(auth_manager=auth_manager)
-        # Esegui il comando due volte per forzare il salto alla traccia precedente
-        spotify.previous_track()
-        spotify.previous_track()
-        logger.info("✅ COMANDO INVIATO: Tornato alla traccia precedente (doppio tocco).")
+        presses = await player_scheduler.previous_track()
+        logger.info(f"✅ COMANDO INVIATO: Tornato alla traccia precedente ({presses} tocchi).")
         return {"status": "success", "message": "Subito! Torniamo a quella di prima."}
     except spotipy.exceptions.SpotifyException as e:
+        metrics.record_api_error("spotify", e)
         logger.error(f"Errore durante lo skip indietro: {e.reason}")
         if e.reason == 'NO_ACTIVE_DEVICE':
             return {"status": "success", "message": "Non posso tornare indietro se non stiamo andando da nessuna parte, mozzo!"}
@@ -143,38 +164,74 @@ async def previous_track():
         return {"status": "error", "message": "Qualcosa è andato storto."}
 
 # --- TOOL: RICONOSCI CANZONE ---
+def _current_song_result(snapshot):
+    if snapshot is None:
+        logger.info("Nessuna canzone attualmente in riproduzione o in coda.")
+        return {"status": "success", "message": "Al momento non c'è nessuna canzone in riproduzione, mozzo."}
+    logger.info(f"✅ Canzone corrente: '{snapshot['track']}' di {snapshot['artist']}.")
+    # RISPOSTA ASSERTIVA (come da raccomandazione ElevenLabs)
+    return {
+        "status": "CURRENT_STATE_UPDATE",
+        "message": "SISTEMA: Lo stato della riproduzione è cambiato. Le informazioni precedenti sono obsolete.",
+        "current_song": snapshot['track'],
+        "current_artist": snapshot['artist'],
+        "playback_status": "in riproduzione" if snapshot['is_playing'] else "in pausa",
+        "override_context": True
+    }
+
+@tool(cache_ttl=2.0)
 async def get_current_song():
-    """Recupera la canzone e l'artista attualmente in riproduzione su Spotify."""
-    logger.info("TOOL ESEGUITO: get_current_song (con refresh forzato)")
+    """
+    Recupera la canzone e l'artista attualmente in riproduzione su Spotify.
+    Lo stato arriva già con gli aggiornamenti di contesto: serve solo se l'utente chiede di ricontrollare.
+    """
+    logger.info("TOOL ESEGUITO: get_current_song")
     if not auth_manager:
         return {"status": "error", "message": "Spotify non configurato."}
+    local = playback_queue.now_playing()
+    if local is not None:
+        # Il Guardiano ha letto lo stato da pochi secondi: nessuna chiamata a Spotify
+        PLAYBACK_ANSWERS.inc(tool="get_current_song", source="local")
+        return _current_song_result(local["snapshot"])
+    PLAYBACK_ANSWERS.inc(tool="get_current_song", source="live")
     try:
         # **LA MODIFICA CHIAVE È QUI**
         # Creiamo un'istanza "fresca" di Spotify ogni volta per evitare la cache.
-        spotify = spotipy.Spotify(auth_manager=auth_manager)
-
-        playback = spotify.current_playback()
-        if playback and playback.get('item'): # Rimosso is_playing per avere info anche in pausa
-            track_name = playback['item']['name']
-            artist_name = playback['item']['artists'][0]['name']
-            logger.info(f"✅ Canzone corrente recuperata: '{track_name}' di {artist_name}.")
-            status_riproduzione = "in riproduzione" if playback['is_playing'] else "in pausa"
-            # RISPOSTA ASSERTIVA (come da raccomandazione ElevenLabs)
-            return {
-                "status": "CURRENT_STATE_UPDATE",
-                "message": "SISTEMA: Lo stato della riproduzione è cambiato. Le informazioni precedenti sono obsolete.",
-                "current_song": track_name,
-                "current_artist": artist_name,
-                "playback_status": status_riproduzione,
-                "override_context": True
-            }
-        else:
-            logger.info("Nessuna canzone attualmente in riproduzione o in coda.")
-            return {"status": "success", "message": "Al momento non c'è nessuna canzone in riproduzione, mozzo."}
+        spotify = spotipy.Spotify(auth_manager=auth_manager, **SPOTIPY_OPTIONS)
+
+        playback = await spotify_scheduler.call(spotify.current_playback)
+        player_scheduler.state.observe(playback)
+        playback_state.publish(playback)
+        # Rimosso is_playing per avere info anche in pausa
+        return _current_song_result(summarize(playback))
     except spotipy.exceptions.SpotifyException as e:
+        metrics.record_api_error("spotify", e)
         logger.error(f"Errore durante il recupero della canzone corrente: {e.reason}")
         return {"status": "error", "message": "Problema con Spotify."}
     except Exception as e:
         logger.error(f"Errore imprevisto in get_current_song: {e}", exc_info=True)
         return {"status": "error", "message": "Qualcosa è andato storto."}
-omar@Omar:~/ProgettoBotte/ProgettoModulare_Funzionante/Progetto_Stabile$
+
+
+# --- TOOL: PROSSIMA CANZONE ---
+@tool(cache_ttl=2.0)
+async def get_next_song():
+    """Dice quale canzone verrà dopo quella attuale, dalla coda di Spotify."""
+    logger.info("TOOL ESEGUITO: get_next_song")
+    if not auth_manager:
+        return {"status": "error", "message": "Spotify non configurato."}
+    upcoming = playback_queue.up_next()
+    if upcoming is None:
+        # Coda non ancora letta o non allineata al brano attuale: una lettura, poi si risponde
+        PLAYBACK_ANSWERS.inc(tool="get_next_song", source="live")
+        if not await playback_queue.refresh():
+            # Coda non letta: meglio un errore che una coda vuota inventata
+            return {"status": "error", "message": "Problema con Spotify."}
+        upcoming = {"track": playback_queue.upcoming[0] if playback_queue.upcoming else None}
+    else:
+        PLAYBACK_ANSWERS.inc(tool="get_next_song", source="local")
+    track = upcoming["track"]
+    if track is None:
+        return {"status": "success", "message": "Dopo questa non c'è niente in coda, mozzo."}
+    return {"status": "success", "next_song": track['name'], "next_artist": track['artists'][0]['name'],
+            "message": f"Dopo questa arriva '{track['name']}' di {track['artists'][0]['name']}."}
@@ -0,0 +1,191 @@
+# Progetto_Stabile/spotify_scheduler.py
+import asyncio
+import concurrent.futures
+import itertools
+import logging
+import queue
+import threading
+import time
+
+import spotipy
+
+import metrics
+
+logger = logging.getLogger("SpotifyScheduler")
+
+# --- Priorità: i comandi dell'utente passano sempre prima del polling ---
+PRIORITY_USER = 0
+PRIORITY_BACKGROUND = 1
+
+# Spotify non pubblica un limite esatto (finestra mobile di 30 s): restiamo prudenti
+RATE_PER_SECOND = 5.0
+BURST = 10
+# Gettoni che il polling in background non può usare: restano per i comandi vocali
+USER_RESERVED_TOKENS = 3
+MAX_RATE_LIMIT_RETRIES = 3
+DEFAULT_RETRY_AFTER_S = 1.0
+WORKERS = 4
+
+# Opzioni per i client spotipy: il 429 lo gestiamo noi (rispettando Retry-After)
+# invece di lasciare che urllib3 dorma dentro la chiamata.
+SPOTIPY_OPTIONS = {"status_forcelist": (500, 502, 503, 504), "requests_timeout": 10}
+
+QUEUE_WAIT = metrics.registry.histogram(
+    "rumbtide_spotify_queue_wait_seconds", "Attesa in coda delle richieste Spotify prima dell'invio.", ("priority",))
+RATE_LIMITED = metrics.registry.counter(
+    "rumbtide_spotify_rate_limited_total", "Risposte 429 ricevute da Spotify e ritentate.")
+QUEUE_DEPTH = metrics.registry.gauge(
+    "rumbtide_spotify_queue_depth", "Richieste Spotify in attesa.")
+
+_PRIORITY_NAMES = {PRIORITY_USER: "user", PRIORITY_BACKGROUND: "background"}
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, reserve=0):
+        """Secondi da aspettare perché ci sia un gettone oltre la riserva."""
+        self._refill()
+        missing = reserve + 1 - self.tokens
+        return max(0.0, missing / self.rate)
+
+    def consume(self):
+        self._refill()
+        self.tokens -= 1
+
+
+class _Job:
+    def __init__(self, priority, function, args, kwargs):
+        self.priority = priority
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.future = concurrent.futures.Future()
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+
+
+class SpotifyRequestScheduler:
+    """
+    Punto unico da cui passano tutte le chiamate spotipy.
+    Un thread di smistamento preleva le richieste in ordine di priorità quando il
+    token bucket lo consente e le passa a un piccolo pool che fa la chiamata HTTP.
+    Un 429 blocca tutte le richieste per il tempo indicato da Retry-After e la
+    richiesta viene rimessa in testa alla coda.
+    """
+
+    def __init__(self, rate=RATE_PER_SECOND, burst=BURST, reserved=USER_RESERVED_TOKENS, workers=WORKERS):
+        self.bucket = TokenBucket(rate, burst)
+        self.reserved = reserved
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._blocked_until = 0.0
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="SpotifyAPI")
+        self._dispatcher = None
+        self._start_lock = threading.Lock()
+        QUEUE_DEPTH.set_function(self._queue.qsize)
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._dispatch_loop, name="SpotifyScheduler", daemon=True)
+                self._dispatcher.start()
+
+    def _put(self, job, sequence=None):
+        self._queue.put((job.priority, next(self._sequence) if sequence is None else sequence, job))
+
+    def _dispatch_loop(self):
+        while True:
+            # Aspettiamo che ci sia lavoro, poi lo rimettiamo in coda: dopo l'attesa
+            # del gettone prendiamo la richiesta più urgente, anche se arrivata nel frattempo.
+            entry = self._queue.get()
+            self._queue.put(entry)
+            priority = entry[0]
+            reserve = 0 if priority == PRIORITY_USER else self.reserved
+            wait = max(self._blocked_until - time.monotonic(), self.bucket.wait_time(reserve))
+            if wait > 0:
+                time.sleep(min(wait, 0.05))
+                continue
+            priority, sequence, job = self._queue.get()
+            if priority != PRIORITY_USER and self.bucket.wait_time(self.reserved) > 0:
+                self._queue.put((priority, sequence, job))
+                continue
+            self.bucket.consume()
+            QUEUE_WAIT.observe(time.monotonic() - job.enqueued_at, priority=_PRIORITY_NAMES.get(priority, priority))
+            self._executor.submit(self._run, job, sequence)
+
+    def _run(self, job, sequence):
+        if job.future.cancelled():
+            return
+        job.attempts += 1
+        try:
+            result = job.function(*job.args, **job.kwargs)
+        except spotipy.exceptions.SpotifyException as e:
+            if e.http_status == 429 and job.attempts <= MAX_RATE_LIMIT_RETRIES:
+                retry_after = self._retry_after(e)
+                self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+                RATE_LIMITED.inc()
+                metrics.record_api_error("spotify", e)
+                logger.warning(f"Spotify ci chiede di rallentare: pausa di {retry_after:.1f}s (tentativo {job.attempts}).")
+                # Stessa sequenza: la richiesta torna in testa tra quelle della sua priorità
+                self._put(job, sequence)
+                return
+            self._settle(job, error=e)
+        except BaseException as e:
+            self._settle(job, error=e)
+        else:
+            self._settle(job, result=result)
+
+    @staticmethod
+    def _settle(job, result=None, error=None):
+        # Il chiamante può aver rinunciato (timeout) mentre la chiamata era in volo
+        try:
+            if error is not None:
+                job.future.set_exception(error)
+            else:
+                job.future.set_result(result)
+        except concurrent.futures.InvalidStateError:
+            pass
+
+    @staticmethod
+    def _retry_after(error):
+        headers = getattr(error, "headers", None) or {}
+        try:
+            return max(0.0, float(headers.get("Retry-After", DEFAULT_RETRY_AFTER_S)))
+        except (TypeError, ValueError):
+            return DEFAULT_RETRY_AFTER_S
+
+    # --- API pubblica ---
+    def submit(self, function, *args, priority=PRIORITY_USER, **kwargs):
+        """Accoda una chiamata spotipy e restituisce un concurrent.futures.Future."""
+        self._ensure_started()
+        job = _Job(priority, function, args, kwargs)
+        self._put(job)
+        return job.future
+
+    def call_sync(self, function, *args, priority=PRIORITY_USER, timeout=None, **kwargs):
+        """Versione bloccante, per i thread (Guardiano, helper sincroni)."""
+        future = self.submit(function, *args, priority=priority, **kwargs)
+        try:
+            return future.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            # Se è ancora in coda non ha più senso inviarla
+            future.cancel()
+            raise
+
+    async def call(self, function, *args, priority=PRIORITY_USER, **kwargs):
+        """Versione per l'event loop: non blocca mai il loop."""
+        return await asyncio.wrap_future(self.submit(function, *args, priority=priority, **kwargs))
+
+
+# Creiamo un'istanza unica che verrà usata in tutto il progetto
+spotify_scheduler = SpotifyRequestScheduler()
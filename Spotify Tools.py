@@ -1,13 +1,24 @@
 # Progetto_Stabile/spotify_tools.py
+import asyncio
+import contextvars
 import logging
+import time
 import spotipy
 from spotipy.oauth2 import SpotifyOAuth
 from openai import OpenAI
 import config
+import metrics
+from tool_registry import tool
+from chart_cache import ChartCache
+from spotify_scheduler import PRIORITY_BACKGROUND, PRIORITY_USER, SPOTIPY_OPTIONS, spotify_scheduler
 import re
 
 logger = logging.getLogger("SpotifyTools")
 
+# Dispositivo Spotify del barile che esegue il tool. Con più barili nello stesso processo
+# ognuno lo imposta nel proprio task; il client Spotify e il suo pool HTTP restano condivisi.
+target_device_name = contextvars.ContextVar("target_device_name", default=None)
+
 # --- Autenticazione ---
 try:
     SCOPE = "user-modify-playback-state user-read-playback-state playlist-read-private"
@@ -19,7 +30,7 @@ try:
         open_browser=False,
         cache_path=config.SPOTIFY_CACHE_PATH
     )
-    spotify = spotipy.Spotify(auth_manager=auth_manager)
+    spotify = spotipy.Spotify(auth_manager=auth_manager, **SPOTIPY_OPTIONS)
     spotify.current_user()
     logger.info("Autenticazione Spotify OAuth completata.")
 except Exception as e:
@@ -58,20 +69,20 @@ def _clean_gpt_response(response_text: str) -> str:
 def _get_target_device_id():
     # ... (invariata)
     if not spotify: return None
-    if not config.SPOTIFY_DEVICE_NAME or config.SPOTIFY_DEVICE_NAME == "...":
+    device_name = target_device_name.get() or config.SPOTIFY_DEVICE_NAME
+    if not device_name or device_name == "...":
         logger.warning("Nome del dispositivo Spotify non configurato.")
         return None
-    devices = spotify.devices()
+    devices = spotify_scheduler.call_sync(spotify.devices)
     if not devices or not devices['devices']:
         logger.error("Nessun dispositivo Spotify trovato.")
         return None
-    target_device_name = config.SPOTIFY_DEVICE_NAME.lower()
     for device in devices['devices']:
-        if device['name'].lower() == target_device_name:
+        if device['name'].lower() == device_name.lower():
             device_id = device['id']
             logger.info(f"Dispositivo target '{device['name']}' trovato con ID: {device_id}")
             return device_id
-    logger.warning(f"Dispositivo '{config.SPOTIFY_DEVICE_NAME}' non trovato. Disponibili: {[d['name'] for d in devices['devices']]}")
+    logger.warning(f"Dispositivo '{device_name}' non trovato. Disponibili: {[d['name'] for d in devices['devices']]}")
     return None
 
 # --- Funzione helper aggiornata per la ricerca e riproduzione ---
@@ -81,7 +92,7 @@ def _search_and_play_track(query: str):
         return {"status": "error", "message": "Spotify non configurato."}
     try:
         target_device_id = _get_target_device_id()
-        results = spotify.search(q=query, type='track', limit=1)
+        results = spotify_scheduler.call_sync(spotify.search, q=query, type='track', limit=1)
         tracks = results.get('tracks', {}).get('items', [])
         if not tracks:
             return {"status": "error", "message": f"Non ho trovato nulla per '{query}'."}
@@ -94,10 +105,11 @@ def _search_and_play_track(query: str):
             return {"status": "error", "message": "Non trovo un dispositivo Spotify attivo su cui riprodurre."}
 
         try:
-            spotify.start_playback(uris=[track_uri], device_id=target_device_id)
+            spotify_scheduler.call_sync(spotify.start_playback, uris=[track_uri], device_id=target_device_id)
             logger.info(f"✅ COMANDO INVIATO: Riproduzione di '{track_name}' su dispositivo ID {target_device_id}.")
             return {"status": "success", "message": f"Perfetto, ho messo in play '{track_name}' di '{artist_name}'.", "track_uri": track_uri}
         except spotipy.exceptions.SpotifyException as e:
+            metrics.record_api_error("spotify", e)
             logger.error(f"Errore durante la riproduzione: {e.reason}")
             return {"status": "error", "message": "Spotify ha rifiutato il comando. Assicurati di avere un account Premium."}
     except Exception as e:
@@ -105,7 +117,14 @@ def _search_and_play_track(query: str):
         return {"status": "error", "message": "Si è verificato un problema con Spotify."}
 
 
+# I tool di ricerca passano da OpenAI e da più chiamate Spotify: hanno bisogno di più tempo
+SEARCH_TOOL_TIMEOUT_S = 30
+_PLAYBACK_READS = ("get_current_song", "get_next_song")
+
 # --- TOOL 1: Ricerca Diretta (LOGICA DI PULIZIA AGGIUNTA) ---
+@tool(description="Riproduce una canzone dato il titolo e, se noto, l'artista.",
+      timeout=SEARCH_TOOL_TIMEOUT_S, lane="spotify_playback", invalidates=_PLAYBACK_READS,
+      params={"song_title": "Titolo della canzone", "artist": "Artista (opzionale)"})
 async def play_song_by_title_and_artist(song_title: str, artist: str = None):
     logger.info(f"TOOL: play_song_by_title_and_artist, titolo='{song_title}', artista='{artist}'")
     if not openai_client: return {"status": "error", "message": "OpenAI non configurato."}
@@ -118,17 +137,22 @@ async def play_song_by_title_and_artist(song_title: str, artist: str = None):
     )
 
     try:
-        response = openai_client.chat.completions.create(model="gpt-4o", messages=[{"role": "system", "content": "Sei un esperto di musica che ottimizza query per Spotify."}, {"role": "user", "content": prompt}], temperature=0.0)
+        # Le chiamate HTTP bloccanti girano in un thread, per non fermare l'event loop (audio e ping)
+        response = await asyncio.to_thread(openai_client.chat.completions.create, model="gpt-4o", messages=[{"role": "system", "content": "Sei un esperto di musica che ottimizza query per Spotify."}, {"role": "user", "content": prompt}], temperature=0.0)
         gpt_response = response.choices[0].message.content
         optimized_query = _clean_gpt_response(gpt_response) # <-- USA LA FUNZIONE DI PULIZIA
         logger.info(f"Query ottimizzata e pulita: '{optimized_query}'")
     except Exception as e:
+        metrics.record_api_error("openai", e)
         logger.error(f"Errore OpenAI: {e}. Uso la query originale.")
         optimized_query = f"{song_title} {artist}" if artist else song_title
 
-    return _search_and_play_track(optimized_query)
+    return await asyncio.to_thread(_search_and_play_track, optimized_query)
 
 # --- TOOL 2: Ricerca Descrittiva (LOGICA DI PULIZIA AGGIUNTA) ---
+@tool(description="Trova e riproduce una canzone a partire da una descrizione (testo, film, atmosfera).",
+      timeout=SEARCH_TOOL_TIMEOUT_S, lane="spotify_playback", invalidates=_PLAYBACK_READS,
+      params={"description": "Descrizione della canzone fatta dall'utente"})
 async def find_song_by_description(description: str):
     logger.info(f"TOOL: find_song_by_description, descrizione='{description}'")
     if not openai_client: return {"status": "error", "message": "OpenAI non configurato."}
@@ -142,7 +166,7 @@ async def find_song_by_description(description: str):
     )
 
     try:
-        response = openai_client.chat.completions.create(model="gpt-4o", messages=[{"role": "system", "content": "Sei un esperto di musica che identifica canzoni da descrizioni."}, {"role": "user", "content": prompt}], temperature=0.0)
+        response = await asyncio.to_thread(openai_client.chat.completions.create, model="gpt-4o", messages=[{"role": "system", "content": "Sei un esperto di musica che identifica canzoni da descrizioni."}, {"role": "user", "content": prompt}], temperature=0.0)
         extracted_info = response.choices[0].message.content
         logger.info(f"Informazioni estratte da GPT: '{extracted_info}'")
 
@@ -151,20 +175,23 @@ async def find_song_by_description(description: str):
 
         if not title_match or not artist_match:
             logger.warning("GPT non ha restituito il formato atteso. Tento una ricerca generica.")
-            return _search_and_play_track(description)
+            return await asyncio.to_thread(_search_and_play_track, description)
 
         extracted_title = title_match.group(1).strip()
         extracted_artist = artist_match.group(1).strip()
         search_query = f"{extracted_title} {extracted_artist}"
         logger.info(f"Query di ricerca costruita: '{search_query}'")
     except Exception as e:
+        metrics.record_api_error("openai", e)
         logger.error(f"Errore OpenAI: {e}. Uso la descrizione originale.")
         search_query = description
 
-    return _search_and_play_track(search_query)
+    return await asyncio.to_thread(_search_and_play_track, search_query)
 
 
 # --- TOOL 3: Riproduci Playlist per Nome ---
+@tool(timeout=SEARCH_TOOL_TIMEOUT_S, lane="spotify_playback", invalidates=_PLAYBACK_READS,
+      params={"playlist_name": "Nome della playlist dell'utente"})
 async def play_playlist_by_name(playlist_name: str):
     """
     Cerca una playlist dell'utente per nome e la mette in riproduzione.
@@ -175,7 +202,7 @@ async def play_playlist_by_name(playlist_name: str):
 
     try:
         # Recupera tutte le playlist dell'utente loggato
-        playlists = spotify.current_user_playlists()
+        playlists = await spotify_scheduler.call(spotify.current_user_playlists)
 
         target_playlist = None
         # Cerca la playlist per nome (case-insensitive)
@@ -192,17 +219,18 @@ async def play_playlist_by_name(playlist_name: str):
         playlist_name_found = target_playlist['name']
         logger.info(f"Playlist trovata: '{playlist_name_found}' con URI: {playlist_uri}")
 
-        target_device_id = _get_target_device_id()
+        target_device_id = await asyncio.to_thread(_get_target_device_id)
         if not target_device_id:
             return {"status": "error", "message": "Non trovo un dispositivo Spotify attivo su cui riprodurre."}
 
         # Avvia la riproduzione della playlist
-        spotify.start_playback(context_uri=playlist_uri, device_id=target_device_id)
+        await spotify_scheduler.call(spotify.start_playback, context_uri=playlist_uri, device_id=target_device_id)
 
         logger.info(f"✅ COMANDO INVIATO: Riproduzione della playlist '{playlist_name_found}' avviata.")
         return {"status": "success", "message": f"Perfetto, ho messo in play la playlist '{playlist_name_found}'. All'arrembaggio!"}
 
     except spotipy.exceptions.SpotifyException as e:
+        metrics.record_api_error("spotify", e)
         logger.error(f"Errore Spotify durante la riproduzione della playlist: {e.reason}")
         return {"status": "error", "message": "Ho avuto un problema con Spotify mentre cercavo di avviare la tua playlist."}
     except Exception as e:
@@ -211,68 +239,97 @@ async def play_playlist_by_name(playlist_name: str):
 
 
 # --- TOOL 4: Riproduci Classifica (APPROCCIO TRAMITE PLAYLIST PUBBLICHE) ---
-async def play_top_charts(playlist_name: str = "Hit Del Momento 2025", owner_name: str = "peermusic"):
+async def _resolve_chart_playlist(playlist_name, owner_name, background=False):
     """
-    Approccio di fallback: Cerca una playlist pubblica di alta qualità per nome
-    (es. "Hit Del Momento 2025" di "peermusic"), e tenta di riprodurne le tracce.
-    Questo evita il blocco delle playlist editoriali di Spotify.
+    Cerca una playlist pubblica di alta qualità per nome (es. "Hit Del Momento 2025" di "peermusic")
+    e ne legge le tracce. Questo evita il blocco delle playlist editoriali di Spotify.
     """
-    logger.info(f"TOOL (Ricerca Fallback): Avvio ricerca per playlist '{playlist_name}' di '{owner_name}'.")
-    if not spotify:
-        return {"status": "error", "message": "Spotify non configurato."}
+    if not spotify: return None
+    priority = PRIORITY_BACKGROUND if background else PRIORITY_USER
+    # 1. Cerca la playlist per nome
+    results = await spotify_scheduler.call(spotify.search, q=playlist_name, type="playlist", limit=10,
+                                           priority=priority)
+    if not results or not results['playlists']['items']:
+        logger.warning(f"Nessuna playlist trovata con il nome '{playlist_name}'.")
+        return None
 
-    target_device_id = _get_target_device_id()
-    if not target_device_id:
-        return {"status": "error", "message": "Non trovo un dispositivo Spotify attivo su cui riprodurre."}
+    # 2. Filtra per trovare quella del proprietario specificato
+    target_playlist = next((p for p in results['playlists']['items']
+                            if p and p.get('owner') and p['owner']['display_name'] == owner_name), None)
+    if not target_playlist:
+        logger.warning(f"Trovate playlist chiamate '{playlist_name}', ma nessuna è di '{owner_name}'.")
+        return None
 
-    try:
-        # 1. Cerca la playlist per nome
-        results = spotify.search(q=playlist_name, type="playlist", limit=10)
+    # 3. Legge le tracce
+    playlist_id, found_name = target_playlist['id'], target_playlist['name']
+    tracks_response = await spotify_scheduler.call(spotify.playlist_tracks, playlist_id, limit=10,
+                                                   fields='items(track(uri))', priority=priority)
+    track_uris = [item['track']['uri'] for item in (tracks_response or {}).get('items', []) if item.get('track')]
+    if not track_uris:
+        logger.warning(f"La playlist '{found_name}' sembra essere vuota o illeggibile.")
+        return None
+    return {"id": playlist_id, "name": found_name, "track_uris": track_uris}
 
-        if not results or not results['playlists']['items']:
-            logger.warning(f"Nessuna playlist trovata con il nome '{playlist_name}'.")
-            return {"status": "error", "message": f"Non ho trovato nessuna playlist chiamata '{playlist_name}'."}
 
-        # 2. Filtra per trovare quella del proprietario specificato
-        target_playlist = None
-        for playlist in results['playlists']['items']:
-            if not playlist:
-                continue
+# Le classifiche risolte restano in cache e si aggiornano in background (avviata da ProcessServices)
+chart_playlists = ChartCache(_resolve_chart_playlist, refresh_s=config.CHART_REFRESH_S or 6 * 3600)
 
-            if 'owner' in playlist and playlist.get('owner') and playlist['owner']['display_name'] == owner_name:
-                target_playlist = playlist
-                break
+# Gli id dei dispositivi cambiano di rado: la classifica non paga una devices() a ogni richiesta
+DEVICE_ID_TTL_S = 300
+_device_ids = {}
 
-        if not target_playlist:
-            logger.warning(f"Trovate playlist chiamate '{playlist_name}', ma nessuna è di '{owner_name}'.")
-            return {"status": "error", "message": f"Non ho trovato la classifica '{playlist_name}' di '{owner_name}'."}
 
-        playlist_id = target_playlist['id']
-        found_name = target_playlist['name']
-        logger.info(f"Trovata playlist target: '{found_name}' (ID: {playlist_id})")
+async def _cached_target_device_id(refresh=False):
+    device_name = target_device_name.get() or config.SPOTIFY_DEVICE_NAME
+    cached = _device_ids.get(device_name)
+    if cached and cached[0] > time.monotonic() and not refresh:
+        return cached[1]
+    device_id = await asyncio.to_thread(_get_target_device_id)
+    if device_id: _device_ids[device_name] = (time.monotonic() + DEVICE_ID_TTL_S, device_id)
+    else: _device_ids.pop(device_name, None)
+    return device_id
 
-        # 3. Tenta di leggere le tracce
-        logger.info(f"Tento di leggere le tracce dalla playlist ID: {playlist_id}...")
-        tracks_response = spotify.playlist_tracks(playlist_id, limit=10, fields='items(track(uri))')
 
-        if not tracks_response or not tracks_response['items']:
-             logger.warning(f"La playlist '{found_name}' sembra essere vuota o illeggibile.")
-             return {"status": "error", "message": f"La classifica '{found_name}' è vuota o non sono riuscito a leggerla."}
+@tool(description="Riproduce le canzoni del momento da una playlist pubblica di classifica.",
+      timeout=SEARCH_TOOL_TIMEOUT_S, lane="spotify_playback", invalidates=_PLAYBACK_READS,
+      params={"playlist_name": "Nome della playlist di classifica", "owner_name": "Proprietario della playlist"})
+async def play_top_charts(playlist_name: str = "Hit Del Momento 2025", owner_name: str = "peermusic"):
+    """
+    Approccio di fallback alle playlist editoriali: una playlist pubblica di classifica,
+    già risolta in cache. Di solito costa una sola chiamata, start_playback.
+    """
+    logger.info(f"TOOL: Classifica '{playlist_name}' di '{owner_name}'.")
+    if not spotify:
+        return {"status": "error", "message": "Spotify non configurato."}
 
-        track_uris = [item['track']['uri'] for item in tracks_response['items'] if item.get('track')]
-        if not track_uris:
-            logger.warning(f"Nessuna traccia valida trovata nella playlist '{found_name}'.")
-            return {"status": "error", "message": "Non ho trovato canzoni valide nella classifica."}
+    target_device_id = await _cached_target_device_id()
+    if not target_device_id:
+        return {"status": "error", "message": "Non trovo un dispositivo Spotify attivo su cui riprodurre."}
+
+    try:
+        chart = await chart_playlists.get(playlist_name, owner_name)
+        if not chart:
+            return {"status": "error", "message": f"Non ho trovato la classifica '{playlist_name}' di '{owner_name}'."}
 
         # 4. Avvia la riproduzione
-        spotify.start_playback(uris=track_uris, device_id=target_device_id)
+        try:
+            await spotify_scheduler.call(spotify.start_playback, uris=chart['track_uris'], device_id=target_device_id)
+        except spotipy.exceptions.SpotifyException as e:
+            if e.http_status != 404: raise
+            # L'id in cache non è più valido (dispositivo riavviato): lo si cerca di nuovo, una volta
+            target_device_id = await _cached_target_device_id(refresh=True)
+            if not target_device_id: raise
+            await spotify_scheduler.call(spotify.start_playback, uris=chart['track_uris'], device_id=target_device_id)
 
-        logger.info(f"✅ COMANDO INVIATO: Riproduzione delle top 10 da '{found_name}' avviata.")
-        return {"status": "success", "message": f"Perfetto! Ecco le canzoni da '{found_name}'."}
+        logger.info(f"✅ COMANDO INVIATO: Riproduzione delle top {len(chart['track_uris'])} da '{chart['name']}' avviata.")
+        return {"status": "success", "message": f"Perfetto! Ecco le canzoni da '{chart['name']}'."}
 
     except spotipy.exceptions.SpotifyException as e:
+        metrics.record_api_error("spotify", e)
         logger.error(f"Errore Spotify: {e.reason} (Status: {e.http_status})")
         if e.http_status in [403, 404]:
+             # La classifica in cache non si può più suonare: alla prossima richiesta si risolve di nuovo
+             chart_playlists.invalidate(playlist_name, owner_name)
              return {"status": "error", "message": "Anche questa playlist è bloccata. Incredibile."}
         return {"status": "error", "message": "Ho avuto un problema con Spotify mentre cercavo la playlist."}
     except Exception as e:
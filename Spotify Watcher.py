@@ -1,8 +1,16 @@
 import logging
 import threading
 import time
+from concurrent.futures import TimeoutError as QueueTimeout
+import spotipy
+import config
 from spotify_client import get_spotify_client
 from background_music_manager import music_manager
+import metrics
+from tool_cache import tool_cache
+from player_scheduler import player_scheduler
+from spotify_scheduler import PRIORITY_BACKGROUND, spotify_scheduler
+from playback_state import playback_state
 
 logger = logging.getLogger("SpotifyWatcher")
 
@@ -13,6 +21,10 @@ class SpotifyWatcher:
         self.stop_event = threading.Event()
         self.watcher_thread = None
         self.is_spotify_playing = False
+        self.current_track_uri = None
+        # Chi suona la musica di sottofondo: pygame e/o i processi audio isolati dei barili.
+        # Vuota se SPOTIFY_PAUSES_MUSIC è spento: il Guardiano allora osserva soltanto
+        self.music_players = [music_manager] if music_manager and config.SPOTIFY_PAUSES_MUSIC else []
 
     def _watcher_loop(self):
         """Il ciclo principale che controlla lo stato di Spotify."""
@@ -21,38 +33,59 @@ class SpotifyWatcher:
             try:
                 # Controlliamo lo stato solo se il client Spotify è valido
                 if self.spotify:
-                    current_playback = self.spotify.current_playback()
+                    # Priorità bassa: il polling non deve mai rubare spazio ai comandi vocali
+                    current_playback = spotify_scheduler.call_sync(
+                        self.spotify.current_playback, priority=PRIORITY_BACKGROUND, timeout=self.interval * 5)
+                    # Lo stato letto qui tiene aggiornato anche il player locale, senza chiamate extra
+                    player_scheduler.state.observe(current_playback)
+                    # L'agente riceve i cambi di canzone senza doverli chiedere con un tool
+                    playback_state.publish(current_playback)
+                    track = current_playback.get('item') if current_playback else None
+                    track_uri = track.get('uri') if track else None
+                    if track_uri != self.current_track_uri:
+                        # Canzone cambiata (anche dal telefono): la risposta in cache è vecchia
+                        self.current_track_uri = track_uri
+                        tool_cache.invalidate("get_current_song", "get_next_song")
                     # Spotify è considerato 'attivo' se c'è una sessione di riproduzione, anche se in pausa
                     if current_playback and current_playback.get('is_playing'):
                         if not self.is_spotify_playing:
                             logger.info("Il Guardiano ha rilevato che Spotify ha iniziato a suonare.")
                             self.is_spotify_playing = True
-                            if music_manager:
-                                music_manager.pause()
+                            tool_cache.invalidate("get_current_song")
+                            for player in self.music_players: player.pause()
                     else:
                         if self.is_spotify_playing:
                             logger.info("Il Guardiano ha rilevato che Spotify ha smesso di suonare.")
                             self.is_spotify_playing = False
-                            if music_manager:
-                                music_manager.resume()
+                            tool_cache.invalidate("get_current_song")
+                            for player in self.music_players: player.resume()
 
                 else:
                     logger.warning("Il client Spotify non è disponibile per il Guardiano.")
 
+            except (QueueTimeout, spotipy.exceptions.SpotifyException) as e:
+                if isinstance(e, spotipy.exceptions.SpotifyException) and e.http_status != 429:
+                    self._handle_error(e)
+                else:
+                    # Rate limit o coda piena: non sappiamo niente di nuovo, lo stato resta com'è
+                    logger.warning("Il Guardiano salta un controllo: Spotify ci sta limitando.")
             except Exception as e:
-                # Gestiamo gli errori di rete senza bloccare il guardiano
-                logger.error(f"Errore nel Guardiano di Spotify: {e}", exc_info=False)
-                # Se c'è un errore (es. rete), consideriamo Spotify non in riproduzione
-                if self.is_spotify_playing:
-                    self.is_spotify_playing = False
-                    if music_manager:
-                        music_manager.resume()
+                self._handle_error(e)
 
             # Aspettiamo per l'intervallo specificato prima del prossimo controllo
             time.sleep(self.interval)
 
         logger.info("Il 'Guardiano' di Spotify è stato fermato.")
 
+    def _handle_error(self, e):
+        # Gestiamo gli errori di rete senza bloccare il guardiano
+        logger.error(f"Errore nel Guardiano di Spotify: {e}", exc_info=False)
+        metrics.record_api_error("spotify", e)
+        # Se c'è un errore (es. rete), consideriamo Spotify non in riproduzione
+        if self.is_spotify_playing:
+            self.is_spotify_playing = False
+            for player in self.music_players: player.resume()
+
 
     def start(self):
         """Avvia il thread del guardiano."""
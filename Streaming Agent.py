@@ -1,33 +1,97 @@
 # Progetto_Stabile/streaming_agent.py
 
 import asyncio
-import queue
+import contextlib
+import logging
 import sounddevice as sd
 import numpy as np
-from scipy.signal import resample
-import threading
 import time
 
-from elevenlabs.client import ElevenLabs
+from elevenlabs.client import AsyncElevenLabs
 
-from config import ELEVEN_API_KEY, AUDIO_CONFIG
+import metrics
+from audio_core import Capture, Playout, StreamResampler, decode, to_int16
+from config import ELEVEN_API_KEY, AUDIO_CONFIG, ELEVEN_VOICE_ID, STREAMING_TTS_MODEL, STREAMING_TTS_LATENCY
+from log_setup import RateLimited, setup_logging
+
+logger = logging.getLogger("StreamingAgent")
 
 # --- Costanti Audio ---
 INPUT_SAMPLE_RATE = AUDIO_CONFIG['input_sample_rate']
 OUTPUT_SAMPLE_RATE = AUDIO_CONFIG['output_sample_rate']
 INPUT_CHANNELS = AUDIO_CONFIG['channels']
 SILENCE_THRESHOLD_RMS = 0.01
+# Mentre il Capitano parla serve più energia per interromperlo: la sua voce rientra nel microfono
+BARGE_IN_THRESHOLD_RMS = 0.05
 SILENCE_DURATION_S = 1.0
+# Oltre questa durata la frase viene chiusa comunque (monologhi, rumore di fondo sopra soglia)
+MAX_UTTERANCE_S = 30.0
+# Ogni quanto l'audio già registrato parte verso il backend, mentre l'utente parla ancora
+STREAM_CHUNK_S = 0.25
+# Blocchi del microfono in attesa di analisi (~5s a 20 blocchi/s): oltre vengono scartati
+INPUT_QUEUE_MAX_BLOCKS = 100
+# La voce di default di client.generate, se non ne è configurata una
+DEFAULT_VOICE_ID = "EXAVITQu4vr4xnSDxMaL"
+
+TIME_TO_FIRST_AUDIO = metrics.registry.histogram(
+    "rumbtide_tts_first_audio_seconds", "Tempo tra la fine della frase dell'utente e il primo audio della risposta.")
+BARGE_INS = metrics.registry.counter(
+    "rumbtide_barge_ins_total", "Risposte interrotte perché l'utente ha ripreso a parlare.")
+
+
+class CaptureRing:
+    """
+    Buffer circolare preallocato per l'audio della frase in corso.
+    Tiene solo l'audio non ancora mandato: drain() lo copia fuori e libera subito lo spazio,
+    così la memoria resta la stessa qualunque sia la durata della frase.
+    """
+
+    def __init__(self, capacity, channels=1):
+        self._buffer = np.zeros((capacity, channels), dtype=np.float32)
+        self._start = 0
+        self._size = 0
+        # Campioni persi perché il consumatore non ha svuotato in tempo
+        self.dropped = 0
+
+    def __len__(self):
+        return self._size
+
+    def write(self, samples):
+        capacity = len(self._buffer)
+        if len(samples) > capacity:
+            self.dropped += len(samples) - capacity
+            samples = samples[-capacity:]
+        overflow = self._size + len(samples) - capacity
+        if overflow > 0:
+            # Pieno: sovrascriviamo l'audio più vecchio
+            self._start = (self._start + overflow) % capacity
+            self._size -= overflow
+            self.dropped += overflow
+        end = (self._start + self._size) % capacity
+        first = min(len(samples), capacity - end)
+        self._buffer[end:end + first] = samples[:first]
+        self._buffer[:len(samples) - first] = samples[first:]
+        self._size += len(samples)
+
+    def drain(self):
+        first = min(self._size, len(self._buffer) - self._start)
+        out = np.concatenate((self._buffer[self._start:self._start + first], self._buffer[:self._size - first]))
+        self._start, self._size = 0, 0
+        return out
+
 
 class StreamingAgent:
     def __init__(self):
-        print("🚀 Inizializzazione di StreamingAgent...")
+        logger.info("🚀 Inizializzazione di StreamingAgent...")
         if not ELEVEN_API_KEY: raise ValueError("ELEVEN_API_KEY non trovato")
-        self.client = ElevenLabs(api_key=ELEVEN_API_KEY)
+        self.client = AsyncElevenLabs(api_key=ELEVEN_API_KEY)
 
         self.is_user_speaking = False
         self.is_agent_speaking = False
         self.conversation_active = True
+        # Coroutine che riceve il PCM16 a INPUT_SAMPLE_RATE di ogni segmento: il punto in cui agganciare
+        # l'upload allo STT, che in questo agente di prova non c'è ancora (la risposta è una frase fissa)
+        self.on_segment = None
 
         try:
             sd.check_input_settings()
@@ -35,112 +99,173 @@ class StreamingAgent:
             self.input_device = sd.default.device[0]
             self.output_device = sd.default.device[1]
             self.device_sample_rate = int(sd.query_devices(self.input_device)['default_samplerate'])
-            print(f"✅ Microfono di default: {sd.query_devices(self.input_device)['name']}")
-            print(f"✅ Output di default: {sd.query_devices(self.output_device)['name']}")
+            logger.info(f"✅ Microfono di default: {sd.query_devices(self.input_device)['name']}")
+            logger.info(f"✅ Output di default: {sd.query_devices(self.output_device)['name']}")
         except Exception as e:
-            print(f"❌ Errore critico: Nessun dispositivo audio di input/output trovato. {e}")
+            logger.critical(f"❌ Nessun dispositivo audio di input/output trovato. {e}")
             raise
 
-        self.input_audio_queue = queue.Queue()
-        self.input_stream = None
-        print("✅ Agente inizializzato.")
+        self.input_audio_queue = asyncio.Queue(maxsize=INPUT_QUEUE_MAX_BLOCKS)
+        self.dropped_input_blocks = 0
+        # Diagnostica dell'RMS per blocco: al massimo una riga al secondo, e solo a livello DEBUG
+        self._rms_log = RateLimited(logger)
+        self.microphone = None
+        self.playout = Playout(OUTPUT_SAMPLE_RATE, device=self.output_device)
+        # La risposta che sta parlando: il barge-in la cancella
+        self._speaking_task = None
+        logger.info("✅ Agente inizializzato.")
 
-    def _audio_callback(self, indata, frames, time, status):
-        if status: print(f"Errore callback: {status}")
-        self.input_audio_queue.put(indata.copy())
+    def _on_mic_block(self, data):
+        try:
+            self.input_audio_queue.put_nowait(data)
+        except asyncio.QueueFull:
+            self.dropped_input_blocks += 1
 
     def start_listening(self):
-        if self.input_stream is None:
+        if self.microphone is None:
             try:
-                self.input_stream = sd.InputStream(
-                    device=self.input_device, channels=INPUT_CHANNELS,
-                    samplerate=self.device_sample_rate, callback=self._audio_callback, dtype='float32'
-                )
-                self.input_stream.start()
-                print(f"🎤 In ascolto da: {sd.query_devices(self.input_device)['name']}...")
+                self.microphone = Capture(self.device_sample_rate, self._on_mic_block, device=self.input_device,
+                                          dtype='float32')
+                self.microphone.start()
+                self.playout.start()
+                logger.info(f"🎤 In ascolto da: {sd.query_devices(self.input_device)['name']}...")
             except sd.PortAudioError as e:
-                print(f"❌ ERRORE: Impossibile usare il microfono. Un'altra applicazione potrebbe essere in esecuzione. ({e})")
+                logger.error(f"❌ Impossibile usare il microfono. Un'altra applicazione potrebbe essere in esecuzione. ({e})")
                 self.conversation_active = False
             except Exception as e:
-                print(f"❌ Errore avvio ascolto: {e}")
+                logger.error(f"❌ Errore avvio ascolto: {e}")
                 self.conversation_active = False
 
     async def listen_for_user_input(self):
         self.start_listening()
         if not self.conversation_active: return
 
-        recorded_chunks = []
+        capture = CaptureRing(int(STREAM_CHUNK_S * 4 * self.device_sample_rate), INPUT_CHANNELS)
+        segment_samples = int(STREAM_CHUNK_S * self.device_sample_rate)
+        max_utterance_samples = int(MAX_UTTERANCE_S * self.device_sample_rate)
+        # Segmenti della frase in corso verso respond_to_user; None la chiude
+        utterance = None
+        utterance_samples = 0
         silence_start_time = None
-        chunk_counter = 0
 
         while self.conversation_active:
-            try:
-                audio_chunk = self.input_audio_queue.get_nowait()
-                rms = np.sqrt(np.mean(audio_chunk**2))
-
-                # REINTRODUCIAMO IL DEBUG
-                chunk_counter += 1
-                if chunk_counter % 20 == 0: # Stampa ogni ~secondo
-                    print(f"  [DEBUG] Audio RMS: {rms:.6f}")
-
-                is_speech = rms > SILENCE_THRESHOLD_RMS
-
-                if is_speech:
-                    silence_start_time = None
-                    if not self.is_user_speaking:
-                        print("\nL'utente ha iniziato a parlare...")
-                        self.is_user_speaking = True
-                        recorded_chunks = []
-                    recorded_chunks.append(audio_chunk)
-                elif self.is_user_speaking:
-                    if silence_start_time is None:
-                        silence_start_time = time.monotonic()
-
-                    if time.monotonic() - silence_start_time > SILENCE_DURATION_S:
-                        print("L'utente ha finito di parlare.")
-                        self.is_user_speaking = False
-                        full_audio_data = np.concatenate(recorded_chunks)
-                        recorded_chunks = []
-                        asyncio.create_task(self.respond_to_user(full_audio_data))
-
-            except queue.Empty:
-                await asyncio.sleep(0.05)
+            audio_chunk = await self.input_audio_queue.get()
+            rms = np.sqrt(np.mean(audio_chunk**2))
+
+            self._rms_log.log("Audio RMS: %.6f (blocchi scartati: %d)", rms, self.dropped_input_blocks)
+
+            # Il VAD gira anche mentre il Capitano parla: è così che lo si interrompe
+            is_speech = rms > (BARGE_IN_THRESHOLD_RMS if self.is_agent_speaking else SILENCE_THRESHOLD_RMS)
 
-    async def respond_to_user(self, user_audio_data: np.ndarray):
-        print("🤖 Invio audio a ElevenLabs...")
+            if is_speech:
+                silence_start_time = None
+                if not self.is_user_speaking:
+                    logger.info("L'utente ha iniziato a parlare...")
+                    if self.is_agent_speaking: self._barge_in()
+                    self.is_user_speaking = True
+                    utterance, utterance_samples = asyncio.Queue(), 0
+                    # La risposta parte subito e riceve l'audio mentre l'utente parla
+                    asyncio.create_task(self.respond_to_user(utterance))
+                capture.write(audio_chunk)
+                utterance_samples += len(audio_chunk)
+                if len(capture) >= segment_samples:
+                    utterance.put_nowait(capture.drain())
+                if utterance_samples >= max_utterance_samples:
+                    logger.info(f"L'utente parla da più di {MAX_UTTERANCE_S:.0f}s: chiudo la frase.")
+                    self._end_utterance(capture, utterance)
+                    utterance, silence_start_time = None, None
+            elif self.is_user_speaking:
+                if silence_start_time is None:
+                    silence_start_time = time.monotonic()
+
+                if time.monotonic() - silence_start_time > SILENCE_DURATION_S:
+                    logger.info("L'utente ha finito di parlare.")
+                    self._end_utterance(capture, utterance)
+                    utterance = None
+
+    def _end_utterance(self, capture, utterance):
+        if len(capture): utterance.put_nowait(capture.drain())
+        if capture.dropped:
+            logger.warning(f"⚠️ {capture.dropped} campioni persi nella frase: il backend non ha tenuto il passo.")
+            capture.dropped = 0
+        utterance.put_nowait(None)
+        self.is_user_speaking = False
+
+    def _barge_in(self):
+        logger.info("⚡️ INTERRUZIONE!")
+        BARGE_INS.inc()
+        self.is_agent_speaking = False
+        self.playout.interrupt()
+        if self._speaking_task: self._speaking_task.cancel()
+
+    async def respond_to_user(self, utterance: asyncio.Queue):
+        logger.info("🤖 Invio audio a ElevenLabs...")
+        # Ogni segmento viene convertito e mandato appena arriva, poi rilasciato.
+        # Un solo resampler per frase: i segmenti restano un flusso continuo, senza bordi ogni STREAM_CHUNK_S
+        resampler = StreamResampler(self.device_sample_rate, INPUT_SAMPLE_RATE)
+        sent_samples = 0
+        while (segment := await utterance.get()) is not None:
+            resampled_audio = resampler.process(segment)
+            if self.on_segment:
+                await self.on_segment(to_int16(resampled_audio).tobytes())
+            sent_samples += len(resampled_audio)
+        logger.info(f"🤖 Frase inviata: {sent_samples / INPUT_SAMPLE_RATE:.1f}s di audio.")
+        utterance_ended_at = time.monotonic()
         self.is_agent_speaking = True
+        self._speaking_task = asyncio.current_task()
         try:
-            target_len = int(len(user_audio_data) * INPUT_SAMPLE_RATE / self.device_sample_rate)
-            resampled_audio = resample(user_audio_data, target_len).astype(np.float32)
-            audio_bytes = (resampled_audio * 32767).astype(np.int16).tobytes()
-
-            response_stream = self.client.generate(
-                text="Ciao! Se mi senti e io ho risposto alla tua voce, la configurazione è finalmente corretta.",
-                model="eleven_multilingual_v2", stream=True
-            )
-            print(f"▶️ Riproduzione risposta su: {sd.query_devices(self.output_device)['name']}")
-            for audio_chunk in response_stream:
-                if not self.is_agent_speaking:
-                    print("⚡️ INTERRUZIONE!")
-                    break
-                if audio_chunk:
-                    sd.play(np.frombuffer(audio_chunk, dtype=np.int16), samplerate=OUTPUT_SAMPLE_RATE, device=self.output_device)
-            sd.wait()
+            await self._speak("Ciao! Se mi senti e io ho risposto alla tua voce, la configurazione è finalmente corretta.",
+                              utterance_ended_at)
+            while self.is_agent_speaking and self.playout.is_playing():
+                await asyncio.sleep(0.05)
+        except asyncio.CancelledError:
+            logger.info("Risposta interrotta dall'utente.")
         except Exception as e:
-            print(f"❌ Errore durante la risposta: {e}")
+            logger.error(f"❌ Errore durante la risposta: {e}", exc_info=True)
         finally:
-            print("Fine risposta agente.")
-            self.is_agent_speaking = False
+            logger.info("Fine risposta agente.")
+            # Se nel frattempo è partita un'altra risposta, lo stato è suo
+            if self._speaking_task is asyncio.current_task():
+                self._speaking_task = None
+                self.is_agent_speaking = False
+
+    async def _speak(self, text, started_at):
+        """
+        Il TTS arriva in streaming dal client asincrono e ogni chunk va subito al playout:
+        l'event loop resta libero per il VAD, che può interrompere la risposta in qualunque momento.
+        """
+        stream = self.client.text_to_speech.convert_as_stream(
+            voice_id=ELEVEN_VOICE_ID or DEFAULT_VOICE_ID, text=text, model_id=STREAMING_TTS_MODEL,
+            output_format=f"pcm_{OUTPUT_SAMPLE_RATE}", optimize_streaming_latency=STREAMING_TTS_LATENCY)
+        logger.info(f"▶️ Riproduzione risposta su: {sd.query_devices(self.output_device)['name']}")
+        # I chunk HTTP non rispettano i confini dei campioni: il byte dispari passa al chunk dopo
+        leftover = b""
+        first_audio = True
+        async with contextlib.aclosing(stream):
+            async for audio_chunk in stream:
+                if not self.is_agent_speaking: break
+                data = leftover + audio_chunk
+                usable = len(data) - len(data) % 2
+                leftover = data[usable:]
+                if not usable: continue
+                if first_audio:
+                    first_audio = False
+                    elapsed = time.monotonic() - started_at
+                    TIME_TO_FIRST_AUDIO.observe(elapsed)
+                    logger.info(f"🔊 Primo audio dopo {elapsed * 1000:.0f} ms.")
+                self.playout.add_chunk(decode(data[:usable]))
 
     def stop_conversation(self):
-        print("\n🛑 Termino la conversazione...")
+        logger.info("🛑 Termino la conversazione...")
         self.conversation_active = False
-        sd.stop()
-        if self.input_stream and self.input_stream.active:
-            self.input_stream.close()
-            print("🎤 Microfono spento.")
+        if self._speaking_task: self._speaking_task.cancel()
+        self.playout.stop()
+        if self.microphone:
+            self.microphone.close()
+            self.microphone = None
 
 async def main():
+    setup_logging()
     agent = None
     try:
         agent = StreamingAgent()
@@ -148,11 +273,11 @@ async def main():
     except KeyboardInterrupt:
         pass
     except Exception as e:
-        print(f"❌ Errore critico: {e}")
+        logger.critical(f"❌ Errore critico: {e}", exc_info=True)
     finally:
         if agent:
             agent.stop_conversation()
-        print("\n👋 Addio!")
+        logger.info("👋 Addio!")
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,127 @@
+# Progetto_Stabile/supervisor.py
+"""
+Più barili da una sola macchina.
+
+Ogni barile (config.BARRELS) ha i suoi dispositivi audio, il suo agente ElevenLabs e il suo
+dispositivo Spotify; client Spotify/OpenAI, pool HTTP, cache dei tool e guardiano sono in comune.
+
+    python supervisor.py               # tutti i barili sullo stesso event loop
+    python supervisor.py --workers 2   # divisi tra 2 processi (es. una musica di sottofondo per processo)
+"""
+import argparse
+import asyncio
+import contextlib
+import logging
+import multiprocessing
+import signal
+import threading
+
+import config
+from agent import ConversationalAgent, ProcessServices
+from spotify_scheduler import BURST, RATE_PER_SECOND, USER_RESERVED_TOKENS, TokenBucket, spotify_scheduler
+
+logger = logging.getLogger("Supervisor")
+
+# Pausa prima di riavviare un barile o un processo caduto
+RESTART_DELAY = 5
+
+
+class Supervisor:
+    """Tiene in vita N barili sullo stesso event loop: se uno cade (es. microfono staccato) lo riavvia."""
+
+    def __init__(self, barrels, metrics_port=None):
+        self.barrels = barrels
+        self.services = ProcessServices(metrics_port)
+        self.agents = []
+        self._tasks = []
+        self._stopping = False
+
+    async def _keep_alive(self, barrel):
+        while not self._stopping:
+            agent = ConversationalAgent(barrel, services=False)
+            self.agents.append(agent)
+            try:
+                await agent.start()
+            except Exception as e:
+                logger.error(f"Il barile '{agent.name}' è caduto: {e}. Riavvio tra {RESTART_DELAY}s.", exc_info=True)
+            finally:
+                agent.stop()
+                self.agents.remove(agent)
+            if not self._stopping: await asyncio.sleep(RESTART_DELAY)
+
+    async def run(self):
+        self._stopping = False
+        await self.services.start()
+        logger.info(f"🛢️  Avvio di {len(self.barrels)} barili: {', '.join(b.get('NAME', '?') for b in self.barrels)}.")
+        self._tasks = [asyncio.create_task(self._keep_alive(barrel)) for barrel in self.barrels]
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stop(self):
+        self._stopping = True
+        for agent in list(self.agents): agent.stop()
+        for task in self._tasks: task.cancel()
+        self.services.stop()
+
+
+# --- Più processi ---
+async def _serve(barrels, metrics_port=None):
+    supervisor = Supervisor(barrels, metrics_port)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, supervisor.stop)
+    await supervisor.run()
+
+
+def _worker_main(barrels, index, workers):
+    # Il limite di richieste di Spotify è dell'account: ogni processo ne usa una quota
+    spotify_scheduler.bucket = TokenBucket(RATE_PER_SECOND / workers, max(BURST / workers, USER_RESERVED_TOKENS + 1))
+    metrics_port = config.METRICS_PORT + index if config.METRICS_PORT else None
+    asyncio.run(_serve(barrels, metrics_port))
+
+
+def run_workers(barrels, workers):
+    """Divide i barili tra `workers` processi e riavvia quelli che terminano."""
+    groups = [barrels[i::workers] for i in range(min(workers, len(barrels)))]
+    context = multiprocessing.get_context("spawn")
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+
+    def spawn(index):
+        process = context.Process(target=_worker_main, args=(groups[index], index, len(groups)),
+                                  name=f"barili-{index}")
+        process.start()
+        logger.info(f"Processo {process.name} (pid {process.pid}): {[b.get('NAME') for b in groups[index]]}")
+        return process
+
+    processes = [spawn(i) for i in range(len(groups))]
+    try:
+        while not stopping.wait(RESTART_DELAY):
+            for index, process in enumerate(processes):
+                if not process.is_alive():
+                    logger.warning(f"Il processo {process.name} è terminato (codice {process.exitcode}): riavvio.")
+                    processes[index] = spawn(index)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            if process.is_alive(): process.terminate()
+        for process in processes:
+            process.join(timeout=10)
+        logger.info("Tutti i processi dei barili sono fermi.")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Avvia tutti i barili di config.BARRELS.")
+    parser.add_argument("--workers", type=int, default=1, help="Processi tra cui dividere i barili")
+    args = parser.parse_args(argv)
+    if not config.BARRELS:
+        parser.error("Nessun barile in config.BARRELS.")
+    if args.workers > 1:
+        run_workers(config.BARRELS, args.workers)
+    else:
+        with contextlib.suppress(KeyboardInterrupt):
+            asyncio.run(_serve(config.BARRELS, config.METRICS_PORT))
+
+
+if __name__ == "__main__":
+    main()
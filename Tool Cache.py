@@ -0,0 +1,111 @@
+# Progetto_Stabile/tool_cache.py
+import asyncio
+import json
+import logging
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger("ToolCache")
+
+CACHE_RESULTS = metrics.registry.counter(
+    "rumbtide_tool_cache_total", "Esiti della cache dei tool (hit, miss, coalesced).", ("tool", "result"))
+
+
+class ToolCache:
+    """
+    Cache dei risultati dei tool in sola lettura, con TTL per tool e single-flight:
+    chiamate identiche mentre una è già in corso aspettano la stessa risposta.
+    I tool che modificano lo stato invalidano le voci collegate prima e dopo l'esecuzione.
+    Le politiche arrivano dal registro dei tool (decoratore @tool).
+    """
+
+    def __init__(self):
+        self.ttl = {}
+        self.invalidates = {}
+        self._entries = {}
+        self._inflight = {}
+        # Ogni invalidazione incrementa la generazione del tool: le letture partite
+        # prima non possono più scrivere in cache un risultato ormai vecchio.
+        self._generation = {}
+        self._lock = threading.Lock()
+
+    def set_policy(self, tool_name, ttl=None, invalidates=()):
+        """ttl: secondi di validità per i tool in sola lettura; invalidates: tool da invalidare."""
+        if ttl is not None:
+            self.ttl[tool_name] = ttl
+        if invalidates:
+            self.invalidates[tool_name] = tuple(invalidates)
+
+    @staticmethod
+    def _key(tool_name, parameters):
+        return tool_name, json.dumps(parameters, sort_keys=True, default=str)
+
+    def invalidate(self, *tool_names):
+        """Invalida le voci dei tool indicati. Può essere chiamata anche da altri thread."""
+        with self._lock:
+            for tool_name in tool_names:
+                self._generation[tool_name] = self._generation.get(tool_name, 0) + 1
+                for key in [k for k in self._entries if k[0] == tool_name]:
+                    del self._entries[key]
+                for key in [k for k in self._inflight if k[0] == tool_name]:
+                    del self._inflight[key]
+
+    async def run(self, tool_name, parameters, tool_function):
+        """Esegue il tool passando dalla cache quando la politica lo prevede."""
+        ttl = self.ttl.get(tool_name)
+        if ttl is None:
+            dependents = self.invalidates.get(tool_name, ())
+            self.invalidate(*dependents)
+            try:
+                return await tool_function(**parameters)
+            finally:
+                self.invalidate(*dependents)
+
+        key = self._key(tool_name, parameters)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                CACHE_RESULTS.inc(tool=tool_name, result="hit")
+                return dict(entry[1])
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                inflight = self._inflight[key] = asyncio.get_running_loop().create_future()
+                owner = True
+                generation = self._generation.get(tool_name, 0)
+            else:
+                owner = False
+
+        if not owner:
+            CACHE_RESULTS.inc(tool=tool_name, result="coalesced")
+            return dict(await asyncio.shield(inflight))
+
+        CACHE_RESULTS.inc(tool=tool_name, result="miss")
+        try:
+            result = await tool_function(**parameters)
+        except BaseException as e:
+            with self._lock:
+                if self._inflight.get(key) is inflight:
+                    del self._inflight[key]
+            if not inflight.done():
+                if isinstance(e, asyncio.CancelledError):
+                    # Chi aspettava la stessa lettura non è stato annullato: riceve un errore normale
+                    e = RuntimeError(f"Lettura di '{tool_name}' annullata.")
+                inflight.set_exception(e)
+                # L'eccezione arriva già al chiamante principale: evitiamo l'avviso "never retrieved"
+                inflight.exception()
+            raise
+
+        with self._lock:
+            if self._inflight.get(key) is inflight:
+                del self._inflight[key]
+            # Gli errori non vanno in cache, né i risultati superati da un'invalidazione
+            if result.get("status") != "error" and self._generation.get(tool_name, 0) == generation:
+                self._entries[key] = (time.monotonic() + ttl, result)
+        inflight.set_result(result)
+        return dict(result)
+
+
+# Creiamo un'istanza unica che verrà usata in tutto il progetto
+tool_cache = ToolCache()
@@ -0,0 +1,146 @@
+# Progetto_Stabile/tool_registry.py
+import asyncio
+import inspect
+import json
+import logging
+
+from tool_cache import tool_cache
+
+logger = logging.getLogger("ToolRegistry")
+
+DEFAULT_TIMEOUT_S = 10
+
+# Tipi Python -> tipi JSON dello schema dei tool di ElevenLabs
+_JSON_TYPES = {str: "string", int: "integer", float: "number", bool: "boolean"}
+_ACCEPTED_TYPES = {str: (str,), int: (int,), float: (int, float), bool: (bool,)}
+
+
+class ToolSpec:
+    """Tutto quello che serve per chiamare un tool, calcolato una volta sola alla registrazione."""
+
+    def __init__(self, function, description, timeout, cache_ttl, invalidates, lane, merge_key, param_descriptions):
+        self.name = function.__name__
+        self.function = function
+        self.description = description or inspect.getdoc(function) or ""
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.invalidates = tuple(invalidates)
+        self.lane = lane
+        self.merge_key = merge_key
+
+        # Validatore dei parametri precalcolato dalla firma
+        self.params = {}
+        self.required = set()
+        for param in inspect.signature(function).parameters.values():
+            annotation = param.annotation if param.annotation in _JSON_TYPES else str
+            self.params[param.name] = (annotation, param_descriptions.get(param.name, ""))
+            if param.default is inspect.Parameter.empty:
+                self.required.add(param.name)
+
+    def validate(self, parameters):
+        """Restituisce un messaggio d'errore se i parametri non rispettano la firma, altrimenti None."""
+        if not isinstance(parameters, dict):
+            return "I parametri devono essere un oggetto."
+        unknown = set(parameters) - set(self.params)
+        if unknown:
+            return f"Parametri non previsti: {', '.join(sorted(unknown))}."
+        # Un null esplicito non conta come parametro passato
+        missing = {name for name in self.required if parameters.get(name) is None}
+        if missing:
+            return f"Parametri mancanti: {', '.join(sorted(missing))}."
+        for name, value in parameters.items():
+            annotation = self.params[name][0]
+            # In Python bool è un int: true/false del JSON non valgono come numeri
+            if value is not None and (not isinstance(value, _ACCEPTED_TYPES[annotation])
+                                      or (annotation is not bool and isinstance(value, bool))):
+                return f"Il parametro '{name}' deve essere di tipo {_JSON_TYPES[annotation]}."
+        return None
+
+    def schema(self):
+        """Configurazione del client tool per l'agente ElevenLabs."""
+        return {
+            "type": "client",
+            "name": self.name,
+            "description": self.description,
+            "expects_response": True,
+            "response_timeout_secs": int(self.timeout),
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    name: {"type": _JSON_TYPES[annotation], "description": description}
+                    for name, (annotation, description) in self.params.items()
+                },
+                "required": sorted(self.required),
+            },
+        }
+
+
+class ToolRegistry:
+    """Registro dei tool chiamabili dall'agente: solo le funzioni decorate con @tool."""
+
+    def __init__(self):
+        self._tools = {}
+
+    def register(self, spec):
+        if spec.name in self._tools:
+            raise ValueError(f"Tool '{spec.name}' registrato due volte.")
+        self._tools[spec.name] = spec
+        tool_cache.set_policy(spec.name, ttl=spec.cache_ttl, invalidates=spec.invalidates)
+
+    def get(self, name):
+        return self._tools.get(name)
+
+    def names(self):
+        return sorted(self._tools)
+
+    async def call(self, name, parameters):
+        """
+        Valida ed esegue il tool (passando dalla cache) con il suo timeout.
+        Restituisce il risultato e la sua serializzazione JSON, calcolata una volta sola.
+        """
+        spec = self._tools.get(name)
+        if spec is None:
+            result = {"status": "error", "message": f"Tool '{name}' non trovato."}
+            return result, json.dumps(result)
+        error = spec.validate(parameters)
+        if error:
+            logger.warning(f"Parametri non validi per il tool '{name}': {error}")
+            result = {"status": "error", "message": error}
+            return result, json.dumps(result)
+        try:
+            result = await asyncio.wait_for(tool_cache.run(name, parameters, spec.function), timeout=spec.timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Il tool '{name}' non ha risposto entro {spec.timeout}s.")
+            result = {"status": "error", "message": "Il tool ci ha messo troppo a rispondere."}
+        return result, json.dumps(result)
+
+    def schema(self):
+        return [self._tools[name].schema() for name in self.names()]
+
+
+# Creiamo un'istanza unica che verrà usata in tutto il progetto
+registry = ToolRegistry()
+
+
+def tool(description=None, timeout=DEFAULT_TIMEOUT_S, cache_ttl=None, invalidates=(), lane=None, merge_key=None,
+         params=None):
+    """
+    Decoratore che registra una funzione async come tool chiamabile dall'agente.
+    cache_ttl: secondi di validità del risultato (solo tool in sola lettura).
+    invalidates: tool in cache da invalidare quando questo viene eseguito.
+    lane / merge_key: corsia seriale e chiave di fusione usate dall'agente.
+    params: descrizioni dei parametri per lo schema di ElevenLabs.
+    """
+    def decorator(function):
+        registry.register(ToolSpec(function, description, timeout, cache_ttl, invalidates, lane, merge_key,
+                                   params or {}))
+        return function
+    return decorator
+
+
+if __name__ == "__main__":
+    # Stampa lo schema dei tool da incollare nella configurazione dell'agente ElevenLabs
+    import spotify_player_controls  # noqa: F401
+    import spotify_tools  # noqa: F401
+
+    print(json.dumps(registry.schema(), indent=2, ensure_ascii=False))
@@ -0,0 +1,211 @@
+# Progetto_Stabile/voice_lines.py
+"""
+Cache locale delle battute fisse del Capitano.
+
+Molti tool rispondono sempre con le stesse frasi ("Aye aye! Canzone successiva!").
+Invece di farle sintetizzare ogni volta dal TTS nel cloud, le teniamo pronte come
+PCM16 a 24 kHz, mappate in memoria, e le suoniamo subito in locale.
+
+    python voice_lines.py --rebuild              # estrae le battute dai tool e sintetizza quelle mancanti
+    python voice_lines.py --add "Testo" take.wav # usa una registrazione (es. da una sessione passata)
+    python voice_lines.py --list
+"""
+import argparse
+import ast
+import collections
+import hashlib
+import inspect
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+
+import config
+import metrics
+from log_setup import setup_logging
+
+logger = logging.getLogger("VoiceLines")
+
+SAMPLE_RATE = 24000
+INDEX_FILE = "index.json"
+
+VOICE_LINES = metrics.registry.counter(
+    "rumbtide_voice_lines_total", "Battute dei tool cercate nella cache locale (hit, miss).", ("result",))
+
+
+def normalize(text):
+    return " ".join(text.split())
+
+
+def extract_lines(paths):
+    """
+    Le battute del Capitano: i "message" costanti dei dizionari con "status": "success".
+    Errori, messaggi per lo sviluppatore e direttive per l'LLM (es. CURRENT_STATE_UPDATE) non si dicono ad alta voce.
+    """
+    lines = set()
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            tree = ast.parse(f.read(), filename=path)
+        for node in ast.walk(tree):
+            if not isinstance(node, ast.Dict):
+                continue
+            constants = {key.value: value.value for key, value in zip(node.keys, node.values)
+                         if isinstance(key, ast.Constant) and isinstance(value, ast.Constant)}
+            if constants.get("status") == "success" and isinstance(constants.get("message"), str):
+                lines.add(normalize(constants["message"]))
+    return sorted(lines)
+
+
+class VoiceLineCache:
+    """
+    Indice testo -> file PCM. I file vengono mappati in memoria alla prima richiesta
+    e tenuti aperti al massimo in max_mapped (LRU): la RAM resta quella delle battute usate davvero.
+    """
+
+    def __init__(self, directory, max_mapped=32):
+        self.directory = directory
+        self.max_mapped = max_mapped
+        self._lock = threading.Lock()
+        self._mapped = collections.OrderedDict()
+        index_path = os.path.join(directory, INDEX_FILE)
+        self._index = {}
+        if os.path.exists(index_path):
+            with open(index_path, encoding="utf-8") as f:
+                self._index = json.load(f)
+
+    def __contains__(self, text):
+        return normalize(text) in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def lines(self):
+        return sorted(self._index)
+
+    def get(self, text):
+        """PCM16 della battuta (np.memmap, senza copie) o None se non è in cache."""
+        key = normalize(text)
+        with self._lock:
+            pcm = self._mapped.get(key)
+            if pcm is not None:
+                self._mapped.move_to_end(key)
+                VOICE_LINES.inc(result="hit")
+                return pcm
+            entry = self._index.get(key)
+            if entry is None:
+                VOICE_LINES.inc(result="miss")
+                return None
+            try:
+                pcm = np.memmap(os.path.join(self.directory, entry["file"]), dtype=np.int16, mode="r")
+            except (OSError, ValueError) as e:
+                logger.error(f"Battuta in cache illeggibile '{key}': {e}")
+                VOICE_LINES.inc(result="miss")
+                return None
+            self._mapped[key] = pcm
+            # Chi sta ancora suonando un array sfrattato lo tiene vivo: qui togliamo solo il nostro riferimento
+            while len(self._mapped) > self.max_mapped:
+                self._mapped.popitem(last=False)
+            VOICE_LINES.inc(result="hit")
+            return pcm
+
+    def add(self, text, pcm):
+        """Salva una battuta (PCM16 mono a 24 kHz) e aggiorna l'indice su disco."""
+        key = normalize(text)
+        file_name = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16] + ".pcm"
+        os.makedirs(self.directory, exist_ok=True)
+        samples = np.asarray(pcm, dtype=np.int16)
+        samples.tofile(os.path.join(self.directory, file_name))
+        with self._lock:
+            self._index[key] = {"file": file_name, "seconds": round(len(samples) / SAMPLE_RATE, 2)}
+            self._mapped.pop(key, None)
+            self._save_index()
+
+    def remove(self, text):
+        key = normalize(text)
+        with self._lock:
+            entry = self._index.pop(key, None)
+            self._mapped.pop(key, None)
+            self._save_index()
+        if entry:
+            os.remove(os.path.join(self.directory, entry["file"]))
+
+    def _save_index(self):
+        # Scrittura atomica: un indice a metà non deve mai arrivare all'agente
+        path = os.path.join(self.directory, INDEX_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self._index, f, indent=2, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+
+
+# --- Ricostruzione della cache ---
+def synthesize(text, voice_id, model_id):
+    """PCM16 a 24 kHz dal TTS di ElevenLabs, con la stessa voce dell'agente."""
+    from elevenlabs.client import ElevenLabs
+
+    client = ElevenLabs(api_key=config.ELEVEN_API_KEY)
+    audio = client.text_to_speech.convert(voice_id=voice_id, text=text, model_id=model_id,
+                                          output_format=f"pcm_{SAMPLE_RATE}")
+    return np.frombuffer(b"".join(audio), dtype=np.int16)
+
+
+def rebuild(cache, lines, voice_id, model_id, prune=False):
+    missing = [line for line in lines if line not in cache]
+    logger.info(f"{len(lines)} battute nel catalogo, {len(missing)} da sintetizzare.")
+    for line in missing:
+        try:
+            cache.add(line, synthesize(line, voice_id, model_id))
+            logger.info(f"✅ '{line}'")
+        except Exception as e:
+            logger.error(f"Sintesi fallita per '{line}': {e}")
+    if prune:
+        for line in set(cache.lines()) - set(lines):
+            cache.remove(line)
+            logger.info(f"🗑️  Rimossa battuta non più usata: '{line}'")
+
+
+def _read_wav(path):
+    import wave
+
+    with wave.open(path, "rb") as f:
+        if f.getsampwidth() != 2 or f.getnchannels() != 1:
+            raise ValueError(f"{path}: serve un WAV PCM16 mono.")
+        data = np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16)
+        rate = f.getframerate()
+    if rate != SAMPLE_RATE:
+        positions = np.arange(0, len(data), rate / SAMPLE_RATE)
+        data = np.interp(positions, np.arange(len(data)), data).astype(np.int16)
+    return data
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gestione della cache locale delle battute del Capitano.")
+    parser.add_argument("--dir", default=config.VOICE_LINES_DIR or "voice_lines")
+    parser.add_argument("--rebuild", action="store_true", help="Sintetizza le battute dei tool mancanti")
+    parser.add_argument("--prune", action="store_true", help="Con --rebuild: elimina le battute non più usate")
+    parser.add_argument("--add", nargs=2, metavar=("TESTO", "WAV"), help="Aggiunge una registrazione")
+    parser.add_argument("--list", action="store_true")
+    args = parser.parse_args(argv)
+    setup_logging()
+
+    cache = VoiceLineCache(args.dir)
+    if args.rebuild:
+        if not config.ELEVEN_VOICE_ID:
+            parser.error("Imposta ELEVEN_VOICE_ID in config.py (la voce del Capitano).")
+        # I moduli dei tool da cui estrarre le battute fisse: il file si trova da quelli importati
+        import spotify_player_controls
+        import spotify_tools
+        lines = extract_lines([inspect.getsourcefile(module) for module in (spotify_tools, spotify_player_controls)])
+        rebuild(cache, lines, config.ELEVEN_VOICE_ID, config.VOICE_LINES_MODEL_ID, prune=args.prune)
+    if args.add:
+        text, wav_path = args.add
+        cache.add(text, _read_wav(wav_path))
+        logger.info(f"✅ Aggiunta '{normalize(text)}'")
+    if args.list:
+        for line in cache.lines():
+            print(line)
+
+
+if __name__ == "__main__":
+    main()